@@ -0,0 +1,176 @@
+import functools
+import re
+import resource
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from discord import opus
+from discord.player import FFmpegPCMAudio
+
+from cogs.music.model import FFMPEG_BEFORE_OPTIONS, FFMPEG_OPUS_OPTIONS
+from cogs.music.probe import PROBE_PROFILES, select
+
+FRAME_DURATION = opus.Encoder.FRAME_LENGTH / 1000
+CHUNK_SIZE = 16 * 1024
+RANGE = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+# 配信で使われるコンテナを合成音源から作成する
+FIXTURES = {
+    "audio.webm": ["-c:a", "libopus", "-b:a", "128k"],
+    "audio.m4a": ["-c:a", "aac", "-b:a", "128k", "-movflags", "+frag_keyframe+empty_moov+default_base_moof"],
+    "audio.mp3": ["-c:a", "libmp3lame", "-b:a", "192k"],
+    "audio.ts": ["-c:a", "aac", "-b:a", "128k", "-f", "mpegts"],
+    "hls/index.m3u8": ["-c:a", "aac", "-b:a", "128k", "-f", "hls", "-hls_time", "4", "-hls_playlist_type", "vod"],
+}
+FIXTURE_SUFFIXES = (".webm", ".weba", ".opus", ".ogg", ".m4a", ".mp4", ".mp3", ".ts", ".m3u8")
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+    rate = 0.0
+    latency = 0.0
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    server: FixtureServer
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002, ARG002
+        return
+
+    def do_GET(self) -> None:
+        time.sleep(self.server.latency)  # 配信サーバーまでの往復時間を再現する
+        path = Path(self.translate_path(self.path))
+        if not path.is_file():
+            self.send_error(404)
+            return
+
+        size = path.stat().st_size
+        start, end = 0, size - 1
+        match = RANGE.match(self.headers.get("Range", ""))
+        if match is not None:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            if start > end:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+        with path.open("rb") as file:
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0 and (chunk := file.read(min(CHUNK_SIZE, remaining))):
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remaining -= len(chunk)
+                if self.server.rate > 0:
+                    time.sleep(len(chunk) / self.server.rate)
+
+
+def generate(folder: Path, duration: float) -> None:
+    source = ["-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}"]
+    source.extend(["-f", "lavfi", "-i", f"anoisesrc=duration={duration}:color=pink:amplitude=0.2"])
+    source.extend(["-filter_complex", "amix=inputs=2", "-ac", "2", "-ar", "48000"])
+    for name, options in FIXTURES.items():
+        path = folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *source, *options, str(path)]
+        subprocess.run(command, check=True)  # noqa: S603
+
+
+def discover(folder: Path) -> list[Path]:
+    paths = [*folder.glob("*"), *folder.glob("*/*.m3u8")]  # HLSのセグメントは対象外
+    return sorted(path for path in paths if path.is_file() and path.suffix in FIXTURE_SUFFIXES)
+
+
+def children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(url: str, profile: str, seconds: float) -> tuple[float | None, float]:
+    before_options = " ".join([*FFMPEG_BEFORE_OPTIONS, *PROBE_PROFILES[profile]])
+    options = " ".join(FFMPEG_OPUS_OPTIONS)
+    frames = int(seconds / FRAME_DURATION)
+    cpu_start = children_cpu()
+    start = time.perf_counter()
+
+    source = FFmpegPCMAudio(url, before_options=before_options, options=options)
+    first = None
+    count = 0
+    while count < frames and source.read():
+        if first is None:
+            first = time.perf_counter() - start
+        count += 1
+    source.cleanup()  # FFmpegの終了を待ってから子プロセスのCPU時間を取得する
+    return first, children_cpu() - cpu_start
+
+
+def benchmark(base: str, folder: Path, path: Path, runs: int, seconds: float) -> str | None:
+    url = f"{base}/{path.relative_to(folder).as_posix()}"
+    ext = path.suffix.removeprefix(".")
+    selected = select(None, "m3u8_native", None) if ext == "m3u8" else select(None, "https", ext)
+
+    best: tuple[float, str] | None = None
+    for profile in PROBE_PROFILES:
+        results = [measure(url, profile, seconds) for _ in range(runs)]
+        firsts = [first for first, _ in results if first is not None]
+        failures = runs - len(firsts)
+        cpu = statistics.mean(cpu for _, cpu in results)
+        median = statistics.median(firsts) * 1000 if firsts else float("nan")
+        worst = max(firsts) * 1000 if firsts else float("nan")
+        mark = "*" if profile == selected else ""
+        print(  # noqa: T201
+            f"{path.name:<12} {profile + mark:<8} {median:>10.1f} ms {worst:>10.1f} ms {cpu:>8.3f} s {failures:>8}",
+        )
+        if not failures and (best is None or median < best[0]):
+            best = (median, profile)
+    return best[1] if best is not None else None
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measure time to first audio frame for each FFmpeg probe profile.")
+    parser.add_argument("folder", nargs="?", type=Path, help="Folder of recorded fixtures. Generated if omitted.")
+    parser.add_argument("--generate", action="store_true", help="Generate synthetic fixtures into the folder.")
+    parser.add_argument("--duration", type=float, default=60, help="Length of generated fixtures in seconds.")
+    parser.add_argument("--seconds", type=float, default=5, help="Seconds of audio to read per run.")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per fixture and profile.")
+    parser.add_argument("--rate", type=float, default=0, help="Bandwidth limit in KiB/s. 0 for unlimited.")
+    parser.add_argument("--latency", type=float, default=0, help="Delay per HTTP request in milliseconds.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp:
+        folder: Path = args.folder or Path(temp)
+        if args.folder is None or args.generate:
+            generate(folder, args.duration)
+        fixtures = discover(folder)
+        if not fixtures:
+            raise SystemExit(f"No Fixtures Found: {folder}")
+
+        server = FixtureServer(("127.0.0.1", 0), functools.partial(FixtureHandler, directory=str(folder)))
+        server.rate = args.rate * 1024
+        server.latency = args.latency / 1000
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+
+        print(f"{'Fixture':<12} {'Profile':<8} {'Median':>13} {'Max':>13} {'CPU':>10} {'Failures':>8}")  # noqa: T201
+        recommended = {path.name: benchmark(base, folder, path, args.runs, args.seconds) for path in fixtures}
+        server.shutdown()
+
+    print("\nFastest Profile without Failures (* marks the current selection in the table above)")  # noqa: T201
+    for name, profile in recommended.items():
+        print(f"{name:<12} {profile or 'None'}")  # noqa: T201
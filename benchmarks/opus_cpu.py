@@ -0,0 +1,75 @@
+import resource
+import time
+from argparse import ArgumentParser
+from collections.abc import Callable
+
+import yt_dlp
+from discord import opus
+from discord.player import AudioSource, FFmpegOpusAudio, FFmpegPCMAudio
+
+from cogs.music import probe
+from cogs.music.model import FFMPEG_BEFORE_OPTIONS, FFMPEG_OPTIONS, FFMPEG_OPUS_OPTIONS
+from cogs.music.youtube import YTDLP_OPTIONS
+
+DEFAULT_URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+FRAME_DURATION = opus.Encoder.FRAME_LENGTH / 1000
+
+
+def children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(name: str, factory: Callable[[], AudioSource], seconds: float) -> None:
+    frames = int(seconds / FRAME_DURATION)
+    ffmpeg_start = children_cpu()
+    python_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    source = factory()
+    encoder = None if source.is_opus() else opus.Encoder()  # VoiceClientが行うエンコードも計測に含める
+    count = 0
+    while count < frames and (data := source.read()):
+        if encoder is not None:
+            encoder.encode(data, opus.Encoder.SAMPLES_PER_FRAME)
+        count += 1
+    source.cleanup()  # FFmpegの終了を待ってから子プロセスのCPU時間を取得する
+
+    audio = count * FRAME_DURATION
+    ffmpeg = children_cpu() - ffmpeg_start
+    python = time.process_time() - python_start
+    wall = time.perf_counter() - wall_start
+    usage = (ffmpeg + python) / audio * 100 if audio else 0.0
+    print(  # noqa: T201
+        f"{name:<12} {audio:>8.1f} s {ffmpeg:>8.2f} s {python:>8.2f} s {usage:>8.2f} % {wall:>8.2f} s",
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare CPU time per stream of the PCM and Opus passthrough paths.")
+    parser.add_argument("url", nargs="?", default=DEFAULT_URL, help="Video URL to extract.")
+    parser.add_argument("--seconds", type=float, default=120, help="Seconds of audio to read per path.")
+    args = parser.parse_args()
+
+    with yt_dlp.YoutubeDL(YTDLP_OPTIONS) as ydl:  # pyright: ignore[reportArgumentType]
+        info = ydl.extract_info(args.url, download=False)
+    if info is None:
+        raise SystemExit(f"No Information Extracted: {args.url}")
+    print(f"Format: {info.get('format_id')} ({info.get('acodec')}, {info.get('abr')} kbps)")  # noqa: T201
+
+    headers = "\r\n".join(f"{key}: {value}" for key, value in (info.get("http_headers") or {}).items())
+    profile = probe.select(info.get("extractor"), info.get("protocol"), info.get("ext"))
+    before_options = " ".join([*FFMPEG_BEFORE_OPTIONS, *probe.options(profile), f'-headers "{headers}"'])
+    url = info["url"]
+    filtered = " ".join(FFMPEG_OPTIONS)
+    plain = " ".join(FFMPEG_OPUS_OPTIONS)
+
+    print(f"{'Path':<12} {'Audio':>10} {'FFmpeg':>10} {'Python':>10} {'CPU':>10} {'Wall':>10}")  # noqa: T201
+    measure("PCM", lambda: FFmpegPCMAudio(url, before_options=before_options, options=filtered), args.seconds)
+    measure("PCM (no af)", lambda: FFmpegPCMAudio(url, before_options=before_options, options=plain), args.seconds)
+    if info.get("acodec") == "opus":
+        measure(
+            "Passthrough",
+            lambda: FFmpegOpusAudio(url, codec="copy", before_options=before_options, options=plain),
+            args.seconds,
+        )
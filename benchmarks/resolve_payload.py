@@ -0,0 +1,53 @@
+import pickle
+import statistics
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+import yt_dlp
+
+from cogs.music.youtube import YTDLP_OPTIONS, ResolvedInfo
+
+DEFAULT_URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+_PAYLOAD: object = None
+
+
+def _initialize(payload: object) -> None:
+    global _PAYLOAD  # noqa: PLW0603
+    _PAYLOAD = payload
+
+
+def _echo(_: int) -> object:
+    return _PAYLOAD
+
+
+def measure(name: str, payload: object, rounds: int) -> None:
+    size = len(pickle.dumps(payload))
+    with ProcessPoolExecutor(max_workers=1, initializer=_initialize, initargs=(payload,)) as executor:
+        executor.submit(_echo, 0).result()  # ワーカー起動を計測から除外
+        times = []
+        for i in range(rounds):
+            start = time.perf_counter()
+            executor.submit(_echo, i).result()
+            times.append(time.perf_counter() - start)
+
+    mean = statistics.mean(times) * 1000
+    p95 = sorted(times)[int(len(times) * 0.95)] * 1000
+    print(f"{name:<8} {size / 1024:>10.1f} KiB {mean:>10.3f} ms {p95:>10.3f} ms")  # noqa: T201
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare yt-dlp payload size and IPC round-trip time.")
+    parser.add_argument("url", nargs="?", default=DEFAULT_URL, help="Video URL to extract.")
+    parser.add_argument("--rounds", type=int, default=200, help="Number of round-trips to measure.")
+    args = parser.parse_args()
+
+    with yt_dlp.YoutubeDL(YTDLP_OPTIONS) as ydl:  # pyright: ignore[reportArgumentType]
+        info = ydl.extract_info(args.url, download=False)
+        full = ydl.sanitize_info(info)
+    compact = ResolvedInfo.from_info(full)  # pyright: ignore[reportArgumentType]
+
+    print(f"{'Payload':<8} {'Size':>14} {'Mean':>13} {'P95':>13}")  # noqa: T201
+    measure("Full", full, args.rounds)
+    measure("Compact", compact, args.rounds)
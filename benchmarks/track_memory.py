@@ -0,0 +1,109 @@
+import gc
+import tracemalloc
+from argparse import ArgumentParser
+from types import SimpleNamespace
+
+from cogs.music.model import MusicQueue, PlaylistTrack, Track, YouTubeDLPTrack
+from cogs.music.youtube import PlaylistEntry, ResolvedInfo
+
+# yt-dlpが返すヘッダーと同じく全ての曲で共通の値を使う
+HTTP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-us,en;q=0.5",
+    "Sec-Fetch-Mode": "navigate",
+}
+SOURCE_QUERY = "&".join(f"param{i}=" + "x" * 24 for i in range(24))  # 配信URLの署名などのクエリ
+
+
+def create_users(guilds: int, users: int) -> list[list[SimpleNamespace]]:
+    # Memberの代わりに曲の追加で参照する属性のみを持つオブジェクトを使う
+    return [
+        [
+            SimpleNamespace(
+                id=guild * users + user,
+                display_name=f"User {guild}-{user}",
+                display_avatar=SimpleNamespace(url=f"https://cdn.discordapp.com/avatars/{guild}/{user}.png"),
+                bot=False,
+            )
+            for user in range(users)
+        ]
+        for guild in range(guilds)
+    ]
+
+
+def create_track(kind: str, user: SimpleNamespace, index: int, channel: int) -> Track:
+    video_id = f"{index:011d}"
+    url = f"https://www.youtube.com/watch?v={video_id}"
+    uploader = f"Channel {channel}"
+    uploader_url = f"https://www.youtube.com/channel/UC{channel:022d}"
+    thumbnail = f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
+    if kind == "playlist":
+        entry = PlaylistEntry(
+            title=f"Track {index}",
+            url=url,
+            uploader=uploader,
+            uploader_url=uploader_url,
+            thumbnail=thumbnail,
+            duration=180 + index % 120,
+        )
+        return PlaylistTrack.from_entry(user, entry)  # pyright: ignore[reportArgumentType]
+
+    info = ResolvedInfo(
+        video_id=video_id,
+        title=f"Track {index}",
+        webpage_url=url,
+        uploader=uploader,
+        uploader_url=uploader_url,
+        thumbnail=thumbnail,
+        duration=180 + index % 120,
+        url=f"https://rr1---sn-example.googlevideo.com/videoplayback?id={video_id}&{SOURCE_QUERY}",
+        http_headers=HTTP_HEADERS,
+        cookies=None,
+        extractor="youtube",
+        expire=2000000000,
+        acodec="opus",
+        abr=128.0,
+        asr=48000,
+        ext="webm",
+        protocol="https",
+    )
+    return YouTubeDLPTrack.from_info(user, info)  # pyright: ignore[reportArgumentType]
+
+
+def measure(kind: str, users: list[list[SimpleNamespace]], tracks: int, channels: int) -> None:
+    gc.collect()
+    tracemalloc.start()
+    queues = []
+    index = 0
+    for guild_users in users:
+        queue = MusicQueue()
+        for i in range(tracks):
+            queue.put_nowait(create_track(kind, guild_users[i % len(guild_users)], index, index % channels))
+            index += 1
+        queues.append(queue)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = len(users) * tracks
+    print(  # noqa: T201
+        f"{kind:<9} {len(queues):>7} {total:>9} {current / 1024**2:>10.1f} MiB "
+        f"{peak / 1024**2:>10.1f} MiB {current / total:>10.0f} B",
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measure memory used per queued track across many guild queues.")
+    parser.add_argument("--guilds", type=int, default=20, help="Number of guild queues.")
+    parser.add_argument("--tracks", type=int, default=10000, help="Tracks per guild queue.")
+    parser.add_argument("--users", type=int, default=5, help="Users adding tracks in each guild.")
+    parser.add_argument("--channels", type=int, default=500, help="Distinct uploader channels.")
+    parser.add_argument("--kind", choices=["resolved", "playlist", "all"], default="all", help="Track type to queue.")
+    args = parser.parse_args()
+
+    users = create_users(args.guilds, args.users)
+    kinds = ["resolved", "playlist"] if args.kind == "all" else [args.kind]
+    print(f"{'Kind':<9} {'Guilds':>7} {'Tracks':>9} {'Current':>14} {'Peak':>14} {'Per Track':>12}")  # noqa: T201
+    for kind in kinds:
+        measure(kind, users, args.tracks, args.channels)
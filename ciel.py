@@ -76,35 +76,55 @@ class CielTree(app_commands.CommandTree):
         return self._command_map.get(command)
 
 
-class Ciel(commands.Bot):
+class Ciel(commands.AutoShardedBot):
     def __init__(
         self,
         intents: Intents | None = None,
         sync: bool = False,
         develop: bool = False,
+        *,
+        shard_ids: list[int] | None = None,
+        shard_count: int | None = None,
+        cluster_id: int | None = None,
+        cluster_count: int = 1,
         **kwargs: object,  # noqa: ARG002
     ) -> None:
         if intents is None:
             intents = Intents.default()
-        super().__init__(command_prefix="", help_command=None, tree_cls=CielTree, intents=intents)
+        super().__init__(
+            command_prefix="",
+            help_command=None,
+            tree_cls=CielTree,
+            intents=intents,
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+        )
         self.sync = sync
         self.develop = develop
         self.develop_guild = None
+        self.cluster_id = cluster_id
+        self.cluster_count = cluster_count
 
     @property
     def tree(self) -> CielTree:  # pyright: ignore[reportIncompatibleMethodOverride]
         return super().tree  # pyright: ignore[reportReturnType]
 
+    @staticmethod
+    def get_token(develop: bool = False) -> str:
+        token = os.getenv("DISCORD_TOKEN", "")
+        if develop:
+            develop_token = os.getenv("DEVELOP_DISCORD_TOKEN")
+            if develop_token is None:
+                utils.logger.warning("DEVELOP_DISCORD_TOKEN is not found while running in Develop Mode.")
+            else:
+                token = develop_token
+        return token
+
     def run(self, token: str = "", /, **kwargs: object) -> None:  # noqa: ARG002
-        utils.setup_logging(self.develop)
+        if self.cluster_id is None:  # クラスターモードではワーカー起動時にログの転送先を設定済み
+            utils.setup_logging(self.develop)
         if not token:
-            token = os.getenv("DISCORD_TOKEN", "")
-            if self.develop:
-                develop_token = os.getenv("DEVELOP_DISCORD_TOKEN")
-                if develop_token is None:
-                    utils.logger.warning("DEVELOP_DISCORD_TOKEN is not found while running in Develop Mode.")
-                else:
-                    token = develop_token
+            token = self.get_token(self.develop)
 
         super().run(token=token, log_handler=None)
 
@@ -195,7 +215,10 @@ class Ciel(commands.Bot):
     async def on_ready(self) -> None:
         user = self.user.display_name if self.user is not None else "Unknown User"
         develop = "Enabled" if self.develop else "Disabled"
-        utils.logger.info(f"Ciel Start-up (User: {user}, Develop Mode: {develop})")
+        shards = ", ".join(map(str, sorted(self.shards)))
+        utils.logger.info(
+            f"Ciel Start-up (User: {user}, Develop Mode: {develop}, Shards: {shards} / {self.shard_count})",
+        )
 
     async def on_message(self, message: Message) -> None:
         pass  # process_commands 関数を無効化
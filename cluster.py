@@ -0,0 +1,176 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from multiprocessing.context import SpawnProcess
+from multiprocessing.queues import Queue
+
+from discord import Intents
+from discord.http import HTTPClient
+
+import utils
+from ciel import Ciel
+
+CLUSTER_SHARDS = int(os.getenv("CLUSTER_SHARDS", "0"))  # 0の場合はDiscordの推奨値を使う
+CLUSTER_RESTART_DELAY = 5
+CLUSTER_RESTART_MAX_DELAY = 300
+CLUSTER_STABLE_TIME = 600  # これより長く動いていたワーカーは再起動の待ち時間をリセットする
+CLUSTER_POLL_INTERVAL = 1
+CLUSTER_STOP_TIMEOUT = 30
+IDENTIFY_INTERVAL = 5  # Gatewayへの接続はバケットごとに5秒に1回まで
+
+
+async def fetch_gateway(token: str) -> tuple[int, int]:
+    http = HTTPClient(asyncio.get_running_loop())
+    try:
+        await http.static_login(token)
+        shards, _, limit = await http.get_bot_gateway()
+    finally:
+        await http.close()
+    return shards, limit["max_concurrency"]
+
+
+def assign_shards(shard_count: int, clusters: int) -> list[list[int]]:
+    clusters = max(1, min(clusters, shard_count))
+    return [list(range(cluster_id, shard_count, clusters)) for cluster_id in range(clusters)]
+
+
+def run_worker(
+    *,
+    cluster_id: int,
+    cluster_count: int,
+    shard_ids: list[int],
+    shard_count: int,
+    queue: Queue,
+    intents: Intents,
+    sync: bool,
+    develop: bool,
+) -> None:
+    utils.setup_cluster_logging(queue, f"Cluster {cluster_id}", develop)
+    bot = Ciel(
+        intents=intents,
+        sync=sync,
+        develop=develop,
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+        cluster_id=cluster_id,
+        cluster_count=cluster_count,
+    )
+    bot.run()
+
+
+class Worker:
+    def __init__(self, cluster_id: int, shard_ids: list[int]) -> None:
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.process: SpawnProcess | None = None
+        self.started = 0.0
+        self.restarts = 0
+        self.delay = CLUSTER_RESTART_DELAY
+        self.restart_at: float | None = None
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+class Coordinator:
+    def __init__(self, clusters: int, intents: Intents, *, sync: bool = False, develop: bool = False) -> None:
+        self.clusters = clusters
+        self.intents = intents
+        self.sync = sync
+        self.develop = develop
+        self.workers: list[Worker] = []
+        self.shard_count = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._queue: Queue = self._context.Queue()
+        self._stop = threading.Event()
+
+    def start(self, worker: Worker) -> None:
+        sync = self.sync and worker.cluster_id == 0  # コマンドの同期は1つのワーカーのみで行う
+        process = self._context.Process(
+            target=run_worker,
+            kwargs={
+                "cluster_id": worker.cluster_id,
+                "cluster_count": len(self.workers),
+                "shard_ids": worker.shard_ids,
+                "shard_count": self.shard_count,
+                "queue": self._queue,
+                "intents": self.intents,
+                "sync": sync,
+                "develop": self.develop,
+            },
+            name=f"Cluster-{worker.cluster_id}",
+        )
+        process.start()
+        worker.process = process
+        worker.started = time.monotonic()
+        worker.restart_at = None
+        utils.logger.info(
+            f"Started Cluster (Cluster: {worker.cluster_id}, Shards: {worker.shard_ids}, PID: {process.pid})",
+        )
+
+    def check(self, worker: Worker) -> None:
+        now = time.monotonic()
+        if worker.restart_at is not None:
+            if now >= worker.restart_at:
+                worker.restarts += 1
+                self.start(worker)
+            return
+        if worker.process is None or worker.is_alive():
+            return
+
+        if now - worker.started > CLUSTER_STABLE_TIME:
+            worker.delay = CLUSTER_RESTART_DELAY
+        utils.logger.error(
+            f"Cluster Exited (Cluster: {worker.cluster_id}, Code: {worker.process.exitcode}, "
+            f"Restart in: {worker.delay}s, Restarts: {worker.restarts})",
+        )
+        worker.restart_at = now + worker.delay
+        worker.delay = min(worker.delay * 2, CLUSTER_RESTART_MAX_DELAY)
+
+    def stop(self) -> None:
+        utils.logger.info("Stopping Clusters")
+        for worker in self.workers:
+            if worker.process is not None and worker.process.pid is not None and worker.process.is_alive():
+                os.kill(worker.process.pid, signal.SIGINT)  # discord.pyの終了処理で切断させる
+        deadline = time.monotonic() + CLUSTER_STOP_TIMEOUT
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            worker.process.join(max(0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                utils.logger.warning(f"Killing Cluster (Cluster: {worker.cluster_id}, PID: {worker.process.pid})")
+                worker.process.kill()
+                worker.process.join()
+
+    def run(self) -> None:
+        utils.setup_logging(self.develop)
+        listener = utils.listen_cluster_logging(self._queue)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: self._stop.set())
+
+        concurrency = 1
+        self.shard_count = CLUSTER_SHARDS
+        if self.shard_count <= 0:
+            self.shard_count, concurrency = asyncio.run(fetch_gateway(Ciel.get_token(self.develop)))
+        assignments = assign_shards(self.shard_count, self.clusters)
+        self.workers = [Worker(cluster_id, shard_ids) for cluster_id, shard_ids in enumerate(assignments)]
+        utils.logger.info(f"Starting Clusters (Clusters: {len(self.workers)}, Shards: {self.shard_count})")
+
+        try:
+            for worker in self.workers:
+                if self._stop.is_set():
+                    break
+                self.start(worker)
+                # 各ワーカーのシャードがGatewayに接続し終えるまで次のワーカーの起動を待つ
+                self._stop.wait(math.ceil(len(worker.shard_ids) / concurrency) * IDENTIFY_INTERVAL)
+
+            while not self._stop.wait(CLUSTER_POLL_INTERVAL):
+                for worker in self.workers:
+                    self.check(worker)
+        finally:
+            self.stop()
+            listener.stop()
@@ -1,40 +1,55 @@
 from google.adk.agents import Agent, SequentialAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from pydantic import BaseModel, Field
 
 import utils
 
-from . import youtube
+from . import quota, youtube
 
 APP_NAME = "CielMusic"
+MIN_DURATION = 60
+MAX_DURATION = 20 * 60
 
 
-async def search_youtube(word: str) -> list[dict[str, str]]:
+def charge_gemini(callback_context: CallbackContext, llm_request: LlmRequest) -> LlmResponse | None:  # noqa: ARG001
+    quota.GEMINI.charge(quota.Cost.gemini_request, quota.Priority.background)
+    return None
+
+
+async def search_youtube(word: str) -> list[dict[str, str | int]]:
     """指定されたキーワードでYouTube上の動画を検索し、最大3件の関連性の高い動画の情報を取得する非同期関数
 
     Args:
         word (str): 検索に使用するキーワード。
 
     Returns:
-        list[dict[str, str]]: 各要素は以下のキーを持つ辞書
+        list[dict[str, str | int]]: 各要素は以下のキーを持つ辞書
             - title (str): 動画のタイトル
             - url (str): 動画のYouTubeリンク
             - channel (str): 動画を投稿したチャンネル名
             - channel_url (str): チャンネルのURL
             - thumbnail (str): 動画のサムネイル画像URL
+            - duration (int): 動画の長さ (秒)
 
     Raises:
         errors.SearchError: YouTube APIからエラーが返された場合や、検索結果が見つからなかった場合に発生。
+        errors.QuotaExceededError: 自動再生に割り当てられたYouTube Data APIのクォータが残っていない場合に発生。
 
     Note:
         - GoogleのYouTube Data API v3を利用して動画を検索します。
         - APIキーは環境変数 'GOOGLE_API_KEY' から取得します。
         - 検索結果が1件もない場合やAPIエラー時は例外を送出します。
+        - 楽曲として短すぎる・長すぎる動画や日本で再生できない動画は除外されるため、空のリストが返る場合があります。
 
     """
     utils.logger.debug(f"Searching YouTube (Query: {word})")
-    info = await youtube.search(word, results=3)
+    info = await youtube.search(word, results=3, priority=quota.Priority.background)
+    video_ids = [item["id"]["videoId"] for item in info["items"] if "videoId" in item.get("id", {})]
+    details = await youtube.videos(video_ids, priority=quota.Priority.background)
+
     items: list[dict] = []
     for item in info["items"]:
         snippet = item.get("snippet", {})
@@ -42,7 +57,14 @@ async def search_youtube(word: str) -> list[dict[str, str]]:
         channel = snippet.get("channelTitle", "")
 
         video_id = item.get("id", {}).get("videoId")
-        url = f"https://www.youtube.com/watch?v={video_id}" if video_id is not None else ""
+        video = details.get(video_id) if video_id is not None else None
+        if video is None or video.blocked or video.duration is None:
+            utils.logger.debug(f"Skipped Youtube Video (Title: {title}, Reason: Unavailable)")
+            continue
+        if not MIN_DURATION <= video.duration <= MAX_DURATION:
+            utils.logger.debug(f"Skipped Youtube Video (Title: {title}, Duration: {video.duration})")
+            continue
+        url = f"https://www.youtube.com/watch?v={video_id}"
 
         channel_id = snippet.get("channelId")
         channel_url = f"https://www.youtube.com/channel/{channel_id}" if channel_id is not None else ""
@@ -63,6 +85,7 @@ async def search_youtube(word: str) -> list[dict[str, str]]:
                 "channel": channel,
                 "channel_url": channel_url,
                 "thumbnail": thumbnail,
+                "duration": video.duration,
             },
         )
     return items
@@ -99,6 +122,7 @@ WOKER_AGENT = Agent(
 
     """,
     tools=[search_youtube],
+    before_model_callback=charge_gemini,
 )
 
 
@@ -119,6 +143,7 @@ FORMAT_AGENT = Agent(
     }
     """,
     output_schema=TrackInfo,
+    before_model_callback=charge_gemini,
     disallow_transfer_to_parent=True,
     disallow_transfer_to_peers=True,
 )
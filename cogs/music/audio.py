@@ -0,0 +1,450 @@
+import collections
+import hashlib
+import math
+import os
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import IO
+
+from discord import FFmpegOpusAudio, FFmpegPCMAudio, opus
+from discord.player import AudioSource
+
+import utils
+
+from .cache import LRUCache
+from .process import SUPERVISOR, ProcessOwner
+
+OPUS_CACHE_FOLDER = os.getenv("OPUS_CACHE_FOLDER")
+OPUS_CACHE_BYTES = int(os.getenv("OPUS_CACHE_BYTES", str(2 * 1024 * 1024 * 1024)))
+OPUS_CACHE_ENTRIES = 65536
+OPUS_CACHE_MAX_DURATION = 60 * 60
+OPUS_CACHE_COMPLETE = 0.95  # 途中で途切れたストリームを保存しないための再生率の下限
+OPUS_CACHE_SUFFIX = ".packets"
+
+FRAME_DURATION = opus.Encoder.FRAME_LENGTH / 1000
+PACKET_HEADER = struct.Struct("<H")
+
+HEALTH_COMPLETE = 0.95  # これより手前でストリームが途切れた場合はアンダーランとみなす
+HEALTH_STALL = 0.1  # 1フレームの読み込みにこれ以上かかった場合は警告を出力する
+
+
+class SupervisedPCMAudio(FFmpegPCMAudio):
+    def __init__(
+        self,
+        source: str,
+        *,
+        owner: ProcessOwner,
+        before_options: str | None = None,
+        options: str | None = None,
+    ) -> None:
+        self.owner = owner  # super().__init__でプロセスが起動されるため先に設定する
+        super().__init__(source, before_options=before_options, options=options)
+
+    def _spawn_process(self, args: list[str], **subprocess_kwargs: object) -> subprocess.Popen:
+        spawn = super()._spawn_process
+        return SUPERVISOR.spawn(self.owner, lambda: spawn(args, **subprocess_kwargs))
+
+    def cleanup(self) -> None:
+        super().cleanup()
+        SUPERVISOR.prune()
+
+
+class SupervisedOpusAudio(FFmpegOpusAudio):
+    def __init__(
+        self,
+        source: str,
+        *,
+        owner: ProcessOwner,
+        codec: str | None = None,
+        before_options: str | None = None,
+        options: str | None = None,
+    ) -> None:
+        self.owner = owner
+        super().__init__(source, codec=codec, before_options=before_options, options=options)
+
+    def _spawn_process(self, args: list[str], **subprocess_kwargs: object) -> subprocess.Popen:
+        spawn = super()._spawn_process
+        return SUPERVISOR.spawn(self.owner, lambda: spawn(args, **subprocess_kwargs))
+
+    def cleanup(self) -> None:
+        super().cleanup()
+        SUPERVISOR.prune()
+
+
+class PrebufferedAudio(AudioSource):
+    def __init__(self, source: AudioSource) -> None:
+        self.source = source
+        self._buffer: collections.deque[bytes] = collections.deque()
+
+    def fill(self, frames: int) -> None:
+        while len(self._buffer) < frames:
+            data = self.source.read()
+            if not data:
+                break
+            self._buffer.append(data)
+
+    def read(self) -> bytes:
+        if self._buffer:
+            return self._buffer.popleft()
+        return self.source.read()
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    @property
+    def _current_error(self) -> Exception | None:
+        return getattr(self.source, "_current_error", None)
+
+    def cleanup(self) -> None:
+        self._buffer.clear()
+        self.source.cleanup()
+
+
+class PlaybackHealth:
+    def __init__(self, parent: "PlaybackHealth | None" = None) -> None:
+        self.parent = parent
+        self.read_latency = utils.Histogram()
+        self.jitter = utils.LatencyRecorder()
+        self.frames = 0
+        self.late_frames = 0
+        self.underruns = 0
+        self.bytes = 0
+        self.play_time = 0.0
+        self.tracks = 0
+
+    def record_frame(self, latency: float, interval: float | None, size: int, *, late: bool) -> None:
+        self.read_latency.record(latency)
+        if interval is not None:
+            self.jitter.record(abs(interval - FRAME_DURATION))
+        self.frames += 1
+        self.late_frames += late
+        self.bytes += size
+        if self.parent is not None:
+            self.parent.record_frame(latency, interval, size, late=late)
+
+    def record_underrun(self) -> None:
+        self.underruns += 1
+        if self.parent is not None:
+            self.parent.record_underrun()
+
+    def record_track(self, play_time: float) -> None:
+        self.tracks += 1
+        self.play_time += play_time
+        if self.parent is not None:
+            self.parent.record_track(play_time)
+
+    def stats(self) -> dict[str, str]:
+        late = self.late_frames / self.frames if self.frames else 0.0
+        return {
+            "Frames": f"{self.frames} (Late: {self.late_frames}, {late:.2%}, Underruns: {self.underruns})",
+            "Read Latency": (
+                f"avg {utils.format_seconds(self.read_latency.mean)}, "
+                f"p99 {utils.format_seconds(self.read_latency.percentile(99))}, "
+                f"max {utils.format_seconds(self.read_latency.max)}"
+            ),
+            "Histogram": self.read_latency.format(),
+            "Jitter": (
+                f"p50 {utils.format_seconds(self.jitter.percentile(50))}, "
+                f"p99 {utils.format_seconds(self.jitter.percentile(99))}"
+            ),
+            "Played": (
+                f"{self.tracks} Tracks, {timedelta(seconds=int(self.play_time))}, {self.bytes / 1024 / 1024:.1f} MiB"
+            ),
+        }
+
+
+class MonitoredAudio(AudioSource):
+    def __init__(
+        self,
+        source: AudioSource,
+        health: PlaybackHealth,
+        name: str,
+        *,
+        offset: float = 0.0,
+        end: float | None = None,
+    ) -> None:
+        self.source = source
+        self.health = health
+        self.name = name
+        self.offset = offset
+        self.end = end
+        self.frames = 0
+        self.late_frames = 0
+        self.underruns = 0
+        self.max_latency = 0.0
+        self._lock = threading.Lock()
+        self._base = 0  # シーク時点でのフレーム数
+        self._started: float | None = None
+        self._last: float | None = None
+        self._ended = False
+
+    @property
+    def position(self) -> float:
+        return self.offset + (self.frames - self._base) * FRAME_DURATION
+
+    def replace(self, source: AudioSource, *, offset: float, end: float | None) -> AudioSource:
+        # 読み込み中のフレームを待ってから差し替え、古いソースは呼び出し側で後片付けする
+        with self._lock:
+            old = self.source
+            self.source = source
+            self.offset = offset
+            self.end = end
+            self._base = self.frames
+            self._ended = False
+        return old
+
+    def read(self) -> bytes:
+        with self._lock:
+            start = time.perf_counter()
+            data = self.source.read()
+            latency = time.perf_counter() - start
+        interval = start - self._last if self._last is not None else None
+        self._last = start
+        if self._started is None:
+            self._started = start
+
+        if not data:
+            if not self._ended:
+                self._ended = True
+                # 予定より早く終わった場合はFFmpegへの入力が途切れている
+                if self.end is not None and self.position < self.offset + (self.end - self.offset) * HEALTH_COMPLETE:
+                    self.underrun()
+            return data
+        if not self.is_opus() and len(data) < opus.Encoder.FRAME_SIZE:
+            self.underrun()
+
+        late = latency > FRAME_DURATION
+        self.frames += 1
+        self.late_frames += late
+        self.max_latency = max(self.max_latency, latency)
+        self.health.record_frame(latency, interval, len(data), late=late)
+        if latency > HEALTH_STALL:
+            utils.logger.warning(
+                f"Audio Read Stalled (Track: {self.name}, Frame: {self.frames}, "
+                f"Latency: {utils.format_seconds(latency)}, Load: {load_average()})",
+            )
+        return data
+
+    def underrun(self) -> None:
+        self.underruns += 1
+        self.health.record_underrun()
+        utils.logger.warning(f"Audio Underrun (Track: {self.name}, Frame: {self.frames}, Load: {load_average()})")
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    @property
+    def _current_error(self) -> Exception | None:
+        return getattr(self.source, "_current_error", None)
+
+    def cleanup(self) -> None:
+        self.source.cleanup()
+        if self._started is None or self._last is None:
+            return
+        self.health.record_track(self._last - self._started)
+        self._started = None
+
+
+def load_average() -> str:
+    if not hasattr(os, "getloadavg"):
+        return "Unknown"
+    return ", ".join(f"{load:.2f}" for load in os.getloadavg())
+
+
+class CachedOpusAudio(AudioSource):
+    def __init__(self, path: Path, cache: "OpusCache") -> None:
+        self.cache = cache
+        self._file: IO[bytes] | None = path.open("rb")
+
+    def read(self) -> bytes:
+        if self._file is None:
+            return b""
+        header = self._file.read(PACKET_HEADER.size)
+        if len(header) < PACKET_HEADER.size:
+            return b""
+        (length,) = PACKET_HEADER.unpack(header)
+        packet = self._file.read(length)
+        self.cache.served(PACKET_HEADER.size + len(packet))
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class OpusRecorder(AudioSource):
+    def __init__(self, source: AudioSource, cache: "OpusCache", key: str, duration: float) -> None:
+        self.source = source
+        self.cache = cache
+        self.key = key
+        self.duration = duration
+        self.encoder = None if source.is_opus() else opus.Encoder()
+        self.frames = 0
+        self.size = 0
+        self.completed = False
+        self._current_error: Exception | None = None
+        self._file: IO[bytes] | None = tempfile.NamedTemporaryFile(  # noqa: SIM115
+            dir=cache.folder,
+            suffix=".tmp",
+            delete=False,
+        )
+
+    def read(self) -> bytes:
+        data = self.source.read()
+        if not data:
+            self._current_error = getattr(self.source, "_current_error", None)
+            self.completed = self._current_error is None
+            return b""
+
+        # VoiceClientと同じ設定でエンコードし、送信するパケットをそのまま保存する
+        packet = data if self.encoder is None else self.encoder.encode(data, opus.Encoder.SAMPLES_PER_FRAME)
+        self.frames += 1
+        if self._file is not None:
+            try:
+                self._file.write(PACKET_HEADER.pack(len(packet)))
+                self._file.write(packet)
+                self.size += PACKET_HEADER.size + len(packet)
+            except OSError:
+                utils.logger.exception(f"Failed to Write Opus Cache (Key: {self.key})")
+                self._discard()
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def _discard(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        Path(self._file.name).unlink(missing_ok=True)
+        self._file = None
+
+    def cleanup(self) -> None:
+        self.source.cleanup()
+        if self._file is None:
+            return
+        if not self.completed or self.frames * FRAME_DURATION < self.duration * OPUS_CACHE_COMPLETE:
+            self._discard()
+            return
+
+        self._file.close()
+        self.cache.commit(self.key, Path(self._file.name), self.size)
+        self._file = None
+
+
+class OpusCache:
+    def __init__(self, folder: str | None = OPUS_CACHE_FOLDER, *, max_bytes: int = OPUS_CACHE_BYTES) -> None:
+        self.root = Path(folder) if folder is not None else None
+        self.folder = self.root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: LRUCache[str, int] = LRUCache(
+            max_entries=OPUS_CACHE_ENTRIES,
+            max_bytes=max_bytes,
+            sizeof=lambda size: size,
+            on_evict=self._evict,
+        )
+        self.recorded = 0
+        self.frames_served = 0
+        self.bytes_served = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.folder is not None and self.folder.is_dir()
+
+    def _name(self, key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+    def _path(self, name: str) -> Path:
+        return self.folder / f"{name}{OPUS_CACHE_SUFFIX}"  # pyright: ignore[reportOptionalOperand]
+
+    def _evict(self, name: str, _: int) -> None:
+        self._path(name).unlink(missing_ok=True)
+
+    def partition(self, cluster_id: int, clusters: int) -> None:
+        # クラスターモードでは各ワーカーが専用のフォルダと容量の一部を使い、書き込み途中のファイルを消し合わない
+        if self.root is None or not self.root.is_dir():
+            return
+        self.folder = self.root / f"cluster-{cluster_id}"
+        self.folder.mkdir(exist_ok=True)
+        self._entries.max_bytes = self.max_bytes // max(1, clusters)
+
+    def start(self) -> None:
+        folder = self.folder
+        if folder is None or not folder.is_dir():
+            return
+        utils.logger.debug(f"Loading Opus Cache (Folder: {folder})")
+        with self._lock:
+            self._entries.clear()
+            for path in folder.glob("*.tmp"):  # 書き込み途中で終了したファイルを削除
+                path.unlink(missing_ok=True)
+            paths = sorted(folder.glob(f"*{OPUS_CACHE_SUFFIX}"), key=lambda path: path.stat().st_mtime)
+            for path in paths:
+                self._entries.put(path.stem, path.stat().st_size, ttl=math.inf)
+
+    def open(self, key: str | None) -> CachedOpusAudio | None:
+        if key is None or not self.enabled:
+            return None
+        name = self._name(key)
+        with self._lock:
+            if self._entries.get(name) is None:
+                return None
+            path = self._path(name)
+            try:
+                source = CachedOpusAudio(path, self)
+            except OSError:
+                self._entries.pop(name)
+                return None
+        utils.logger.debug(f"Opus Cache Hit (Key: {key})")
+        return source
+
+    def __contains__(self, key: str | None) -> bool:
+        return key is not None and self.enabled and self._name(key) in self._entries
+
+    def record(self, key: str | None, source: AudioSource, duration: float | None) -> AudioSource:
+        if key is None or duration is None or duration > OPUS_CACHE_MAX_DURATION or not self.enabled:
+            return source
+        try:
+            return OpusRecorder(source, self, key, duration)
+        except (OSError, opus.OpusNotLoaded):
+            utils.logger.exception(f"Failed to Start Opus Cache (Key: {key})")
+            return source
+
+    def commit(self, key: str, path: Path, size: int) -> None:
+        name = self._name(key)
+        with self._lock:
+            try:
+                path.replace(self._path(name))
+            except OSError:
+                utils.logger.exception(f"Failed to Commit Opus Cache (Key: {key})")
+                path.unlink(missing_ok=True)
+                return
+            self._entries.put(name, size, ttl=math.inf)
+            self.recorded += 1
+        utils.logger.debug(f"Opus Cache Stored (Key: {key}, Size: {size / 1024:.0f} KiB)")
+
+    def served(self, size: int) -> None:
+        self.frames_served += 1
+        self.bytes_served += size
+
+    def stats(self) -> dict[str, str]:
+        if not self.enabled:
+            return {"Status": "Disabled"}
+        served = timedelta(seconds=int(self.frames_served * FRAME_DURATION))
+        return self._entries.stats() | {
+            "Recorded": str(self.recorded),
+            "Saved": f"{self.bytes_served / 1024 / 1024:.1f} MiB ({served} without FFmpeg)",
+        }
+
+
+OPUS_CACHE = OpusCache()
+HEALTH = PlaybackHealth()
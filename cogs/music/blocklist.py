@@ -0,0 +1,226 @@
+import itertools
+import random
+from collections.abc import Callable, Iterable, Iterator
+
+BLOCK_SIZE = 256
+
+
+class FenwickTree[N: (int, float)]:
+    # ブロックごとの要素数や重みの累積和を、値の更新と合わせてO(log n)で求める
+    def __init__(self, values: Iterable[N]) -> None:
+        self._tree: list[N] = [0, *values]  # pyright: ignore[reportAttributeAccessIssue]
+        for i in range(1, len(self._tree)):
+            parent = i + (i & -i)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self) -> int:
+        return len(self._tree) - 1
+
+    def add(self, index: int, value: N) -> None:
+        index += 1
+        while index < len(self._tree):
+            self._tree[index] += value
+            index += index & -index
+
+    def prefix(self, index: int) -> N:
+        # 先頭からindex個の値の合計
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total  # pyright: ignore[reportReturnType]
+
+    def search(self, target: N) -> tuple[int, N]:
+        # 累積和がtargetを超えない最大の個数と、その残りを返す (値が全て正の場合のみ有効)
+        index = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = index + step
+            if nxt < len(self._tree) and self._tree[nxt] <= target:
+                index = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        return index, target
+
+
+class BlockList[T]:
+    # 一定サイズのブロックに分割したリストで、任意の位置の参照・挿入・削除をブロック単位で行う
+    # ブロックの要素数と重み (曲の長さ) の合計をFenwick木で管理し、位置の検索や指定位置までの合計を高速に求める
+    # 位置の検索はO(log n)、ブロック内の挿入・削除はO(block_size)で、ブロックの分割・削除時のみ木を作り直す
+    def __init__(
+        self,
+        items: Iterable[T] = (),
+        *,
+        weight: Callable[[T], float] = lambda _: 0.0,
+        block_size: int = BLOCK_SIZE,
+    ) -> None:
+        self.weight = weight
+        self.block_size = max(2, block_size)
+        self._blocks: list[list[T]] = []
+        self._weights: list[list[float]] = []
+        self._sums: list[float] = []
+        self._length = 0
+        self._total = 0.0
+        self._lengths: FenwickTree[int] = FenwickTree(())
+        self._prefix: FenwickTree[float] = FenwickTree(())
+        self._rebuild((item, weight(item)) for item in items)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[T]:
+        return itertools.chain.from_iterable(self._blocks)
+
+    def __getitem__(self, index: int) -> T:
+        block, offset = self._locate(index)
+        return self._blocks[block][offset]
+
+    def __setitem__(self, index: int, item: T) -> None:
+        block, offset = self._locate(index)
+        weight = self.weight(item)
+        self._adjust(block, weight - self._weights[block][offset])
+        self._blocks[block][offset] = item
+        self._weights[block][offset] = weight
+
+    def __delitem__(self, index: int) -> None:
+        self.pop(index)
+
+    def reweight(self, index: int) -> None:
+        # 要素の中身が変わって重みが変化した場合に計算し直す
+        self[index] = self[index]
+
+    @property
+    def total(self) -> float:
+        return self._total
+
+    def weight_before(self, index: int) -> float:
+        if index >= self._length:
+            return self._total
+        block, offset = self._locate(index)
+        return self._prefix.prefix(block) + sum(self._weights[block][:offset])
+
+    def _reindex(self) -> None:
+        # ブロックの数が変わった場合のみ作り直す
+        self._lengths = FenwickTree(len(block) for block in self._blocks)
+        self._prefix = FenwickTree(self._sums)
+
+    def _adjust(self, block: int, weight: float) -> None:
+        self._sums[block] += weight
+        self._total += weight
+        self._prefix.add(block, weight)
+
+    def _locate(self, index: int) -> tuple[int, int]:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            msg = "BlockList index out of range"
+            raise IndexError(msg)
+        return self._lengths.search(index)
+
+    def _rebuild(self, entries: Iterable[tuple[T, float]]) -> None:
+        self._blocks.clear()
+        self._weights.clear()
+        self._sums.clear()
+        self._length = 0
+        self._total = 0.0
+        for chunk in itertools.batched(entries, self.block_size, strict=False):
+            items, weights = zip(*chunk, strict=True)
+            self._blocks.append(list(items))
+            self._weights.append(list(weights))
+            self._sums.append(sum(weights))
+            self._length += len(items)
+            self._total += self._sums[-1]
+        self._reindex()
+
+    def _entries(self) -> Iterator[tuple[T, float]]:
+        return zip(self, itertools.chain.from_iterable(self._weights), strict=True)
+
+    def insert(self, index: int, item: T) -> None:
+        weight = self.weight(item)
+        self._length += 1
+        if not self._blocks:
+            self._blocks.append([item])
+            self._weights.append([weight])
+            self._sums.append(weight)
+            self._total += weight
+            self._reindex()
+            return
+
+        if index < 0:
+            index = max(index + self._length - 1, 0)
+        if index >= self._length - 1:
+            block, offset = len(self._blocks) - 1, len(self._blocks[-1])
+        else:
+            block, offset = self._locate(index)
+        self._blocks[block].insert(offset, item)
+        self._weights[block].insert(offset, weight)
+        if len(self._blocks[block]) > self.block_size * 2:  # 大きくなりすぎたブロックは分割する
+            half = len(self._blocks[block]) // 2
+            self._blocks.insert(block + 1, self._blocks[block][half:])
+            self._weights.insert(block + 1, self._weights[block][half:])
+            del self._blocks[block][half:]
+            del self._weights[block][half:]
+            self._sums[block] = sum(self._weights[block])
+            self._sums.insert(block + 1, sum(self._weights[block + 1]))
+            self._total += weight
+            self._reindex()
+        else:
+            self._lengths.add(block, 1)
+            self._adjust(block, weight)
+
+    def append(self, item: T) -> None:
+        self.insert(self._length, item)
+
+    def appendleft(self, item: T) -> None:
+        self.insert(0, item)
+
+    def extend(self, items: Iterable[T]) -> None:
+        for item in items:
+            self.append(item)
+
+    def pop(self, index: int = -1) -> T:
+        block, offset = self._locate(index)
+        item = self._blocks[block].pop(offset)
+        weight = self._weights[block].pop(offset)
+        self._length -= 1
+        if self._blocks[block]:
+            self._lengths.add(block, -1)
+            self._adjust(block, -weight)
+        else:
+            del self._blocks[block]
+            del self._weights[block]
+            del self._sums[block]
+            self._total -= weight
+            self._reindex()
+        if not self._length:
+            self._total = 0.0  # 浮動小数点の誤差を残さない
+        return item
+
+    def popleft(self) -> T:
+        return self.pop(0)
+
+    def clear(self) -> None:
+        self._rebuild(())
+
+    def move(self, source: int, destination: int) -> T:
+        item = self.pop(source)
+        self.insert(destination, item)
+        return item
+
+    def shuffle(self) -> None:
+        entries = list(self._entries())
+        random.shuffle(entries)
+        self._rebuild(entries)
+
+    def remove_if(self, predicate: Callable[[T], bool]) -> list[T]:
+        kept: list[tuple[T, float]] = []
+        removed: list[T] = []
+        for item, weight in self._entries():
+            if predicate(item):
+                removed.append(item)
+            else:
+                kept.append((item, weight))
+        if removed:
+            self._rebuild(kept)
+        return removed
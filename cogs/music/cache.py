@@ -0,0 +1,97 @@
+import collections
+import sys
+import time
+from collections.abc import Callable, Hashable
+
+
+class LRUCache[K: Hashable, V]:
+    def __init__(
+        self,
+        *,
+        max_entries: int,
+        max_bytes: int | None = None,
+        sizeof: Callable[[V], int] = sys.getsizeof,
+        on_evict: Callable[[K, V], object] | None = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self._entries: collections.OrderedDict[K, tuple[V, float, int]] = collections.OrderedDict()
+
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[1] > time.monotonic()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: K) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires_at, _ = entry
+        if expires_at <= time.monotonic():
+            self.expirations += 1
+            self.misses += 1
+            self.pop(key)
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def peek(self, key: K) -> V | None:
+        # ヒット率や順序を変えずに有効な値のみを返す
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def put(self, key: K, value: V, *, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        self.pop(key)
+
+        size = self.sizeof(value)
+        self._entries[key] = (value, time.monotonic() + ttl, size)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            evicted_key, (evicted, _, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(evicted_key, evicted)
+
+    def pop(self, key: K) -> V | None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self.bytes -= entry[2]
+        return entry[0]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict[str, str]:
+        limit = f" / {self.max_bytes / 1024:.0f} KiB" if self.max_bytes is not None else ""
+        return {
+            "Entries": f"{len(self._entries)} / {self.max_entries}",
+            "Size": f"{self.bytes / 1024:.1f} KiB{limit}",
+            "Hits": f"{self.hits} / {self.hits + self.misses} ({self.hit_rate:.1%})",
+            "Evictions": f"{self.evictions} (Expired: {self.expirations})",
+        }
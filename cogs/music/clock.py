@@ -0,0 +1,264 @@
+import collections
+import os
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+from discord import ClientException, SpeakingState, VoiceClient, opus
+from discord.player import AudioPlayer, AudioSource
+
+import utils
+
+AUDIO_CLOCK = bool(int(os.getenv("AUDIO_CLOCK", "0")))  # 1の場合は全サーバーの再生を1つのスレッドで行う
+AUDIO_CLOCK_READERS = int(os.getenv("AUDIO_CLOCK_READERS", "4"))
+CLOCK_BUFFER_FRAMES = 10  # 音声ソースから先読みしておくフレーム数
+CLOCK_REFILL_FRAMES = 5  # 先読み済みのフレームがこれを下回ったら読み込む
+CLOCK_MAX_LAG = 5  # これ以上のフレーム数遅れた場合は追いつこうとせずに基準時刻を合わせ直す
+CLOCK_STATS_GUILDS = 5
+
+FRAME_DURATION = opus.Encoder.FRAME_LENGTH / 1000
+
+
+class ClockedPlayer(AudioPlayer):
+    def __init__(
+        self,
+        source: AudioSource,
+        client: VoiceClient,
+        *,
+        clock: "AudioClock",
+        after: Callable[[Exception | None], object] | None = None,
+    ) -> None:
+        super().__init__(source, client, after=after)
+        self.clock = clock
+        self.guild = client.guild.name
+        self.frames = 0
+        self.underruns = 0
+        self.lateness = utils.LatencyRecorder()  # ティックの予定時刻から送信までの遅れ (読み込みの遅延は含まない)
+        self._buffer: collections.deque[bytes] = collections.deque()
+        self._idle = threading.Event()  # リーダースレッドで読み込んでいない間は設定されている
+        self._idle.set()
+        self._exhausted = False
+        self._silenced = False
+        self._disconnected: float | None = None
+
+    def start(self) -> None:
+        # スレッドは起動せず、AudioClockのティックごとに1フレームずつ送信する
+        self._speak(SpeakingState.voice)
+        self.clock.add(self)
+
+    def fill(self) -> None:
+        # 読み込みとエンコードはリーダースレッドで行い、ティックを遅らせないようにする
+        try:
+            while len(self._buffer) < CLOCK_BUFFER_FRAMES and not self._end.is_set():
+                source = self.source
+                data = source.read()
+                if not data:
+                    if self._current_error is None:
+                        self._current_error = getattr(source, "_current_error", None)
+                    self._exhausted = True
+                    break
+                if not source.is_opus():
+                    data = self.client.encoder.encode(data, opus.Encoder.SAMPLES_PER_FRAME)
+                self._buffer.append(data)
+        except Exception as e:
+            self._current_error = e
+            self._exhausted = True
+        finally:
+            self._idle.set()
+
+    def refill(self) -> None:
+        if not self._idle.is_set() or self._exhausted or len(self._buffer) >= CLOCK_REFILL_FRAMES:
+            return
+        self._idle.clear()
+        self.clock.submit(self.fill)
+
+    def is_connected(self) -> bool:
+        # AudioPlayerと同様に再接続を待ち、タイムアウトした場合は再生を終了する
+        if self.client.is_connected():
+            if self._disconnected is not None:
+                self._disconnected = None
+                self._speak(SpeakingState.voice)
+            return True
+        now = time.perf_counter()
+        if self._disconnected is None:
+            self._disconnected = now
+        if now - self._disconnected > self.client.timeout:
+            self._end.set()
+        return False
+
+    def tick(self, deadline: float) -> bool:
+        if not self._resumed.is_set():
+            if not self._silenced:
+                self.send_silence()
+                self._silenced = True
+            return not self._end.is_set()
+        self._silenced = False
+        if not self.is_connected():
+            return not self._end.is_set()
+        if self._end.is_set():
+            return False
+
+        if self._buffer:
+            self.client.send_audio_packet(self._buffer.popleft(), encode=False)
+            self.frames += 1
+            self.lateness.record(max(0.0, time.perf_counter() - deadline))
+        elif self._exhausted:
+            self.stop()
+            return False
+        elif self.frames:
+            self.underruns += 1  # 読み込みが間に合わなかったフレームは送信しない
+        self.refill()
+        return True
+
+    def finish(self) -> None:
+        try:
+            if self.client.is_connected():
+                self.send_silence()
+        finally:
+            self._call_after()
+            self._idle.wait()  # 読み込み中の音声ソースを閉じないよう、リーダースレッドの終了を待つ
+            self.source.cleanup()
+
+    def set_source(self, source: AudioSource) -> None:
+        with self._lock:
+            self.source = source
+            self._buffer.clear()
+            self._exhausted = False
+
+    def stats(self) -> str:
+        return (
+            f"{self.frames} frames, {self.underruns} underruns, "
+            f"lateness avg {utils.format_seconds(self.lateness.mean)} max {utils.format_seconds(self.lateness.max)}"
+        )
+
+
+class AudioClock:
+    def __init__(self, readers: int = AUDIO_CLOCK_READERS) -> None:
+        self.readers = max(1, readers)
+        self._players: list[ClockedPlayer] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._executor: ThreadPoolExecutor | None = None
+
+        self.ticks = 0
+        self.late_ticks = 0
+        self.resyncs = 0
+        self.tick_time = utils.Histogram()
+        self.underruns = 0
+
+    def play(
+        self,
+        voice: VoiceClient,
+        source: AudioSource,
+        *,
+        after: Callable[[Exception | None], object] | None = None,
+    ) -> ClockedPlayer:
+        # VoiceClient.playと同じ確認を行い、スレッドの代わりにClockedPlayerを設定する
+        if not voice.is_connected():
+            raise ClientException("Not connected to voice.")
+        if voice.is_playing():
+            raise ClientException("Already playing audio.")
+        if not source.is_opus():
+            voice.encoder = opus.Encoder()
+        player = voice._player = ClockedPlayer(source, voice, clock=self, after=after)  # noqa: SLF001
+        player.start()
+        return player
+
+    def submit(self, fn: Callable[[], None]) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.readers, thread_name_prefix="AudioClockReader")
+        self._executor.submit(fn)
+
+    def add(self, player: ClockedPlayer) -> None:
+        player.refill()
+        with self._lock:
+            self._players.append(player)
+            self._wakeup.set()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="AudioClock", daemon=True)
+            self._thread.start()
+
+    def run(self) -> None:
+        deadline = time.perf_counter()
+        while not self._stop.is_set():
+            with self._lock:
+                players = self._players.copy()
+                if not players:
+                    self._wakeup.clear()
+            if not players:
+                self._wakeup.wait()
+                deadline = time.perf_counter()
+                continue
+
+            start = time.perf_counter()
+            for player in players:
+                try:
+                    active = player.tick(deadline)
+                except Exception as e:
+                    player._current_error = e  # noqa: SLF001
+                    player.stop()
+                    active = False
+                if not active:
+                    self.remove(player)
+            self.ticks += 1
+            self.tick_time.record(time.perf_counter() - start)
+
+            deadline += FRAME_DURATION
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+                continue
+            self.late_ticks += 1
+            if -delay > FRAME_DURATION * CLOCK_MAX_LAG:
+                # 負荷が高い場合は遅れたフレームをまとめて送らず、以降のティックを後ろにずらす
+                self.resyncs += 1
+                utils.logger.warning(
+                    f"Audio Clock Lagging (Players: {len(players)}, Lag: {utils.format_seconds(-delay)})",
+                )
+                deadline = time.perf_counter()
+
+    def remove(self, player: ClockedPlayer) -> None:
+        with self._lock:
+            if player in self._players:
+                self._players.remove(player)
+        self.underruns += player.underruns
+        self.submit(player.finish)  # afterの呼び出しやFFmpegの終了でティックを止めない
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            players = self._players.copy()
+        for player in players:
+            player.stop()
+            self.remove(player)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self) -> dict[str, str]:
+        if not AUDIO_CLOCK:
+            return {"Mode": "Thread per Guild"}
+        with self._lock:
+            players = self._players.copy()
+        guilds = "\n".join(
+            f"{player.guild}: {player.stats()}"
+            for player in sorted(players, key=lambda player: player.underruns, reverse=True)[:CLOCK_STATS_GUILDS]
+        )
+        return {
+            "Players": f"{len(players)} (Readers: {self.readers})",
+            "Ticks": f"{self.ticks} (Late: {self.late_ticks}, Resyncs: {self.resyncs})",
+            "Underruns": str(self.underruns + sum(player.underruns for player in players)),
+            "Tick Time": self.tick_time.format(),
+            "Guilds": guilds or "No Player",
+        }
+
+
+CLOCK = AudioClock()
@@ -1,15 +1,19 @@
+import contextlib
+from datetime import timedelta
+
 from discord import Color, Interaction, Member, VoiceState, app_commands
 from discord.ext import commands
 
 import utils
 from utils.types import CielType
 
-from . import errors
-from .embed import QueueStatusEmbed, TrackEmbed, VoiceChannelEmbed
-from .model import GoogleSearchTrack, MusicState, YouTubeDLPTrack
+from . import audio, clock, errors, loudness, process, quota, worker, youtube
+from .embed import MusicStatsEmbed, PlaylistEmbed, QueueStatusEmbed, TrackEmbed, VoiceChannelEmbed
+from .model import PLAYBACK, GoogleSearchTrack, MusicState, PlaylistTrack, YouTubeDLPTrack
 from .view import GoogleSearchView, QueueTracksView, QueueView
 
 RETRY_SUGGESTION = 3
+PLAYLIST_PROGRESS_INTERVAL = 20
 
 
 class MusicCog(commands.Cog, name="Music"):
@@ -17,6 +21,15 @@ class MusicCog(commands.Cog, name="Music"):
         self.bot = bot
         self.states: dict[int, MusicState] = {}
 
+    async def cog_load(self) -> None:
+        if self.bot.cluster_id is not None:
+            quota.partition(self.bot.cluster_count)
+            audio.OPUS_CACHE.partition(self.bot.cluster_id, self.bot.cluster_count)
+        youtube.POOL.start()
+        youtube.API_SESSION.start()
+        audio.OPUS_CACHE.start()
+        process.SUPERVISOR.start()
+
     async def cog_unload(self) -> None:
         for state in self.states.values():
             if not state.is_connected():
@@ -30,6 +43,30 @@ class MusicCog(commands.Cog, name="Music"):
             )
             await state.disconnect()
             await state.message.reply(embed=embed)
+        youtube.POOL.shutdown()
+        loudness.ANALYZER.shutdown()
+        process.SUPERVISOR.shutdown()  # リロード後に管理できなくなるFFmpegを残さない
+        worker.POOL.shutdown()
+        clock.CLOCK.shutdown()
+        await youtube.API_SESSION.close()
+
+    def stats(self) -> dict[str, dict[str, str]]:
+        return {
+            "Resolver": youtube.POOL.stats() | youtube.FLIGHT.stats(),
+            "Stream Cache": youtube.STREAM_CACHE.stats(),
+            "Search Cache": youtube.SEARCH_CACHE.stats(),
+            "Video Cache": youtube.VIDEO_CACHE.stats(),
+            "Opus Cache": audio.OPUS_CACHE.stats(),
+            "Loudness": loudness.ANALYZER.stats(),
+            "Playback Health": audio.HEALTH.stats(),
+            "FFmpeg": process.SUPERVISOR.stats(),
+            "Audio Workers": worker.POOL.stats(),
+            "Audio Clock": clock.CLOCK.stats(),
+            "YouTube API": youtube.API_SESSION.stats(),
+            "YouTube Quota": quota.YOUTUBE.stats(),
+            "Gemini Quota": quota.GEMINI.stats(),
+            "Playback": PLAYBACK.stats(),
+        }
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState) -> None:  # noqa: ARG002
@@ -69,6 +106,13 @@ class MusicCog(commands.Cog, name="Music"):
         await state.disconnect()
         await state.message.reply(embed=embed)
 
+    async def defer_auto_play(self, state: MusicState, error: errors.QuotaExceededError) -> None:
+        delay = quota.auto_play_retry_after()
+        utils.logger.warning(f"Auto Play Deferred by Quota (Guild: {state.guild.name}, Delay: {delay:.0f}s)")
+        if state.defer_auto_play(delay):
+            embed = utils.ErrorEmbed(self.bot.user, self.bot, error, title="Auto Play Paused")
+            await state.message.channel.send(embed=embed)
+
     @commands.Cog.listener()
     async def on_music_auto_play(self, state: MusicState) -> None:
         if state.queue.auto_play is None or not state.queue.empty():
@@ -82,6 +126,9 @@ class MusicCog(commands.Cog, name="Music"):
             state.reset_timer()
             try:
                 track = await state.suggestion()
+            except errors.QuotaExceededError as e:
+                await self.defer_auto_play(state, e)
+                return
             except utils.GoogleADKError:
                 utils.logger.exception("Auto Play Suggestion Error")
                 continue
@@ -215,7 +262,7 @@ class MusicCog(commands.Cog, name="Music"):
         await interaction.response.send_message(embed=embed)
 
     @app_commands.command()
-    @app_commands.describe(url="再生したい動画のURL")
+    @app_commands.describe(url="再生したい動画またはプレイリストのURL")
     @app_commands.guild_only()
     async def play(self, interaction: Interaction, url: str) -> None:
         """URLから曲をキューに追加"""
@@ -224,6 +271,9 @@ class MusicCog(commands.Cog, name="Music"):
 
         state = await self.get_or_connect_state(interaction)
         state.reset_timer()
+        if youtube.is_playlist(url):
+            await self.add_playlist(interaction, state, url)
+            return
 
         track = await YouTubeDLPTrack.download(interaction.user, url)
         if not await state.is_valid():
@@ -236,6 +286,34 @@ class MusicCog(commands.Cog, name="Music"):
         await state.add_track(track)
         await interaction.edit_original_response(embed=embed)
 
+    async def add_playlist(self, interaction: Interaction, state: MusicState, url: str) -> None:
+        first: PlaylistTrack | None = None
+        count = 0
+        async with contextlib.aclosing(youtube.playlist(url)) as entries:
+            async for entry in entries:
+                track = PlaylistTrack.from_entry(interaction.user, entry)
+                if first is None:
+                    first = track
+                if not await state.is_valid():
+                    embed = PlaylistEmbed(first, count, title="Cancelled Adding Playlist", color=Color.red())
+                    await interaction.followup.send(embed=embed, ephemeral=True)
+                    await interaction.delete_original_response()
+                    return
+
+                # 取得できた曲から順にキューへ追加し、ストリームURLは再生直前に取得する
+                await state.add_track(track)
+                state.reset_timer()
+                count += 1
+                if count == 1 or count % PLAYLIST_PROGRESS_INTERVAL == 0:
+                    embed = PlaylistEmbed(first, count, title="Adding Playlist...", color=Color.light_grey())
+                    await interaction.edit_original_response(embed=embed)
+
+        if first is None:
+            raise errors.DownloadError(f"No Entries in the Playlist: {url}")
+        utils.logger.info(f"Added Playlist (Guild: {state.guild.name}, Tracks: {count}, URL: {url})")
+        embed = PlaylistEmbed(first, count, title="Added Playlist to the Queue", color=Color.green())
+        await interaction.edit_original_response(embed=embed)
+
     @app_commands.command(name="search-top")
     @app_commands.describe(word="検索ワード")
     @app_commands.guild_only()
@@ -292,6 +370,22 @@ class MusicCog(commands.Cog, name="Music"):
         embed = TrackEmbed(track=track, title="Skipped Now Playing", color=Color.green())
         await interaction.response.send_message(embed=embed)
 
+    @app_commands.command()
+    @app_commands.describe(position="移動先の再生位置 (例: 1:23, 90, 1m30s)")
+    @app_commands.guild_only()
+    async def seek(self, interaction: Interaction, position: str) -> None:
+        """再生中の曲の再生位置を移動"""
+        state = await self.get_connected_state(interaction)
+
+        seconds = youtube.parse_timestamp(position)
+        if seconds is None:
+            raise errors.InvalidSeekPositionError(position)
+        await interaction.response.defer()
+        track = await state.seek(seconds)
+        title = f"Seeked to {timedelta(seconds=int(seconds))}"
+        embed = TrackEmbed(track=track, title=title, color=Color.green())
+        await interaction.followup.send(embed=embed)
+
     @app_commands.command()
     @app_commands.guild_only()
     async def loop(self, interaction: Interaction) -> None:
@@ -334,6 +428,52 @@ class MusicCog(commands.Cog, name="Music"):
         embed = view.set_embed(color=Color.blue())
         await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
+    @app_commands.command()
+    @app_commands.describe(source="移動する曲の番号", destination="移動先の番号")
+    @app_commands.guild_only()
+    async def move(self, interaction: Interaction, source: int, destination: int) -> None:
+        """キュー内の曲の順番を移動"""
+        state = await self.get_connected_state(interaction)
+
+        for index in (source, destination):
+            if not 1 <= index <= state.queue.qsize():  # 番号は /track の表示と同じく1から数える
+                raise errors.InvalidTrackIndexError(index, state.queue.qsize())
+        track = await state.move_track(source - 1, destination - 1)
+        embed = TrackEmbed(track=track, title=f"Moved to #{destination}", color=Color.green())
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.command()
+    @app_commands.guild_only()
+    async def shuffle(self, interaction: Interaction) -> None:
+        """キューの曲をシャッフル"""
+        state = await self.get_connected_state(interaction)
+
+        await state.shuffle()
+        embed = QueueStatusEmbed(interaction.user, state.queue, title="Queue Shuffled", color=Color.green())
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.command()
+    @app_commands.guild_only()
+    async def dedupe(self, interaction: Interaction) -> None:
+        """キュー内の重複した曲を削除"""
+        state = await self.get_connected_state(interaction)
+
+        tracks = await state.remove_duplicates()
+        title = f"Removed {len(tracks)} Duplicate Tracks"
+        embed = QueueStatusEmbed(interaction.user, state.queue, title=title, color=Color.green())
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(name="remove-mine")
+    @app_commands.guild_only()
+    async def remove_mine(self, interaction: Interaction) -> None:
+        """自分が追加した曲をキューから削除"""
+        state = await self.get_connected_state(interaction)
+
+        tracks = await state.remove_user_tracks(interaction.user)
+        title = f"Removed {len(tracks)} Tracks Added by {interaction.user.display_name}"
+        embed = QueueStatusEmbed(interaction.user, state.queue, title=title, color=Color.green())
+        await interaction.response.send_message(embed=embed)
+
     @app_commands.command()
     @app_commands.guild_only()
     @app_commands.describe(word="自動再生のキーワード")
@@ -358,6 +498,17 @@ class MusicCog(commands.Cog, name="Music"):
         embed = QueueStatusEmbed(interaction.user, state.queue, title="Auto Play Disabled", color=Color.red())
         await interaction.edit_original_response(embed=embed)
 
+    @app_commands.command(name="music-stats")
+    @utils.developer_only()
+    async def music_stats(self, interaction: Interaction) -> None:
+        """音楽機能の統計情報を表示"""
+        stats = self.stats()
+        state = self.states.get(interaction.guild_id) if interaction.guild_id is not None else None
+        if state is not None:
+            stats["Playback Health (This Server)"] = state.health.stats()
+        embed = MusicStatsEmbed(interaction.user, stats, title="Music Stats", color=Color.dark_grey())
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
 
 async def setup(bot: CielType) -> None:
     await bot.add_cog(MusicCog(bot))
@@ -1,4 +1,5 @@
-from datetime import datetime
+import itertools
+from datetime import datetime, timedelta
 from typing import Any
 
 from discord import ClientUser, Color, Member, User
@@ -10,6 +11,8 @@ import utils
 from . import errors
 from .model import MusicQueue, Track
 
+QUEUE_EMBED_TRACKS = 10
+
 
 class VoiceChannelEmbed(utils.CustomEmbed):
     def __init__(
@@ -83,7 +86,7 @@ class TrackEmbed(utils.CustomEmbed):
     ) -> None:
         self.track = track
         super().__init__(
-            user=track.user,
+            user=None,  # フッターは曲を追加したユーザーで上書きする
             title=title,
             colour=colour,
             color=color,
@@ -108,11 +111,53 @@ class TrackEmbed(utils.CustomEmbed):
         self.set_footer(text=f"Requested by {self.track.user_name}", icon_url=self.track.user_icon)
 
 
+class PlaylistEmbed(utils.CustomEmbed):
+    def __init__(
+        self,
+        track: Track,
+        count: int,
+        *,
+        colour: int | Color | None = None,
+        color: int | Color | None = None,
+        title: Any | None = None,  # noqa: ANN401
+        type: EmbedType = "rich",  # noqa: A002
+        url: Any | None = None,  # noqa: ANN401
+        description: Any | None = None,  # noqa: ANN401
+        timestamp: datetime | None = None,
+    ) -> None:
+        self.track = track
+        self.count = count
+        super().__init__(
+            user=None,
+            title=title,
+            colour=colour,
+            color=color,
+            type=type,
+            url=url,
+            description=description,
+            timestamp=timestamp,
+        )
+
+    @property
+    def default_description(self) -> str:
+        return self.track.title_markdown
+
+    def format_fields(self) -> None:
+        self.add_field(name="Channel", value=self.track.channel_markdown)
+        self.add_field(name="Tracks", value=self.count)
+        if self.track.thumbnail is not None:
+            self.set_thumbnail(url=self.track.thumbnail)
+
+    def format_footer(self) -> None:
+        self.set_footer(text=f"Requested by {self.track.user_name}", icon_url=self.track.user_icon)
+
+
 class QueueEmbed(utils.CustomEmbed):
     def __init__(
         self,
         user: User | Member | ClientUser | None,
         queue: MusicQueue,
+        position: float | None = None,
         *,
         colour: int | Color | None = None,
         color: int | Color | None = None,
@@ -123,6 +168,7 @@ class QueueEmbed(utils.CustomEmbed):
         timestamp: datetime | None = None,
     ) -> None:
         self.queue = queue
+        self.position = position
         super().__init__(
             user=user,
             title=title,
@@ -139,22 +185,25 @@ class QueueEmbed(utils.CustomEmbed):
         if self.queue.current is not None:
             self.set_thumbnail(url=self.queue.current.thumbnail)
             text = f"{self.queue.current.title_markdown}\nRequested by **{self.queue.current.user_name}**"
+            if self.position is not None:
+                duration = self.queue.current.duration or "Unknown"
+                text += f"\n`{timedelta(seconds=int(self.position))} / {duration}`"
         self.add_field(name="Now Playing", value=text, inline=False)
 
-        lines = [
-            f"{track.title_markdown} | Requested by **{track.user_name}**"
-            for track in self.queue.all(current=False)
-            if track is not None
-        ]
+        tracks = itertools.islice(self.queue.all(current=False), QUEUE_EMBED_TRACKS)
+        lines = [f"{track.title_markdown} | Requested by **{track.user_name}**" for track in tracks]
         if not lines:
             lines.append("No Track")
+        elif self.queue.qsize() > len(lines):
+            lines.append(f"... and **{self.queue.qsize() - len(lines)}** more")  # Embedのフィールド長の上限対策
         self.add_field(name="Tracks in the Queue", value="\n".join(lines), inline=False)
 
         queue_loop = "🟢" if self.queue.queue_loop else "🔴"
         auto_play = f"🟢 `{self.queue.auto_play}`" if self.queue.auto_play is not None else "🔴"
+        total = timedelta(seconds=int(self.queue.duration))
         self.add_field(
             name="Queue Status",
-            value=f"**Queue Loop**: {queue_loop}, **Auto Play**: {auto_play}",
+            value=f"**Queue Loop**: {queue_loop}, **Auto Play**: {auto_play}, **Total**: `{total}`",
             inline=False,
         )
 
@@ -186,7 +235,41 @@ class QueueStatusEmbed(utils.CustomEmbed):
         )
 
     def format_fields(self) -> None:
+        tracks = f"{self.queue.qsize()} Tracks (`{timedelta(seconds=int(self.queue.duration))}`)"
+        self.add_field(name="Tracks in the Queue", value=tracks, inline=False)
         queue_loop = "🟢 Enabled" if self.queue.queue_loop else "🔴 Disabled"
         self.add_field(name="Queue Loop", value=queue_loop, inline=False)
         auto_play = f"🟢 Enabled `{self.queue.auto_play}`" if self.queue.auto_play is not None else "🔴 Disabled"
         self.add_field(name="Auto Play", value=auto_play, inline=False)
+
+
+class MusicStatsEmbed(utils.CustomEmbed):
+    def __init__(
+        self,
+        user: User | Member | ClientUser | None,
+        stats: dict[str, dict[str, str]],
+        *,
+        colour: int | Color | None = None,
+        color: int | Color | None = None,
+        title: Any | None = None,  # noqa: ANN401
+        type: EmbedType = "rich",  # noqa: A002
+        url: Any | None = None,  # noqa: ANN401
+        description: Any | None = None,  # noqa: ANN401
+        timestamp: datetime | None = None,
+    ) -> None:
+        self.stats = stats
+        super().__init__(
+            user=user,
+            title=title,
+            colour=colour,
+            color=color,
+            type=type,
+            url=url,
+            description=description,
+            timestamp=timestamp,
+        )
+
+    def format_fields(self) -> None:
+        for name, values in self.stats.items():
+            lines = [f"**{key}**: {value}" for key, value in values.items()]
+            self.add_field(name=name, value="\n".join(lines) or "No Data", inline=False)
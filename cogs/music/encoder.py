@@ -0,0 +1,165 @@
+import os
+import selectors
+import signal
+import struct
+import subprocess
+import sys
+import time
+from multiprocessing.connection import Connection
+
+from discord import opus
+
+# ワーカープロセスはこのファイルをスクリプトとして実行し、Cogのパッケージ (core・agentなど) を読み込まない
+WORKER_BUFFER_FRAMES = 50  # ワーカーが送信済みで未再生のフレーム数の上限
+WORKER_STOP_TIMEOUT = 5
+WORKER_REAP_INTERVAL = 0.1  # 終了を待っているFFmpegがある場合の確認間隔
+
+# ワーカーから本体へのメッセージ (ストリームID, 種類, 値) の後にOpusパケットやエラーメッセージが続く
+MESSAGE_HEADER = struct.Struct("<IBi")
+MESSAGE_PACKET = 0
+MESSAGE_SPAWNED = 1  # 値はFFmpegのPID
+MESSAGE_ENDED = 2  # 値はFFmpegの終了コード
+MESSAGE_FAILED = 3
+
+
+class EncoderStream:
+    def __init__(self, stream_id: int, args: list[str]) -> None:
+        self.stream_id = stream_id
+        self.encoder = opus.Encoder()  # VoiceClientと同じ設定でエンコードし、失敗時にFFmpegを残さないよう先に作成する
+        self.process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)  # noqa: S603
+        self.fd = self.process.stdout.fileno()  # pyright: ignore[reportOptionalMemberAccess]
+        self.buffer = bytearray()
+        self.credit = WORKER_BUFFER_FRAMES
+        self.reading = False
+        self.deadline = 0.0
+
+    def read(self) -> bytes | None:
+        # 1フレーム分が揃うまで読み込み、他のストリームを待たせないようにブロックしない
+        data = os.read(self.fd, opus.Encoder.FRAME_SIZE - len(self.buffer))
+        if not data:
+            return b""
+        self.buffer.extend(data)
+        if len(self.buffer) < opus.Encoder.FRAME_SIZE:
+            return None
+        packet = self.encoder.encode(bytes(self.buffer), opus.Encoder.SAMPLES_PER_FRAME)
+        self.buffer.clear()
+        return packet
+
+    def close(self, timeout: float = 0) -> None:
+        # 終了コードは後のループで回収し、他のストリームの読み込みを止めない
+        self.process.stdout.close()  # pyright: ignore[reportOptionalMemberAccess]
+        self.deadline = time.monotonic() + timeout
+        if timeout <= 0:
+            self.process.kill()
+
+    def poll(self) -> int | None:
+        returncode = self.process.poll()
+        if returncode is None and time.monotonic() >= self.deadline:
+            self.process.kill()  # 出力を終えても終了しないFFmpegは停止させ、次のループで回収する
+        return returncode
+
+
+class EncoderWorker:
+    def __init__(self, connection: Connection) -> None:
+        self.connection = connection
+        self.streams: dict[int, EncoderStream] = {}
+        self.closing: list[EncoderStream] = []
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(connection, selectors.EVENT_READ)
+
+    def send(self, stream_id: int, kind: int, value: int = 0, payload: bytes = b"") -> None:
+        self.connection.send_bytes(MESSAGE_HEADER.pack(stream_id, kind, value) + payload)
+
+    def resume(self, stream: EncoderStream) -> None:
+        if not stream.reading and stream.credit > 0:
+            self.selector.register(stream.fd, selectors.EVENT_READ, stream)
+            stream.reading = True
+
+    def pause(self, stream: EncoderStream) -> None:
+        if stream.reading:
+            self.selector.unregister(stream.fd)
+            stream.reading = False
+
+    def open(self, stream_id: int, args: list[str]) -> None:
+        try:
+            stream = EncoderStream(stream_id, args)
+        except Exception as e:
+            self.send(stream_id, MESSAGE_FAILED, payload=f"{e.__class__.__name__}: {e}".encode())
+            return
+        self.streams[stream_id] = stream
+        self.send(stream_id, MESSAGE_SPAWNED, stream.process.pid)
+        self.resume(stream)
+
+    def close(self, stream_id: int, timeout: float = 0) -> None:
+        stream = self.streams.pop(stream_id, None)
+        if stream is None:
+            return
+        self.pause(stream)
+        stream.close(timeout)
+        self.closing.append(stream)
+
+    def reap(self) -> None:
+        for stream in tuple(self.closing):
+            returncode = stream.poll()
+            if returncode is not None:
+                self.closing.remove(stream)
+                self.send(stream.stream_id, MESSAGE_ENDED, returncode)
+
+    def credit(self, stream_id: int, frames: int) -> None:
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            return
+        stream.credit += frames
+        self.resume(stream)
+
+    def produce(self, stream: EncoderStream) -> None:
+        try:
+            packet = stream.read()
+        except (OSError, opus.OpusError) as e:
+            # 失敗したストリームのみ終了し、同じワーカーの他のストリームは再生を続ける
+            self.close(stream.stream_id)
+            self.send(stream.stream_id, MESSAGE_FAILED, payload=f"{e.__class__.__name__}: {e}".encode())
+            return
+        if packet is None:
+            return
+        if not packet:
+            self.close(stream.stream_id, WORKER_STOP_TIMEOUT)  # 終了コードはreapで送信する
+            return
+        self.send(stream.stream_id, MESSAGE_PACKET, payload=packet)
+        stream.credit -= 1
+        if stream.credit <= 0:  # 本体側の再生が追いつくまで読み込みを止める
+            self.pause(stream)
+
+    def handle(self, message: tuple) -> None:
+        match message:
+            case ("open", int(stream_id), list(args)):
+                self.open(stream_id, args)
+            case ("credit", int(stream_id), int(frames)):
+                self.credit(stream_id, frames)
+            case ("close", int(stream_id)):
+                self.close(stream_id)
+
+    def run(self) -> None:
+        try:
+            while True:
+                for key, _ in self.selector.select(WORKER_REAP_INTERVAL if self.closing else None):
+                    if key.data is None:
+                        self.handle(self.connection.recv())
+                    elif self.streams.get(key.data.stream_id) is key.data and key.data.reading:
+                        self.produce(key.data)  # 同じ回のメッセージで閉じられたストリームは読み込まない
+                self.reap()
+        except (EOFError, OSError):
+            pass  # 本体のプロセスが終了した
+        finally:
+            for stream in (*self.streams.values(), *self.closing):
+                stream.process.kill()
+                stream.process.wait()
+
+
+def run_worker(fd: int) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+Cでは本体の終了処理から停止させる
+    EncoderWorker(Connection(fd)).run()
+
+
+if __name__ == "__main__":
+    run_worker(int(sys.argv[1]))
@@ -70,6 +70,11 @@ class SearchError(GoogleAPIError):
         super().__init__(*args, msg="検索中にエラーが発生しました")
 
 
+class QuotaExceededError(GoogleAPIError):
+    def __init__(self, name: str, *args: object) -> None:
+        super().__init__(*args, msg=f"{name}の利用上限に達しました", ignore=True)
+
+
 class SearchCountError(GoogleAPIError):
     def __init__(self, actual: int, expected: int, *args: object) -> None:
         super().__init__(*args, msg=f"検索結果の数が一致しません {actual}/{expected}", ignore=True)
@@ -83,3 +88,22 @@ class YouTubeDLPError(MusicError):
 class DownloadError(YouTubeDLPError):
     def __init__(self, *args: object) -> None:
         super().__init__(*args, msg="ダウンロード中にエラーが発生しました")
+
+
+class AnalysisError(MusicError):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args, msg="音量の解析中にエラーが発生しました", ignore=True)
+
+
+class TooManyProcessesError(MusicError):
+    def __init__(self, *args: object) -> None:
+        msg = "同時に再生できる数の上限に達しています\nしばらくしてから再度お試しください"
+        super().__init__(*args, msg=msg, ignore=True)
+
+
+class InvalidSeekPositionError(MusicError):
+    def __init__(self, position: object, duration: object = None, *args: object) -> None:
+        msg = f"再生位置が無効です: {position}"
+        if duration is not None:
+            msg += f"\n曲の長さ: {duration}"
+        super().__init__(*args, msg=msg, ignore=True)
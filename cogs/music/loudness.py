@@ -0,0 +1,181 @@
+import asyncio
+import itertools
+import os
+import re
+import shlex
+import time
+from typing import NamedTuple, Self
+
+import utils
+
+from . import errors
+from .cache import LRUCache
+from .process import SUPERVISOR, ProcessOwner
+
+LOUDNESS_CONCURRENCY = int(os.getenv("LOUDNESS_CONCURRENCY", "2"))
+LOUDNESS_TARGET = -14.0
+LOUDNESS_PEAK_CEILING = -1.0
+LOUDNESS_TIMEOUT = 300
+LOUDNESS_MAX_DURATION = 60 * 60
+LOUDNESS_CACHE_ENTRIES = 4096
+LOUDNESS_CACHE_TTL = 7 * 24 * 60 * 60
+LOUDNESS_FAILED_TTL = 10 * 60
+
+SILENCE_NOISE = "-50dB"
+SILENCE_DURATION = 0.5
+SILENCE_MAX_SKIP = 15.0  # 長いイントロを誤って飛ばさないための上限
+SILENCE_TAIL_TOLERANCE = 1.0
+
+LOUDNESS_FILTER = f"ebur128=peak=true:framelog=verbose,silencedetect=noise={SILENCE_NOISE}:d={SILENCE_DURATION}"
+INTEGRATED = re.compile(r"I:\s+(-?[\d.]+) LUFS")
+TRUE_PEAK = re.compile(r"Peak:\s+(-?[\d.]+|-inf) dBFS")
+SILENCE_START = re.compile(r"silence_start: (-?[\d.]+)")
+SILENCE_END = re.compile(r"silence_end: (-?[\d.]+)")
+
+
+class LoudnessInfo(NamedTuple):
+    integrated: float | None
+    true_peak: float | None
+    start: float
+    end: float | None
+
+    @classmethod
+    def from_log(cls, log: str, duration: float) -> Self:
+        summary = log[log.rfind("Summary:") :]  # 最後に出力される集計値のみを使う
+        integrated = INTEGRATED.search(summary)
+        true_peak = TRUE_PEAK.search(summary)
+
+        starts = [float(value) for value in SILENCE_START.findall(log)]
+        ends = [float(value) for value in SILENCE_END.findall(log)]
+        silences = list(itertools.zip_longest(starts, ends))
+
+        start, end = 0.0, None
+        if silences and silences[0][0] <= SILENCE_DURATION and silences[0][1] is not None:
+            start = min(silences[0][1], SILENCE_MAX_SKIP)
+        if silences:
+            last_start, last_end = silences[-1]
+            # 終了まで続く無音区間は silence_end が出力されないか、曲の長さと一致する
+            if last_start > start and (last_end is None or last_end >= duration - SILENCE_TAIL_TOLERANCE):
+                end = last_start
+
+        return cls(
+            integrated=float(integrated.group(1)) if integrated is not None else None,
+            true_peak=float(true_peak.group(1)) if true_peak is not None else None,
+            start=start,
+            end=end,
+        )
+
+    @property
+    def gain(self) -> float | None:
+        if self.integrated is None:
+            return None
+        gain = LOUDNESS_TARGET - self.integrated
+        if self.true_peak is not None:
+            gain = min(gain, LOUDNESS_PEAK_CEILING - self.true_peak)
+        return gain
+
+    def playback_duration(self, duration: float) -> float:
+        end = self.end if self.end is not None else duration
+        return end - self.start
+
+
+NOT_ANALYZED = LoudnessInfo(integrated=None, true_peak=None, start=0.0, end=None)
+
+
+async def analyze(url: str, before_options: str, duration: float) -> LoudnessInfo:
+    args = ["-hide_banner", "-nostats", "-nostdin", *shlex.split(before_options)]
+    args.extend(["-i", url, "-vn", "-af", LOUDNESS_FILTER, "-f", "null", "-"])
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg",
+        *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    SUPERVISOR.register(process, ProcessOwner(guild_id=None, guild=None, track="Loudness Analysis", playback=False))
+    try:
+        async with asyncio.timeout(LOUDNESS_TIMEOUT):
+            _, stderr = await process.communicate()
+    except (TimeoutError, asyncio.CancelledError):
+        process.kill()
+        await process.wait()
+        raise
+
+    log = stderr.decode(errors="replace")
+    if process.returncode != 0:
+        raise errors.AnalysisError(log[-500:])
+    return LoudnessInfo.from_log(log, duration)
+
+
+class LoudnessAnalyzer:
+    def __init__(self, concurrency: int = LOUDNESS_CONCURRENCY) -> None:
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._tasks: dict[str, asyncio.Task[None]] = {}
+        self.cache: LRUCache[str, LoudnessInfo] = LRUCache(max_entries=LOUDNESS_CACHE_ENTRIES)
+        self.analyses = utils.RateCounter()
+        self.failures = 0
+        self.latency = utils.LatencyRecorder()
+
+    def get(self, key: str | None) -> LoudnessInfo | None:
+        if key is None:
+            return None
+        info = self.cache.get(key)
+        return info if info is not NOT_ANALYZED else None
+
+    def peek(self, key: str | None) -> LoudnessInfo | None:
+        if key is None:
+            return None
+        info = self.cache.peek(key)
+        return info if info is not NOT_ANALYZED else None
+
+    def schedule(
+        self,
+        key: str | None,
+        url: str,
+        before_options: str,
+        duration: float | None,
+    ) -> asyncio.Task[None] | None:
+        if key is None or key in self.cache:
+            return None
+        if key in self._tasks:
+            return self._tasks[key]  # 他のサーバーで解析中の曲は同じタスクの完了を待つ
+        if duration is None or duration > LOUDNESS_MAX_DURATION:
+            return None
+        task = asyncio.create_task(self._analyze(key, url, before_options, duration))
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return task
+
+    async def _analyze(self, key: str, url: str, before_options: str, duration: float) -> None:
+        async with self._semaphore:
+            utils.logger.debug(f"Analyzing Loudness (Key: {key})")
+            start = time.monotonic()
+            try:
+                info = await analyze(url, before_options, duration)
+            except (OSError, TimeoutError, errors.AnalysisError):
+                utils.logger.exception(f"Failed to Analyze Loudness (Key: {key})")
+                self.failures += 1
+                self.cache.put(key, NOT_ANALYZED, ttl=LOUDNESS_FAILED_TTL)
+                return
+
+        self.latency.record(time.monotonic() - start)
+        self.analyses.add()
+        self.cache.put(key, info, ttl=LOUDNESS_CACHE_TTL)
+        utils.logger.debug(
+            f"Analyzed Loudness (Key: {key}, Integrated: {info.integrated}, Peak: {info.true_peak}, "
+            f"Start: {info.start}, End: {info.end})",
+        )
+
+    def shutdown(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    def stats(self) -> dict[str, str]:
+        return {
+            "Analyses": f"{self.analyses.total} (Running: {len(self._tasks)}, Failed: {self.failures})",
+            "Duration": f"avg {utils.format_seconds(self.latency.mean)}, max {utils.format_seconds(self.latency.max)}",
+            "Cached": f"{len(self.cache)} / {self.cache.max_entries}",
+        }
+
+
+ANALYZER = LoudnessAnalyzer()
@@ -1,20 +1,29 @@
 import asyncio
 import collections
+import contextlib
+import functools
+import itertools
 import json
-from collections.abc import Generator, Iterable
+import os
+import sys
+import time
+import weakref
+from collections.abc import Callable, Generator, Iterable
 from datetime import timedelta
-from typing import Self
+from typing import NamedTuple, Self
 
-from discord import ClientUser, Guild, Interaction, Member, Message, User, VoiceClient
+from discord import ClientException, ClientUser, Guild, Interaction, Member, Message, User, VoiceClient
 from discord.channel import VocalGuildChannel, VoiceChannel
 from discord.ext import tasks
-from discord.player import AudioSource, FFmpegPCMAudio
+from discord.player import AudioSource
 
 import utils
 from utils.types import CielType
 
-from . import errors, youtube
+from . import audio, clock, errors, loudness, probe, process, quota, worker, youtube
 from .agent import APP_NAME, RUNNER, SESSION_SERVICE
+from .blocklist import BlockList
+from .process import ProcessOwner
 
 FFMPEG_BEFORE_OPTIONS = [
     "-reconnect 1",
@@ -24,18 +33,115 @@ FFMPEG_BEFORE_OPTIONS = [
     "-fflags discardcorrupt",
     "-flags low_delay",
     "-avioflags direct",
-    "-probesize 500M",
-    "-analyzeduration 0",
-]
-FFMPEG_OPTIONS = ["-vn", "-af dynaudnorm"]
+]  # プローブの設定はストリームの形式に応じて probe.PROBE_PROFILES から選ぶ
+FFMPEG_OPTIONS = ["-vn", "-af dynaudnorm"]  # 音量解析が済んでいない曲のみに使う
+FFMPEG_OPUS_OPTIONS = ["-vn"]
+
+OPUS_PASSTHROUGH = bool(int(os.getenv("OPUS_PASSTHROUGH", "0")))
+OPUS_MIN_BITRATE = 48
+OPUS_SAMPLE_RATE = 48000
 
 TIMEOUT = 300
+REFRESH_MARGIN = 60
+LOOKAHEAD_TRACKS = int(os.getenv("LOOKAHEAD_TRACKS", "2"))
+LOOKAHEAD_VALIDATE = bool(int(os.getenv("LOOKAHEAD_VALIDATE", "0")))
+LOOKAHEAD_INTERVAL = 30
+GAPLESS_PRELOAD = int(os.getenv("GAPLESS_PRELOAD", "5"))
+GAPLESS_BUFFER_FRAMES = 50
+GAPLESS_POLL_INTERVAL = 1  # 一時停止中に再生位置を確認する間隔
+
+QUEUE_JOURNAL_SIZE = 256  # Viewが差分を適用できる変更履歴の件数
+
+
+class PlaybackStats:
+    def __init__(self) -> None:
+        self.plays = utils.RateCounter()
+        self.refreshes = utils.RateCounter()
+        self.refresh_failures = 0
+        self.prefetches = utils.RateCounter()
+        self.prefetch_failures = 0
+        self.invalid_streams = 0
+        self.preloads = 0
+        self.passthrough = 0
+        self.resolve_wait = utils.LatencyRecorder()
+        self.seeks = utils.LatencyRecorder()
+        self.probes: collections.Counter[str] = collections.Counter()
+
+    def stats(self) -> dict[str, str]:
+        return {
+            "Plays": f"{self.plays.total} ({self.plays.rate * 60:.2f}/min)",
+            "Stream Refreshes": f"{self.refreshes.total} (Failed: {self.refresh_failures})",
+            "Look-ahead": (
+                f"{self.prefetches.total} (Failed: {self.prefetch_failures}, Invalid Streams: {self.invalid_streams})"
+            ),
+            "Gapless Transitions": str(self.preloads),
+            "Opus Passthrough": str(self.passthrough),
+            "Probe Profiles": ", ".join(f"{name} {count}" for name, count in self.probes.most_common()) or "No Data",
+            "Resolve Wait": (
+                f"p50 {utils.format_seconds(self.resolve_wait.percentile(50))}, "
+                f"max {utils.format_seconds(self.resolve_wait.max)}"
+            ),
+            "Seek": (
+                f"{self.seeks.count} (p50 {utils.format_seconds(self.seeks.percentile(50))}, "
+                f"max {utils.format_seconds(self.seeks.max)})"
+            ),
+        }
+
+
+PLAYBACK = PlaybackStats()
+
+
+async def open_source(opener: Callable[[], AudioSource]) -> AudioSource:
+    # ワーカーの応答やFFmpegの起動をスレッドで待ち、イベントループを止めない
+    task = asyncio.ensure_future(asyncio.to_thread(opener))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        task.add_done_callback(cleanup_opened)  # 呼び出し元が居なくなった場合は開き終わった後に閉じる
+        raise
+
+
+def cleanup_opened(task: asyncio.Future[AudioSource]) -> None:
+    if not task.cancelled() and task.exception() is None:
+        task.result().cleanup()
+
+
+def intern(value: str | None) -> str | None:
+    # チャンネル名やヘッダーなど多くの曲で同じ文字列を1つのオブジェクトで共有する
+    return sys.intern(value) if value is not None else None
+
+
+class Requester:
+    # 曲ごとにMemberを保持せず、表示に必要な情報のみを同じユーザーの曲で共有する
+    __slots__ = ("__weakref__", "avatar", "bot", "display_name", "id")
+
+    def __init__(self, user_id: int, display_name: str, avatar: str, *, bot: bool = False) -> None:
+        self.id = user_id
+        self.display_name = display_name
+        self.avatar = avatar
+        self.bot = bot
+
+    @classmethod
+    def from_user(cls, user: "User | Member | ClientUser | Requester | None") -> "Requester | None":
+        if user is None or isinstance(user, Requester):
+            return user
+        key = (user.id, user.display_name, user.display_avatar.url, user.bot)
+        requester = REQUESTERS.get(key)
+        if requester is None:  # 表示名やアイコンが変わった場合は以降の曲から新しい情報を使う
+            requester = cls(user.id, sys.intern(user.display_name), user.display_avatar.url, bot=user.bot)
+            REQUESTERS[key] = requester
+        return requester
+
+
+REQUESTERS: weakref.WeakValueDictionary[tuple[int, str, str, bool], Requester] = weakref.WeakValueDictionary()
 
 
 class Track:
+    __slots__ = ("_channel", "_channel_url", "_duration", "_source", "_thumbnail", "_title", "_url", "_user", "start")
+
     def __init__(
         self,
-        user: User | Member | ClientUser | None,
+        user: User | Member | ClientUser | Requester | None,
         *,
         title: str | None = None,
         url: str | None = None,
@@ -44,24 +150,26 @@ class Track:
         thumbnail: str | None = None,
         duration: timedelta | float | int | None = None,
         source: str | None = None,
+        start: float = 0.0,
     ) -> None:
-        self._user = user
+        self._user = Requester.from_user(user)
         self._title = title
         self._url = url
-        self._channel = channel
-        self._channel_url = channel_url
+        self._channel = intern(channel)
+        self._channel_url = intern(channel_url)
         self._thumbnail = thumbnail
         if isinstance(duration, (float, int)):
             duration = timedelta(seconds=duration)
         self._duration = duration
 
         self._source = source
+        self.start = start  # URLの t= で指定された再生開始位置
 
     def __hash__(self) -> int:
         return hash((self._user, self._source))
 
     @property
-    def user(self) -> User | Member | ClientUser | None:
+    def user(self) -> Requester | None:
         return self._user
 
     @property
@@ -88,13 +196,28 @@ class Track:
     def duration(self) -> timedelta | None:
         return self._duration
 
+    @property
+    def playback_duration(self) -> float | None:
+        return self.duration.total_seconds() if self.duration is not None else None
+
+    @property
+    def video_id(self) -> str | None:
+        return youtube.parse_video_id(self.url) if self.url is not None else None
+
+    def playback_range(self, start: float | None = None) -> tuple[float, float | None]:
+        return self.start if start is None else start, self.playback_duration
+
     @property
     def user_name(self) -> str:
         return self.user.display_name if self.user is not None else "Unknown User"
 
     @property
     def user_icon(self) -> str | None:
-        return self.user.display_avatar.url if self.user is not None else None
+        return self.user.avatar if self.user is not None else None
+
+    @property
+    def cache_key(self) -> str | None:
+        return youtube.canonical_key(self.url) if self.url is not None else None
 
     @property
     def title_markdown(self) -> str:
@@ -104,11 +227,17 @@ class Track:
     def channel_markdown(self) -> str:
         return f"[{self.channel}]({self.channel_url})" if self.channel_url is not None else self.channel
 
+    async def resolve(self) -> "Track":
+        return self
+
     def get_audio_source(
         self,
         *,
         before_options: Iterable[str] | str | None = None,
         options: Iterable[str] | str | None = None,
+        passthrough: bool = False,
+        owner: ProcessOwner | None = None,
+        start: float | None = None,
     ) -> AudioSource:
         if self._source is None:
             raise utils.InvalidAttributeError(f"{self.__class__.__name__}.source")
@@ -116,57 +245,73 @@ class Track:
             before_options = " ".join(before_options)
         if isinstance(options, Iterable) and not isinstance(options, str):
             options = " ".join(options)
-
-        return FFmpegPCMAudio(self._source, before_options=before_options, options=options)
+        if start is None:
+            start = self.start
+        if start > 0:  # -iより前に指定し、入力側でシークして読み飛ばしを避ける
+            before_options = f"-ss {start:.3f} {before_options or ''}".rstrip()
+
+        if owner is None:
+            owner = ProcessOwner(guild_id=None, guild=None, track=self.title)
+
+        if passthrough:  # Opusのパケットをデコード・再エンコードせずにそのまま送信する
+            return audio.SupervisedOpusAudio(
+                self._source,
+                owner=owner,
+                codec="copy",
+                before_options=before_options,
+                options=options,
+            )
+        if worker.POOL.enabled:  # デコードとエンコードをワーカープロセスで行い、本体はパケットの送信のみを行う
+            source = worker.POOL.open(self._source, owner=owner, before_options=before_options, options=options)
+            if source is not None:
+                return source
+        return audio.SupervisedPCMAudio(self._source, owner=owner, before_options=before_options, options=options)
 
 
 class YouTubeDLPTrack(Track):
+    __slots__ = ("_analysis", "_expire", "bitrate", "codec", "headers", "probe_profile", "sample_rate")
+
     @classmethod
-    async def download(cls, user: User | Member | ClientUser | None, url: str) -> Self:
+    async def download(cls, user: User | Member | ClientUser | Requester | None, url: str) -> Self:
         user_name = user.display_name if user is not None else "Unknown User"
         utils.logger.debug(f"Downloading Track (User: {user_name}, URL: {url})")
         info = await youtube.download(url)
-        return cls.from_info(user, info)
+        track = cls.from_info(user, info)
+        start = youtube.parse_start(url)
+        if start is not None and (info.duration is None or start < info.duration):
+            track.start = start
+        return track
 
     @classmethod
-    def from_info(cls, user: User | Member | ClientUser | None, info: dict) -> Self:
-        title = info.get("title")
-        url = info.get("webpage_url")
-        channel = info.get("uploader")
-        channel_url = info.get("uploader_url")
-        thumbnail = info.get("thumbnail")
-        duration = info.get("duration")
-
-        source = info.get("url")
-        headers = []
-        http_headers = info.get("http_headers")
-        if http_headers is not None:
-            headers.extend([f"{key}: {value}" for key, value in http_headers.items()])
-        cookies = info.get("cookies")
-        if cookies is not None:
-            headers.append(f"Cookie: {cookies}")
-
-        extractor = info.get("extractor")
-        if extractor == "niconico":
-            uploader_id = info.get("uploader_id")
-            if uploader_id is not None and channel_url is None:
-                channel_url = f"https://www.nicovideo.jp/user/{uploader_id}"
-
+    def from_info(cls, user: User | Member | ClientUser | Requester | None, info: youtube.ResolvedInfo) -> Self:
+        headers = cls.format_headers(info)
         return cls(
             user=user,
-            title=title,
-            url=url,
-            channel=channel,
-            channel_url=channel_url,
-            source=source,
+            title=info.title,
+            url=info.webpage_url,
+            channel=info.uploader,
+            channel_url=info.uploader_url,
+            source=info.url,
             headers=headers,
-            thumbnail=thumbnail,
-            duration=duration,
+            thumbnail=info.thumbnail,
+            duration=info.duration,
+            expire=info.expire,
+            codec=info.acodec,
+            bitrate=info.abr,
+            sample_rate=info.asr,
+            probe_profile=probe.select(info.extractor, info.protocol, info.ext),
         )
 
+    @staticmethod
+    def format_headers(info: youtube.ResolvedInfo) -> tuple[str, ...]:
+        headers = [sys.intern(f"{key}: {value}") for key, value in info.http_headers.items()]
+        if info.cookies is not None:
+            headers.append(sys.intern(f"Cookie: {info.cookies}"))
+        return tuple(headers)
+
     def __init__(
         self,
-        user: User | Member | ClientUser | None,
+        user: User | Member | ClientUser | Requester | None,
         *,
         title: str | None = None,
         url: str | None = None,
@@ -175,7 +320,13 @@ class YouTubeDLPTrack(Track):
         thumbnail: str | None = None,
         duration: timedelta | None = None,
         source: str | None = None,
-        headers: list[str] | None = None,
+        start: float = 0.0,
+        headers: Iterable[str] = (),
+        expire: int | None = None,
+        codec: str | None = None,
+        bitrate: float | None = None,
+        sample_rate: int | None = None,
+        probe_profile: str | None = None,
     ) -> None:
         super().__init__(
             user=user,
@@ -186,36 +337,167 @@ class YouTubeDLPTrack(Track):
             thumbnail=thumbnail,
             duration=duration,
             source=source,
+            start=start,
         )
-        if headers is None:
-            headers = []
-        self.headers = headers
+        self.headers = tuple(sys.intern(header) for header in headers)
+        self._expire = expire
+        self.codec = codec
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.probe_profile = probe_profile
+        self._analysis: loudness.LoudnessInfo | None = None
+
+    @property
+    def expire(self) -> int | None:
+        return self._expire
+
+    @property
+    def passthrough(self) -> bool:
+        if not OPUS_PASSTHROUGH or self.codec != "opus":
+            return False
+        if self.sample_rate is not None and self.sample_rate != OPUS_SAMPLE_RATE:
+            return False
+        return self.bitrate is None or self.bitrate >= OPUS_MIN_BITRATE
+
+    @property
+    def analysis(self) -> loudness.LoudnessInfo | None:
+        if self._analysis is None:  # キューの合計時間の計算などでは統計を変えずに参照する
+            self._analysis = loudness.ANALYZER.peek(self.cache_key)
+        return self._analysis
+
+    @property
+    def playback_duration(self) -> float | None:
+        duration = super().playback_duration
+        if duration is None or self.analysis is None:
+            return duration
+        return self.analysis.playback_duration(duration)
+
+    def playback_range(self, start: float | None = None) -> tuple[float, float | None]:
+        start, end = super().playback_range(start)
+        analysis = self.analysis
+        if analysis is None:
+            return start, end
+        if analysis.end is not None:
+            end = analysis.end
+        return max(start, analysis.start), end  # 先頭と末尾の無音を飛ばす
+
+    def is_expired(self, margin: float = REFRESH_MARGIN) -> bool:
+        if self._expire is None:
+            return False
+        duration = self.duration.total_seconds() if self.duration is not None else 0
+        return self._expire - time.time() < margin + duration  # 再生し終えるまで有効か確認する
+
+    async def refresh(self) -> None:
+        if self.url is None:
+            raise utils.InvalidAttributeError(f"{self.__class__.__name__}.url")
+        utils.logger.info(f"Refreshing Stream URL (Track: {self.title}, Expire: {self._expire})")
+        try:
+            info = await youtube.download(self.url)
+        except errors.YouTubeDLPError:
+            PLAYBACK.refresh_failures += 1
+            raise
+
+        PLAYBACK.refreshes.add()
+        self._source = info.url
+        self.headers = self.format_headers(info)
+        self._expire = info.expire
+        self.codec = info.acodec
+        self.bitrate = info.abr
+        self.sample_rate = info.asr
+        self.probe_profile = probe.select(info.extractor, info.protocol, info.ext)
+
+    async def resolve(self) -> Self:
+        if self.is_expired():
+            await self.refresh()
+        return self
+
+    async def validate(self) -> Self:
+        if self._source is None or self.is_expired():
+            return await self.resolve()
+        headers = dict(header.split(": ", 1) for header in self.headers)
+        if not await youtube.validate(self._source, headers):
+            utils.logger.warning(f"Invalid Stream URL (Track: {self.title})")
+            PLAYBACK.invalid_streams += 1
+            if self.url is not None:
+                youtube.invalidate(self.url)  # キャッシュ済みのURLも無効なため解決し直す
+            await self.refresh()
+        return self
+
+    def format_before_options(self) -> list[str]:
+        before_options = [*FFMPEG_BEFORE_OPTIONS, *probe.options(self.probe_profile)]
+        if self.headers:
+            before_options.append(f'-headers "{"\r\n".join(self.headers)}"')
+        return before_options
+
+    def analyze(self) -> asyncio.Task[None] | None:
+        if self._source is None or self.analysis is not None:
+            return None
+        before_options = " ".join(self.format_before_options())
+        return loudness.ANALYZER.schedule(self.cache_key, self._source, before_options, super().playback_duration)
 
     def get_audio_source(
         self,
         *,
         before_options: Iterable[str] | str | None = None,
         options: Iterable[str] | str | None = None,
+        passthrough: bool = False,
+        owner: ProcessOwner | None = None,
+        start: float | None = None,
     ) -> AudioSource:
+        if self._analysis is None:
+            self._analysis = loudness.ANALYZER.get(self.cache_key)  # 再生時のみヒット率に含める
+        analysis = self._analysis
+        start, _ = self.playback_range(start)
         if before_options is None:
-            before_options = FFMPEG_BEFORE_OPTIONS.copy()
-            if self.headers:
-                before_options.append(f'-headers "{"\r\n".join(self.headers)}"')
+            before_options = self.format_before_options()
         if options is None:
-            options = FFMPEG_OPTIONS.copy()
-
-        return super().get_audio_source(before_options=before_options, options=options)
+            passthrough = self.passthrough  # フィルターを指定した場合はPCMでデコードする
+            if passthrough:
+                options = FFMPEG_OPUS_OPTIONS.copy()
+            elif analysis is not None and analysis.gain is not None:
+                options = [*FFMPEG_OPUS_OPTIONS, f"-af volume={analysis.gain:.2f}dB"]  # 事前解析した固定ゲイン
+            else:
+                options = FFMPEG_OPTIONS.copy()
+            if analysis is not None and analysis.end is not None:
+                options.append(f"-t {max(analysis.end - start, 0):.3f}")  # 末尾の無音を飛ばす
+        if passthrough:
+            PLAYBACK.passthrough += 1
+        PLAYBACK.probes[self.probe_profile or probe.PROBE_DEFAULT] += 1
+
+        return super().get_audio_source(
+            before_options=before_options,
+            options=options,
+            passthrough=passthrough,
+            owner=owner,
+            start=start,
+        )
 
     def set_default_info(self, track: Track) -> Self:
         self._url = self.url or track.url
         self._channel_url = self.channel_url or track.channel_url
         self._thumbnail = self.thumbnail or track.thumbnail
         self._duration = self.duration or track.duration
+        self.start = self.start or track.start
 
         return self
 
 
-class GoogleSearchTrack(Track):
+class LazyTrack(Track):
+    __slots__ = ()
+
+    async def download(self) -> YouTubeDLPTrack:
+        if self.url is None:
+            raise utils.InvalidAttributeError(f"{self.__class__.__name__}.url")
+        track = await YouTubeDLPTrack.download(self.user, self.url)
+        return track.set_default_info(self)
+
+    async def resolve(self) -> YouTubeDLPTrack:
+        return await self.download()
+
+
+class GoogleSearchTrack(LazyTrack):
+    __slots__ = ()
+
     @classmethod
     async def search_top(cls, user: User | Member | ClientUser, word: str) -> Self:
         tracks, _ = await cls.search(user, word, results=1)
@@ -235,9 +517,23 @@ class GoogleSearchTrack(Track):
         info = await youtube.search(word, results=results, token=token)
         token = info.get("nextPageToken", "")
         tracks = [cls.from_info(user, i) for i in info.get("items", [])]
+        await cls.enrich(tracks)
 
         return tracks, token
 
+    @classmethod
+    async def enrich(cls, tracks: list[Self]) -> None:
+        video_ids = [track.video_id for track in tracks if track.video_id is not None]
+        try:
+            details = await youtube.videos(video_ids)
+        except errors.GoogleAPIError:
+            utils.logger.warning(f"Failed to Enrich Tracks (Videos: {len(video_ids)})")
+            return
+
+        for track in tracks:
+            if track.video_id is not None and track.video_id in details:
+                track.set_details(details[track.video_id])
+
     @classmethod
     def from_info(cls, user: User | Member | ClientUser | None, info: dict[str, dict]) -> Self:
         snippet = info.get("snippet", {})
@@ -260,11 +556,35 @@ class GoogleSearchTrack(Track):
 
         return cls(user=user, title=title, url=url, channel=channel, channel_url=channel_url, thumbnail=thumbnail)
 
-    async def download(self) -> YouTubeDLPTrack:
-        if self.url is None:
-            raise utils.InvalidAttributeError(f"{self.__class__.__name__}.url")
-        track = await YouTubeDLPTrack.download(self.user, self.url)
-        return track.set_default_info(self)
+    def set_details(self, video: youtube.VideoDetails) -> Self:
+        if video.duration is not None:
+            self._duration = timedelta(seconds=video.duration)
+
+        return self
+
+
+class PlaylistTrack(LazyTrack):
+    __slots__ = ()
+
+    @classmethod
+    def from_entry(cls, user: User | Member | ClientUser | None, entry: youtube.PlaylistEntry) -> Self:
+        return cls(
+            user=user,
+            title=entry.title,
+            url=entry.url,
+            channel=entry.uploader,
+            channel_url=entry.uploader_url,
+            thumbnail=entry.thumbnail,
+            duration=entry.duration,
+        )
+
+
+class QueueChange(NamedTuple):
+    version: int
+    kind: str  # put, get, delete, replace, move, current, finish, clear, loop, reset
+    index: int | None = None
+    track: Track | None = None
+    target: int | None = None  # moveの移動先
 
 
 class MusicQueue(asyncio.Queue):
@@ -274,15 +594,31 @@ class MusicQueue(asyncio.Queue):
         self._queue_loop = False
         self._auto_play: str | None = None
         self._playing = asyncio.Event()
+        self._version = 0
+        self._journal: collections.deque[QueueChange] = collections.deque(maxlen=QUEUE_JOURNAL_SIZE)
 
     def _init(self, maxsize) -> None:  # noqa: ANN001, ARG002
-        self._queue: collections.deque[Track] = collections.deque()
+        # インポートで数千曲が並ぶキューでも任意の位置の操作と合計時間の取得を高速に行う
+        self._queue: BlockList[Track] = BlockList(weight=lambda track: track.playback_duration or 0.0)
+
+    def _record(
+        self,
+        kind: str,
+        index: int | None = None,
+        track: Track | None = None,
+        target: int | None = None,
+    ) -> None:
+        self._version += 1
+        self._journal.append(QueueChange(self._version, kind, index, track, target))
 
     def _get(self) -> Track:
-        return self._queue.popleft()
+        track = self._queue.popleft()
+        self._record("get", 0, track)
+        return track
 
     def _put(self, item: Track) -> None:
         self._queue.append(item)
+        self._record("put", len(self._queue) - 1, item)
 
     def get_nowait(self) -> Track:
         track: Track = super().get_nowait()
@@ -300,13 +636,38 @@ class MusicQueue(asyncio.Queue):
         return self._queue[idx]
 
     def __setitem__(self, idx: int, value: Track) -> None:
-        self._queue[idx] = value
+        index = range(len(self._queue))[idx]
+        self._queue[index] = value
+        self._record("replace", index, value)
 
     def __delitem__(self, idx: int) -> None:
-        del self._queue[idx]
+        index = range(len(self._queue))[idx]
+        track = self._queue[index]
+        del self._queue[index]
+        self._record("delete", index, track)
 
-    def __hash__(self) -> int:
-        return hash((self._queue_loop, self._current, *self._queue))
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def duration(self) -> float:
+        return self._queue.total
+
+    def duration_before(self, index: int) -> float:
+        return self._queue.weight_before(index)
+
+    def changes(self, since: int) -> list[QueueChange] | None:
+        # 履歴から消えた変更がある場合はNoneを返し、呼び出し側で作り直させる
+        if since >= self._version:
+            return []
+        if not self._journal or since < self._journal[0].version - 1:
+            return None
+        return list(itertools.islice(self._journal, since - self._journal[0].version + 1, None))
+
+    def changed(self, since: int, *kinds: str) -> bool:
+        changes = self.changes(since)
+        return changes is None or any(change.kind in kinds for change in changes)
 
     @property
     def current(self) -> Track | None:
@@ -333,6 +694,7 @@ class MusicQueue(asyncio.Queue):
 
     def toggle(self) -> bool:
         self._queue_loop = not self._queue_loop
+        self._record("loop")
         return self._queue_loop
 
     def enable_auto_play(self, word: str) -> None:
@@ -341,13 +703,74 @@ class MusicQueue(asyncio.Queue):
     def disable_auto_play(self) -> None:
         self._auto_play = None
 
+    def replace(self, old: Track, new: Track) -> bool:
+        for i, track in enumerate(self._queue):
+            if track is old:
+                self[i] = new
+                return True
+        return False
+
+    def reweight(self, target: Track) -> bool:
+        # 解析などで再生時間が変わった曲の合計時間への寄与を更新する
+        for i, track in enumerate(self._queue):
+            if track is target:
+                self._queue.reweight(i)
+                return True
+        return False
+
+    def move(self, source: int, destination: int) -> Track:
+        source = range(len(self._queue))[source]
+        destination = range(len(self._queue))[destination]
+        track = self._queue.move(source, destination)
+        self._record("move", source, track, destination)
+        return track
+
+    def shuffle(self) -> None:
+        self._queue.shuffle()
+        self._record("reset")
+
+    def remove_if(self, predicate: Callable[[Track], bool]) -> list[Track]:
+        removed = self._queue.remove_if(predicate)
+        if removed:
+            self._record("reset")
+        return removed
+
+    def dedupe(self) -> list[Track]:
+        # 再生中の曲を含め、同じ動画が既に前にある曲を削除する
+        seen: set[str] = set()
+        if self._current is not None:
+            seen.add(self._current.video_id or self._current.url)
+
+        def duplicated(track: Track) -> bool:
+            key = track.video_id or track.url
+            if key is None:
+                return False
+            if key in seen:
+                return True
+            seen.add(key)
+            return False
+
+        return self.remove_if(duplicated)
+
+    def remove_user(self, user_id: int) -> list[Track]:
+        return self.remove_if(lambda track: track.user is not None and track.user.id == user_id)
+
+    def replace_current(self, track: Track) -> None:
+        if self._current is not None:
+            self._current = track
+            self._record("current", None, track)
+
     def finish(self) -> None:
+        if self._current is not None:
+            self._record("finish", None, self._current)
         self._current = None
         self._playing.set()
 
     def clear(self) -> None:
         self._queue.clear()
-        self.finish()
+        self._current = None
+        self._playing.set()
+        self._record("clear")
 
     async def wait(self) -> None:
         await self._playing.wait()
@@ -371,11 +794,34 @@ class MusicState:
         self._message: Message | None = None
         self._voice: VoiceClient | None = None
         self._timeout: asyncio.Timeout | None = None
+        self._lookahead = asyncio.Event()
+        self._preload: asyncio.Task[AudioSource | None] | None = None
+        self._preload_track: Track | None = None
+        self._source: audio.MonitoredAudio | None = None
+        self._auto_play_retry: asyncio.TimerHandle | None = None
+        self.auto_play_deferred = False
         self.queue = MusicQueue()
+        self.health = audio.PlaybackHealth(parent=audio.HEALTH)
 
     def __del__(self) -> None:
         self.cancel()
 
+    @property
+    def position(self) -> float | None:
+        if self._source is None or self.queue.current is None:
+            return None
+        return self._source.position
+
+    def eta(self, index: int) -> float | None:
+        # 長さが不明な曲は0秒として、キュー内の曲が再生されるまでの秒数を求める
+        remaining = 0.0
+        if self.queue.current is not None:
+            duration = self.queue.current.playback_duration
+            if duration is None:
+                return None
+            remaining = max(duration - (self.position or 0.0), 0.0)
+        return remaining + self.queue.duration_before(index)
+
     @property
     def guild(self) -> Guild:
         return self._guild
@@ -441,6 +887,7 @@ class MusicState:
         user_id, session_id = self.get_session_info()
         await SESSION_SERVICE.create_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
         self.audio_loop.start()
+        self.lookahead_loop.start()
 
     async def move(self, interaction: Interaction) -> None:
         channel = self.get_voice_channel(interaction)
@@ -463,6 +910,7 @@ class MusicState:
         user_id, session_id = self.get_session_info()
         await SESSION_SERVICE.create_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
         self.audio_loop.start()
+        self.lookahead_loop.start()
 
     async def disconnect(self) -> None:
         if not self.is_connected():
@@ -485,6 +933,7 @@ class MusicState:
         utils.logger.info(f"Adding Track (Guild: {self.guild.name}, Track: {track.title})")
 
         await self.queue.put(track)
+        self._lookahead.set()
 
     async def skip(self) -> Track:
         if not self.is_connected():
@@ -503,22 +952,114 @@ class MusicState:
         self._bot.dispatch("music_auto_play", self)
         return track
 
-    async def remove_track(self, index: int) -> Track:
+    async def seek(self, position: float) -> Track:
+        if not self.is_connected():
+            raise errors.NotConnectedError
+        if not self.audio_loop.is_running():
+            raise errors.NotRunningAudioLoopError
+        if not await self.is_session_active():
+            raise utils.MissingSessionError
+        current = self._source
+        if self.queue.current is None or current is None:
+            raise errors.NoTrackPlayingError
+        track = self.queue.current
+        if position < 0 or (track.duration is not None and position >= track.duration.total_seconds()):
+            raise errors.InvalidSeekPositionError(timedelta(seconds=int(position)), track.duration)
+        utils.logger.info(f"Seeking (Guild: {self.guild.name}, Track: {track.title}, Position: {position:.1f})")
+
+        start = time.monotonic()
+        resolved = await track.resolve()  # 取得済みのストリームURLを再利用し、期限切れの場合のみ再取得する
+        if self.queue.current is not track or self._source is not current:
+            raise errors.NoTrackPlayingError
+        self.queue.replace_current(resolved)
+
+        owner = ProcessOwner(guild_id=self.guild.id, guild=self.guild.name, track=resolved.title)
+        offset, end = resolved.playback_range(position)
+        opener = functools.partial(resolved.get_audio_source, owner=owner, start=offset)
+        source = audio.PrebufferedAudio(await open_source(opener))
+        try:
+            # 新しいFFmpegの先頭フレームが揃うまでは元のソースの再生を続ける
+            await asyncio.to_thread(source.fill, GAPLESS_BUFFER_FRAMES)
+        except asyncio.CancelledError:
+            source.cleanup()
+            raise
+        if self.queue.current is not resolved or self._source is not current:
+            source.cleanup()
+            raise errors.NoTrackPlayingError
+
+        old = await asyncio.to_thread(current.replace, source, offset=offset, end=end)
+        await asyncio.to_thread(old.cleanup)
+        self.discard_preload()
+        self.schedule_preload(end)
+        PLAYBACK.seeks.record(time.monotonic() - start)
+        return resolved
+
+    async def check_editable(self) -> None:
         if not self.is_connected():
             raise errors.NotConnectedError
         if not self.audio_loop.is_running():
             raise errors.NotRunningAudioLoopError
         if not await self.is_session_active():
             raise utils.MissingSessionError
+
+    def discard_stale_preload(self) -> None:
+        # 次に再生する曲が入れ替わった場合は起動済みのFFmpegを止める
+        if self._preload_track is not None and (self.queue.empty() or self.queue[0] is not self._preload_track):
+            self.discard_preload()
+
+    async def remove_track(self, index: int) -> Track:
+        await self.check_editable()
         if not 0 <= index < self.queue.qsize():
             raise errors.InvalidTrackIndexError(index, self.queue.qsize())
         track = self.queue[index]
         utils.logger.info(f"Removing Track (Guild: {self.guild.name}, Track: {track.title})")
 
         del self.queue[index]
+        if track is self._preload_track:
+            self.discard_preload()
         self._bot.dispatch("music_auto_play", self)
         return track
 
+    async def move_track(self, source: int, destination: int) -> Track:
+        await self.check_editable()
+        for index in (source, destination):
+            if not 0 <= index < self.queue.qsize():
+                raise errors.InvalidTrackIndexError(index, self.queue.qsize())
+        track = self.queue.move(source, destination)
+        utils.logger.info(
+            f"Moving Track (Guild: {self.guild.name}, Track: {track.title}, From: {source}, To: {destination})",
+        )
+
+        self.discard_stale_preload()
+        return track
+
+    async def shuffle(self) -> None:
+        await self.check_editable()
+        utils.logger.info(f"Shuffling Queue (Guild: {self.guild.name}, Tracks: {self.queue.qsize()})")
+
+        self.queue.shuffle()
+        self.discard_stale_preload()
+
+    async def remove_duplicates(self) -> list[Track]:
+        await self.check_editable()
+        tracks = self.queue.dedupe()
+        utils.logger.info(f"Removing Duplicate Tracks (Guild: {self.guild.name}, Tracks: {len(tracks)})")
+
+        self.discard_stale_preload()
+        self._bot.dispatch("music_auto_play", self)
+        return tracks
+
+    async def remove_user_tracks(self, user: User | Member) -> list[Track]:
+        await self.check_editable()
+        tracks = self.queue.remove_user(user.id)
+        utils.logger.info(
+            f"Removing User Tracks (Guild: {self.guild.name}, User: {user.display_name}, Tracks: {len(tracks)})",
+        )
+
+        self.discard_stale_preload()
+        self._bot.dispatch("music_auto_play", self)
+        return tracks
+
     async def suggestion(self) -> GoogleSearchTrack:
         if not self.is_connected():
             raise errors.NotConnectedError
@@ -530,14 +1071,16 @@ class MusicState:
             raise errors.InvalidAutoPlayStateError
 
         user_id, session_id = self.get_session_info()
-        info = await utils.run_agent(
-            SESSION_SERVICE,
-            RUNNER,
-            app_name=APP_NAME,
-            user_id=user_id,
-            session_id=session_id,
-            query=self.queue.auto_play,
-        )
+        with quota.GEMINI.admit(quota.Cost.gemini_suggestion, quota.Priority.background):
+            info = await utils.run_agent(
+                SESSION_SERVICE,
+                RUNNER,
+                app_name=APP_NAME,
+                user_id=user_id,
+                session_id=session_id,
+                query=self.queue.auto_play,
+            )
+        self.auto_play_deferred = False
 
         try:
             info = json.loads(info)
@@ -546,6 +1089,15 @@ class MusicState:
 
         return GoogleSearchTrack(self._bot.user, **info)
 
+    def defer_auto_play(self, delay: float) -> bool:
+        # クォータが補充される頃に自動再生をやり直し、ユーザーの設定は変更しない
+        if self._auto_play_retry is not None:
+            self._auto_play_retry.cancel()
+        self._auto_play_retry = self._bot.loop.call_later(delay, self._bot.dispatch, "music_auto_play", self)
+        notify = not self.auto_play_deferred  # 通知は上限に達した最初の1回のみ
+        self.auto_play_deferred = True
+        return notify
+
     def cancel(self) -> None:
         if not self.audio_loop.is_running():
             return
@@ -566,6 +1118,98 @@ class MusicState:
         if self._timeout is not None and not self._timeout.expired():
             self._timeout.reschedule(self.when_timeout())
 
+    def open_cache(self, track: Track) -> AudioSource | None:
+        if track.start > 0:  # キャッシュは曲の先頭から保存されている
+            return None
+        return audio.OPUS_CACHE.open(track.cache_key)
+
+    def record_source(self, track: Track) -> AudioSource:
+        owner = ProcessOwner(guild_id=self.guild.id, guild=self.guild.name, track=track.title)
+        source = track.get_audio_source(owner=owner)
+        if track.start > 0:
+            return source
+        return audio.OPUS_CACHE.record(track.cache_key, source, track.playback_duration)
+
+    def schedule_preload(self, end: float | None) -> None:
+        if GAPLESS_PRELOAD <= 0 or end is None:
+            return
+        self._preload = asyncio.create_task(self.preload(end))
+
+    async def wait_preload(self, end: float) -> None:
+        # 一時停止中は再生位置が進まないため、経過時間ではなく再生位置が終了間際になるまで待つ
+        while True:
+            position = self.position
+            delay = end - position - GAPLESS_PRELOAD if position is not None else 0.0
+            if delay <= 0:
+                return
+            await asyncio.sleep(max(delay, GAPLESS_POLL_INTERVAL))
+
+    async def preload(self, end: float) -> AudioSource | None:
+        await self.wait_preload(end)
+        if self.queue.empty():
+            return None
+        track = self._preload_track = self.queue[0]
+
+        source = self.open_cache(track)
+        if source is not None:
+            return source
+        try:
+            resolved = await track.resolve()
+        except (utils.InvalidAttributeError, errors.YouTubeDLPError):
+            utils.logger.warning(f"Failed to Preload Track (Guild: {self.guild.name}, Track: {track.title})")
+            return None
+        if resolved is not track and not self.queue.replace(track, resolved):
+            return None
+        self._preload_track = resolved
+
+        # 再生終了前にFFmpegを起動し、接続・プローブ・先頭フレームの読み込みを済ませておく
+        utils.logger.debug(f"Preloading Track (Guild: {self.guild.name}, Track: {resolved.title})")
+        try:
+            source = audio.PrebufferedAudio(await open_source(functools.partial(self.record_source, resolved)))
+        except (ClientException, errors.TooManyProcessesError):
+            utils.logger.exception(f"Failed to Preload Track (Guild: {self.guild.name}, Track: {resolved.title})")
+            return None
+        try:
+            await asyncio.to_thread(source.fill, GAPLESS_BUFFER_FRAMES)
+        except asyncio.CancelledError:
+            source.cleanup()
+            raise
+        return source
+
+    async def take_preload(self, track: Track) -> AudioSource | None:
+        if self._preload is None or self._preload_track is not track:
+            self.discard_preload()
+            return None
+        task = self._preload
+        self._preload = None
+        self._preload_track = None
+        source = await task
+        if source is not None:
+            PLAYBACK.preloads += 1
+        return source
+
+    def discard_preload(self) -> None:
+        task = self._preload
+        self._preload = None
+        self._preload_track = None
+        if task is None:
+            return
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None and (source := task.result()) is not None:
+            utils.logger.debug(f"Discarding Preloaded Track (Guild: {self.guild.name})")
+            source.cleanup()
+
+    async def open_track(self, track: Track) -> AudioSource:
+        while True:
+            if not process.SUPERVISOR.is_available():
+                utils.logger.warning(f"Waiting for FFmpeg Process (Guild: {self.guild.name}, Track: {track.title})")
+                await process.SUPERVISOR.wait_available()
+            try:
+                return await open_source(functools.partial(self.record_source, track))
+            except errors.TooManyProcessesError:
+                continue  # 待機中に他のサーバーが先に枠を使った場合は再び空きを待つ
+
     @tasks.loop()
     async def audio_loop(self) -> None:
         try:
@@ -578,16 +1222,50 @@ class MusicState:
         finally:
             self._timeout = None
 
+        self._lookahead.set()
+
+        source = await self.take_preload(track)
+        if source is None:
+            source = self.open_cache(track)  # キャッシュ済みの曲はストリームURLを取得しない
+        if source is None:
+            start = time.monotonic()
+            try:
+                track = await track.resolve()
+            except (utils.InvalidAttributeError, errors.YouTubeDLPError):
+                utils.logger.exception(f"Failed to Resolve Track (Guild: {self.guild.name}, Track: {track.title})")
+                self.queue.finish()
+                self._bot.dispatch("music_auto_play", self)
+                return
+            PLAYBACK.resolve_wait.record(time.monotonic() - start)
+            self.queue.replace_current(track)  # プレースホルダーを取得済みの曲に置き換える
+            source = await self.open_track(track)
+            if isinstance(track, YouTubeDLPTrack):
+                track.analyze()  # 次回以降の再生のために音量を解析しておく
+
         utils.logger.info(f"Start Playing (Guild: {self.guild.name}, Track: {track.title})")
+        offset, end = track.playback_range()
+        source = self._source = audio.MonitoredAudio(source, self.health, track.title, offset=offset, end=end)
+        if clock.AUDIO_CLOCK:  # 再生スレッドを起動せず、共通のクロックから送信する
+            clock.CLOCK.play(self.voice, source, after=self.next)
+        else:
+            self.voice.play(source, after=self.next)
+        PLAYBACK.plays.add()
+        self.schedule_preload(end)
         await self.set_status(f"🎵 Now Playing {track.title}")
-        self.voice.play(track.get_audio_source(), after=self.next)
         self._bot.dispatch("music_auto_play", self)
 
         await self.queue.wait()
-        await self.set_status(None)
-
+        self._source = None
+        utils.logger.debug(
+            f"Playback Health (Guild: {self.guild.name}, Track: {track.title}, Frames: {source.frames}, "
+            f"Late: {source.late_frames}, Underruns: {source.underruns}, "
+            f"Max Read: {utils.format_seconds(source.max_latency)}, "
+            f"Voice Latency: {utils.format_seconds(self.voice.average_latency)}, Load: {audio.load_average()})",
+        )
         if self.queue.queue_loop:
             await self.add_track(track)
+        if self.queue.empty():  # 次の曲がある場合はステータスの更新を待たずに再生する
+            await self.set_status(None)
 
     @audio_loop.before_loop
     async def before_audio_loop(self) -> None:
@@ -600,5 +1278,43 @@ class MusicState:
         utils.logger.debug(f"Ending Audio Loop (Guild: {self.guild.name}, Canceled: {canceled})")
 
         self.queue.clear()
+        self.discard_preload()
         if canceled and self.is_connected() and self.voice.is_playing():
             self.voice.stop()
+        task = self.lookahead_loop.get_task()
+        self.lookahead_loop.cancel()
+        if task is not None:
+            await asyncio.wait([task])  # 再接続時に再び開始できるよう終了を待つ
+        await process.SUPERVISOR.wait_released(self.guild.id)
+        process.SUPERVISOR.kill(self.guild.id)  # 後片付けされずに残ったFFmpegを終了する
+
+    async def prefetch(self, track: Track) -> None:
+        try:
+            if isinstance(track, YouTubeDLPTrack) and LOOKAHEAD_VALIDATE:
+                resolved = await track.validate()
+            else:
+                resolved = await track.resolve()
+        except (utils.InvalidAttributeError, errors.YouTubeDLPError):
+            utils.logger.warning(f"Failed to Prefetch Track (Guild: {self.guild.name}, Track: {track.title})")
+            PLAYBACK.prefetch_failures += 1
+            return
+
+        PLAYBACK.prefetches.add()
+        if isinstance(resolved, YouTubeDLPTrack) and (task := resolved.analyze()) is not None:
+            task.add_done_callback(lambda _: self.queue.reweight(resolved))  # 無音を除いた長さを合計時間に反映する
+        if resolved is not track:
+            self.queue.replace(track, resolved)
+
+    @tasks.loop()
+    async def lookahead_loop(self) -> None:
+        with contextlib.suppress(TimeoutError):
+            async with asyncio.timeout(LOOKAHEAD_INTERVAL):  # 長時間キューにある曲のURL期限切れも定期的に確認する
+                await self._lookahead.wait()
+        self._lookahead.clear()
+
+        tracks = [
+            track
+            for track in itertools.islice(self.queue.all(current=False), LOOKAHEAD_TRACKS)
+            if track.cache_key not in audio.OPUS_CACHE
+        ]
+        await asyncio.gather(*(self.prefetch(track) for track in tracks))
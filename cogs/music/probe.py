@@ -0,0 +1,48 @@
+import os
+
+import utils
+
+# ストリームの形式を判定するためにFFmpegが先頭から読み込む量の設定
+PROBE_PROFILES = {
+    "legacy": ["-probesize 500M", "-analyzeduration 0"],  # 0は既定値 (5秒) として扱われる
+    "fast": ["-probesize 32k", "-analyzeduration 500000"],
+    "robust": ["-probesize 5M", "-analyzeduration 5000000"],
+}
+PROBE_DEFAULT = "legacy"
+PROBE_OVERRIDE = os.getenv("FFMPEG_PROBE_PROFILE")
+
+# (extractor, protocol, ext) の順に照合し、None は任意の値に一致する
+# ヘッダーにコーデック情報を持つコンテナは最小限の読み込みで済み、HLSやMPEG-TSはパケットから判定する必要がある
+PROBE_RULES: list[tuple[str | None, str | None, str | None, str]] = [
+    (None, "m3u8", None, "robust"),
+    (None, "m3u8_native", None, "robust"),
+    (None, None, "ts", "robust"),
+    (None, None, "webm", "fast"),
+    (None, None, "weba", "fast"),
+    (None, None, "opus", "fast"),
+    (None, None, "ogg", "fast"),
+    (None, None, "m4a", "fast"),
+    (None, None, "mp3", "fast"),
+]
+
+
+def select(extractor: str | None, protocol: str | None, ext: str | None) -> str:
+    if PROBE_OVERRIDE in PROBE_PROFILES:
+        return PROBE_OVERRIDE  # pyright: ignore[reportReturnType]
+    for rule_extractor, rule_protocol, rule_ext, profile in PROBE_RULES:
+        if rule_extractor is not None and rule_extractor != extractor:
+            continue
+        if rule_protocol is not None and rule_protocol != protocol:
+            continue
+        if rule_ext is not None and rule_ext != ext:
+            continue
+        return profile
+    return PROBE_DEFAULT
+
+
+def options(profile: str | None) -> list[str]:
+    if profile not in PROBE_PROFILES:
+        if profile is not None:
+            utils.logger.warning(f"Unknown Probe Profile (Profile: {profile})")
+        profile = PROBE_DEFAULT
+    return PROBE_PROFILES[profile].copy()
@@ -0,0 +1,263 @@
+import asyncio
+import collections
+import contextlib
+import os
+import subprocess
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import NamedTuple, Protocol
+
+from discord.ext import tasks
+
+import utils
+
+from . import errors
+
+FFMPEG_MAX_PROCESSES = int(os.getenv("FFMPEG_MAX_PROCESSES", "32"))
+FFMPEG_SAMPLE_INTERVAL = 10
+FFMPEG_STATS_GUILDS = 5
+FFMPEG_RELEASE_TIMEOUT = 5  # 再生の終了後、プレイヤーによる後片付けを待つ秒数
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class ProcessOwner(NamedTuple):
+    guild_id: int | None
+    guild: str | None
+    track: str
+    playback: bool = True
+
+
+class ProcessHandle(Protocol):
+    # asyncioのプロセスやワーカー内で起動したFFmpegも同じように管理する
+    @property
+    def pid(self) -> int: ...
+
+    @property
+    def returncode(self) -> int | None: ...
+
+    def kill(self) -> None: ...
+
+
+class SupervisedProcess:
+    def __init__(self, process: subprocess.Popen | ProcessHandle, owner: ProcessOwner) -> None:
+        self.process = process
+        self.owner = owner
+        self.pid = process.pid
+        self.started = time.monotonic()
+        self.cpu_percent = 0.0
+        self.rss = 0
+        self._cpu_time: float | None = None
+        self._sampled = self.started
+
+    def is_alive(self) -> bool:
+        if isinstance(self.process, subprocess.Popen):
+            return self.process.poll() is None
+        return self.process.returncode is None
+
+    def kill(self) -> None:
+        try:
+            self.process.kill()
+        except ProcessLookupError:
+            return
+
+    def sample(self) -> None:
+        proc = Path("/proc") / str(self.pid)
+        try:
+            stat = (proc / "stat").read_text().rsplit(")", 1)[1].split()
+            statm = (proc / "statm").read_text().split()
+        except OSError:
+            return  # /procが無い環境では計測しない
+
+        now = time.monotonic()
+        cpu_time = (int(stat[11]) + int(stat[12])) / CLOCK_TICKS  # utime + stime
+        if self._cpu_time is not None and now > self._sampled:
+            self.cpu_percent = (cpu_time - self._cpu_time) / (now - self._sampled) * 100
+        self._cpu_time = cpu_time
+        self._sampled = now
+        self.rss = int(statm[1]) * PAGE_SIZE
+
+
+class ProcessSupervisor:
+    def __init__(self, max_processes: int = FFMPEG_MAX_PROCESSES) -> None:
+        self.max_processes = max(1, max_processes)
+        self._processes: dict[int, SupervisedProcess] = {}
+        self._lock = threading.Lock()  # プレイヤーのスレッドからも終了したプロセスを取り除く
+        self._pending = 0  # 上限の確認後、起動中で登録されていないプロセスの数
+        self._available = asyncio.Event()
+        self._available.set()
+        self._released = asyncio.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+        self.spawned = 0
+        self.peak = 0
+        self.rejected = 0
+        self.orphans = 0
+
+    @property
+    def processes(self) -> list[SupervisedProcess]:
+        with self._lock:
+            return list(self._processes.values())
+
+    @property
+    def playbacks(self) -> int:
+        return sum(process.owner.playback for process in self.processes)
+
+    def _reserved(self) -> int:
+        return sum(process.owner.playback for process in self._processes.values()) + self._pending
+
+    def is_available(self) -> bool:
+        self.prune()
+        with self._lock:
+            return self._reserved() < self.max_processes
+
+    async def wait_available(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        while not self.is_available():
+            self._available.clear()
+            await self._available.wait()
+
+    async def wait_released(self, guild_id: int) -> None:
+        # プレイヤーのスレッドが後片付けを終えるまで待ち、残ったプロセスのみを孤立したものとみなす
+        self._loop = asyncio.get_running_loop()
+        with contextlib.suppress(TimeoutError):
+            async with asyncio.timeout(FFMPEG_RELEASE_TIMEOUT):
+                while True:
+                    self._released.clear()
+                    self.prune()
+                    if not any(process.owner.guild_id == guild_id for process in self.processes):
+                        return
+                    await self._released.wait()
+
+    def spawn[T: subprocess.Popen | ProcessHandle](self, owner: ProcessOwner, spawn: Callable[[], T]) -> T:
+        if owner.playback:
+            self.prune()
+            with self._lock:  # 上限の確認と枠の確保の間に他のスレッドが起動しないようにする
+                reserved = self._reserved() < self.max_processes
+                if reserved:
+                    self._pending += 1
+            if not reserved:
+                self.rejected += 1
+                utils.logger.warning(f"FFmpeg Process Limit Reached (Guild: {owner.guild}, Track: {owner.track})")
+                raise errors.TooManyProcessesError
+        try:
+            process = spawn()
+        except BaseException:
+            if owner.playback:
+                with self._lock:
+                    self._pending -= 1
+                self.notify()
+            raise
+        self.register(process, owner, reserved=owner.playback)
+        return process
+
+    def register(
+        self,
+        process: subprocess.Popen | ProcessHandle,
+        owner: ProcessOwner,
+        *,
+        reserved: bool = False,
+    ) -> None:
+        with self._lock:
+            self._processes[process.pid] = SupervisedProcess(process, owner)
+            if reserved:
+                self._pending -= 1  # 確保していた枠を登録したプロセスに置き換える
+        self.spawned += 1
+        self.peak = max(self.peak, self.playbacks)
+        utils.logger.debug(
+            f"Registered FFmpeg Process (PID: {process.pid}, Guild: {owner.guild}, Track: {owner.track})",
+        )
+
+    def prune(self) -> None:
+        with self._lock:
+            dead = [pid for pid, process in self._processes.items() if not process.is_alive()]
+            for pid in dead:
+                del self._processes[pid]
+            available = self._reserved() < self.max_processes
+        if dead:
+            self._set(self._released)
+        if available:
+            self.notify()
+
+    def notify(self) -> None:
+        self._set(self._available)
+
+    def _set(self, event: asyncio.Event) -> None:
+        # asyncio.Eventはスレッドセーフではないため、待機しているループのスレッドで設定する
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            event.set()
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            event.set()
+        else:
+            with contextlib.suppress(RuntimeError):  # 終了処理中にループが閉じられた場合
+                loop.call_soon_threadsafe(event.set)
+
+    def kill(self, guild_id: int | None = None) -> int:
+        killed = 0
+        for process in self.processes:
+            if guild_id is not None and process.owner.guild_id != guild_id:
+                continue
+            if process.is_alive():
+                utils.logger.warning(
+                    f"Killing Orphan FFmpeg Process (PID: {process.pid}, Guild: {process.owner.guild})",
+                )
+                process.kill()
+                killed += 1
+        self.orphans += killed
+        self.prune()
+        return killed
+
+    def start(self) -> None:
+        if not self.sample.is_running():
+            self.sample.start()
+
+    def shutdown(self) -> None:
+        self.sample.cancel()
+        self.kill()
+
+    @tasks.loop(seconds=FFMPEG_SAMPLE_INTERVAL)
+    async def sample(self) -> None:
+        self.prune()
+        for process in self.processes:
+            process.sample()
+
+    def stats(self) -> dict[str, str]:
+        self.prune()
+        processes = self.processes
+        playbacks = [process for process in processes if process.owner.playback]
+        cpu = sum(process.cpu_percent for process in processes)
+        rss = sum(process.rss for process in processes)
+
+        guilds: collections.Counter[str] = collections.Counter()
+        guild_cpu: collections.Counter[str] = collections.Counter()
+        for process in playbacks:
+            guilds[process.owner.guild or "Unknown"] += 1
+            guild_cpu[process.owner.guild or "Unknown"] += process.cpu_percent
+        top = ", ".join(
+            f"{guild} {count} ({guild_cpu[guild]:.1f}%)" for guild, count in guilds.most_common(FFMPEG_STATS_GUILDS)
+        )
+
+        per_stream = "No Data"
+        if playbacks:
+            stream_cpu = sum(process.cpu_percent for process in playbacks) / len(playbacks)
+            stream_rss = sum(process.rss for process in playbacks) / len(playbacks)
+            per_stream = f"{stream_cpu:.1f}% CPU, {stream_rss / 1024 / 1024:.1f} MiB"
+        return {
+            "Processes": f"{len(playbacks)} / {self.max_processes} (Analysis: {len(processes) - len(playbacks)})",
+            "Spawned": f"{self.spawned} (Peak: {self.peak}, Rejected: {self.rejected}, Killed: {self.orphans})",
+            "Usage": f"{cpu:.1f}% CPU, {rss / 1024 / 1024:.1f} MiB",
+            "Per Stream": per_stream,
+            "Guilds": top or "No Process",
+        }
+
+
+SUPERVISOR = ProcessSupervisor()
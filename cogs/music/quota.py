@@ -0,0 +1,193 @@
+import contextlib
+import contextvars
+import enum
+import os
+import time
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from discord.utils import format_dt
+
+import utils
+
+from . import errors
+
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")  # Google APIのクォータは太平洋時間の0時にリセットされる
+QUOTA_RESERVE = 0.2
+QUOTA_BURST = 0.05
+QUOTA_MIN_RETRY = 60
+
+YOUTUBE_DAILY_QUOTA = int(os.getenv("YOUTUBE_DAILY_QUOTA", "10000"))
+GEMINI_DAILY_QUOTA = int(os.getenv("GEMINI_DAILY_QUOTA", "250"))
+
+
+class Cost:
+    youtube_search = 100
+    youtube_videos = 1
+    gemini_request = 1
+    gemini_suggestion = 5  # 自動再生の1回の提案で見込むリクエスト数 (検索の繰り返しと整形)
+
+
+class Priority(enum.IntEnum):
+    interactive = 0
+    background = 1
+
+
+class Reservation:
+    def __init__(self, cost: int) -> None:
+        self.cost = cost
+        self.remaining = cost
+
+
+def next_reset(now: datetime) -> datetime:
+    local = now.astimezone(QUOTA_TIMEZONE)
+    midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + timedelta(days=1)
+
+
+class QuotaGovernor:
+    def __init__(self, name: str, daily_budget: int, *, reserve: float = QUOTA_RESERVE) -> None:
+        self.name = name
+        self.reserve = reserve
+        self.spent = 0
+        self.calls = dict.fromkeys(Priority, 0)
+        self.rejected = dict.fromkeys(Priority, 0)
+        self.refunded = 0
+        self._reservation: contextvars.ContextVar[Reservation | None] = contextvars.ContextVar(name, default=None)
+
+        now = datetime.now(QUOTA_TIMEZONE)
+        self.reset_at = next_reset(now)
+        self.period_start = now
+
+        self.set_budget(daily_budget)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def set_budget(self, daily_budget: int) -> None:
+        self.daily_budget = daily_budget
+        self.capacity = max(1.0, self.daily_budget * QUOTA_BURST)
+
+    @property
+    def remaining(self) -> int:
+        self._refill()
+        return max(0, self.daily_budget - self.spent)
+
+    @property
+    def headroom(self) -> float:
+        # 対話的な操作のために残す分を除いた、バックグラウンド呼び出しに使える残りの予算
+        return max(0.0, self.daily_budget - self.spent - self.daily_budget * self.reserve)
+
+    @property
+    def refill_rate(self) -> float:
+        # 残りの予算をリセットまでの時間に配分するため、対話的な操作で消費されるほど補充が遅くなる
+        seconds = (self.reset_at - datetime.now(QUOTA_TIMEZONE)).total_seconds()
+        return self.headroom / max(1.0, seconds)
+
+    def _refill(self) -> None:
+        now = datetime.now(QUOTA_TIMEZONE)
+        if now >= self.reset_at:
+            utils.logger.info(f"Quota Reset (Name: {self.name}, Spent: {self.spent}/{self.daily_budget})")
+            self.spent = 0
+            self.reset_at = next_reset(now)
+            self.period_start = now
+
+        monotonic = time.monotonic()
+        tokens = self.tokens + (monotonic - self._updated) * self.refill_rate
+        self.tokens = min(self.capacity, self.headroom, tokens)
+        self._updated = monotonic
+
+    def allowed(self, cost: int, priority: Priority = Priority.interactive) -> bool:
+        remaining = self.remaining
+        if priority == Priority.interactive:
+            return remaining >= cost
+        return remaining - cost >= self.daily_budget * self.reserve and self.tokens >= cost
+
+    def retry_after(self, cost: int, priority: Priority = Priority.background) -> float:
+        # 呼び出しが再び許可されるまでのおおよその秒数
+        if self.allowed(cost, priority):
+            return 0
+        until_reset = (self.reset_at - datetime.now(QUOTA_TIMEZONE)).total_seconds()
+        if priority == Priority.interactive or self.headroom < cost:
+            return until_reset
+        return min(until_reset, (cost - self.tokens) / self.refill_rate)
+
+    def charge(self, cost: int, priority: Priority = Priority.interactive) -> None:
+        reservation = self._reservation.get()
+        if reservation is not None and reservation.remaining >= cost:
+            reservation.remaining -= cost  # 受け付け済みの処理では確保した分から消費する
+            return
+
+        if not self.allowed(cost, priority):
+            self.rejected[priority] += 1
+            utils.logger.warning(
+                f"Quota Rejected (Name: {self.name}, Cost: {cost}, Priority: {priority.name}, "
+                f"Remaining: {self.remaining}/{self.daily_budget})",
+            )
+            raise errors.QuotaExceededError(self.name)
+
+        self.spent += cost
+        self.tokens = max(0.0, self.tokens - cost)
+        self.calls[priority] += 1
+
+    def refund(self, cost: int) -> None:
+        if cost <= 0:
+            return
+        self._refill()
+        self.spent = max(0, self.spent - cost)
+        self.tokens = min(self.capacity, self.tokens + cost)
+        self.refunded += cost
+
+    @contextlib.contextmanager
+    def admit(self, cost: int, priority: Priority = Priority.background) -> Iterator[Reservation]:
+        # 複数回の呼び出しを伴う処理は見込みのコストを最初に確保し、途中で上限に達して中断しないようにする
+        self.charge(cost, priority)
+        reservation = Reservation(cost)
+        token = self._reservation.set(reservation)
+        try:
+            yield reservation
+        finally:
+            self._reservation.reset(token)
+            self.refund(reservation.remaining)  # 使わなかった分は返却する
+
+    def projected_exhaustion(self) -> datetime | None:
+        remaining = self.remaining
+        now = datetime.now(QUOTA_TIMEZONE)
+        elapsed = (now - self.period_start).total_seconds()
+        if self.spent <= 0 or elapsed <= 0:
+            return None
+        exhaustion = now + timedelta(seconds=remaining / (self.spent / elapsed))
+        return exhaustion if exhaustion < self.reset_at else None
+
+    def stats(self) -> dict[str, str]:
+        exhaustion = self.projected_exhaustion()
+        calls = ", ".join(f"{priority.name} {self.calls[priority]}" for priority in Priority)
+        rejected = ", ".join(f"{priority.name} {self.rejected[priority]}" for priority in Priority)
+        return {
+            "Spent": f"{self.spent} / {self.daily_budget} ({self.spent / self.daily_budget:.1%})",
+            "Calls": calls,
+            "Rejected": rejected,
+            "Refunded": str(self.refunded),
+            "Reset": format_dt(self.reset_at, "R"),
+            "Exhaustion": format_dt(exhaustion, "R") if exhaustion is not None else "Not Expected",
+        }
+
+
+YOUTUBE = QuotaGovernor("YouTube Data API", YOUTUBE_DAILY_QUOTA)
+GEMINI = QuotaGovernor("Gemini API", GEMINI_DAILY_QUOTA)
+
+
+def partition(clusters: int) -> None:
+    # クラスターモードでは各ワーカーが同じAPIキーを使うため、1日の予算をワーカー数で分ける
+    clusters = max(1, clusters)
+    YOUTUBE.set_budget(YOUTUBE_DAILY_QUOTA // clusters)
+    GEMINI.set_budget(GEMINI_DAILY_QUOTA // clusters)
+
+
+def auto_play_retry_after() -> float:
+    # どちらのクォータで拒否されたかに関わらず、自動再生の提案に必要な分が両方で補充されるまで待つ
+    return max(
+        QUOTA_MIN_RETRY,
+        GEMINI.retry_after(Cost.gemini_suggestion),
+        YOUTUBE.retry_after(Cost.youtube_search + Cost.youtube_videos),
+    )
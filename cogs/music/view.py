@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Any, Self
 
 from discord import ButtonStyle, Color, Embed, Interaction
@@ -9,14 +9,15 @@ import utils
 
 from . import errors
 from .embed import QueueEmbed, QueueStatusEmbed, TrackEmbed
-from .model import GoogleSearchTrack, MusicState, Track
+from .model import GoogleSearchTrack, MusicState, QueueChange, Track
 
 
 class QueueView(utils.CustomView):
     def __init__(self, interaction: Interaction, state: MusicState) -> None:
         super().__init__(interaction)
         self.state = state
-        self.hash = hash(self.state.queue)
+        self.version = self.state.queue.version
+        self.position = self.state.position
         self.items_setup()
 
     def items_setup(self) -> None:
@@ -46,7 +47,7 @@ class QueueView(utils.CustomView):
 
     @property
     def embed(self) -> Embed:
-        return QueueEmbed(self.interaction.user, self.state.queue, **self.embed_kwargs)
+        return QueueEmbed(self.interaction.user, self.state.queue, self.position, **self.embed_kwargs)
 
     async def update(self, interaction: Interaction) -> None:
         if not self.state.is_connected():
@@ -55,10 +56,12 @@ class QueueView(utils.CustomView):
         if not interaction.response.is_done():
             await interaction.response.defer()
 
-        if self.hash == hash(self.state.queue):
+        position = self.state.position
+        if self.version == self.state.queue.version and position == self.position:
             return
 
-        self.hash = hash(self.state.queue)
+        self.version = self.state.queue.version
+        self.position = position
 
         self.button_toggle_loop.disabled = False
         self.button_tracks.disabled = False
@@ -73,7 +76,7 @@ class QueueView(utils.CustomView):
     async def toggle_loop(self, interaction: Interaction) -> None:
         if not self.state.is_connected():
             raise errors.NotConnectedError
-        if self.hash != hash(self.state.queue):
+        if self.state.queue.changed(self.version, "loop", "clear"):  # 表示とは逆の状態に切り替えないようにする
             raise errors.QueueChangedError
 
         if self.state.queue.toggle():
@@ -96,7 +99,7 @@ class QueueView(utils.CustomView):
     async def skip(self, interaction: Interaction) -> None:
         if not self.state.is_connected():
             raise errors.NotConnectedError
-        if self.hash != hash(self.state.queue):
+        if self.state.queue.changed(self.version, "get", "finish", "clear"):  # 表示中とは別の曲をスキップしない
             raise errors.QueueChangedError
 
         track = await self.state.skip()
@@ -107,8 +110,6 @@ class QueueView(utils.CustomView):
     async def tracks(self, interaction: Interaction) -> None:
         if not self.state.is_connected():
             raise errors.NotConnectedError
-        if self.hash != hash(self.state.queue):
-            raise errors.QueueChangedError
 
         view = QueueTracksView(interaction, self.state)
         embed = view.set_embed(color=Color.blue())
@@ -120,10 +121,12 @@ class QueueTracksView(utils.CustomView):
         super().__init__(interaction)
         self.user = interaction.user
         self.state = state
-        self.hash = hash(self.state.queue)
-        self.queue = tuple(self.state.queue.all())
+        self.version = self.state.queue.version
+        self.queue = list(self.state.queue.all())
+        self.has_current = self.state.queue.current is not None
         self.length = len(self.queue)
         self.index = 0
+        self.stale = False
         self.items_setup()
 
     def items_setup(self) -> None:
@@ -152,6 +155,7 @@ class QueueTracksView(utils.CustomView):
         self.button_last = Button(label="Last", emoji="⏭️", style=ButtonStyle.primary, disabled=disabled, row=1)
         self.button_last.callback = self.last
         self.add_item(self.button_last)
+        self.update_buttons()
 
     async def on_error(self, interaction: Interaction, error: Exception, item: Item) -> None:
         if isinstance(error, utils.MissingPermissionsError):
@@ -171,46 +175,99 @@ class QueueTracksView(utils.CustomView):
     def track(self) -> Track:
         return self.queue[self.index]
 
+    @property
+    def position(self) -> int:
+        # 再生中の曲を表示している場合は負の値になる
+        return self.index - int(self.has_current)
+
     @property
     def embed(self) -> Embed:
         if not self.queue:
             self.embed_kwargs["title"] = "No Tracks in the Queue"
             return utils.CustomEmbed(self.interaction.user, **self.embed_kwargs)
 
-        if self.index == 0:
+        position = self.position
+        if position < 0:
             self.embed_kwargs["title"] = "Now Playing"
         else:
-            self.embed_kwargs["title"] = f"Tracks in the Queue ({self.index}/{self.length - 1})"
+            self.embed_kwargs["title"] = f"Tracks in the Queue ({position + 1}/{self.length - int(self.has_current)})"
+            eta = self.state.eta(position)
+            if eta is not None:
+                self.embed_kwargs["title"] += f" | Starts in {timedelta(seconds=int(eta))}"
         return TrackEmbed(self.track, **self.embed_kwargs)
 
-    async def update(self, interaction: Interaction) -> None:
-        if not self.state.is_connected():
-            raise errors.NotConnectedError
-
-        if not interaction.response.is_done():
-            await interaction.response.defer()
-
-        if self.hash != hash(self.state.queue):
-            self.hash = hash(self.state.queue)
-            self.queue = list(self.state.queue.all())
-            self.length = len(self.queue)
+    def pop(self, position: int) -> None:
+        del self.queue[position]
+        if position == self.index:
+            self.stale = True
+        if position < self.index or self.index >= len(self.queue):
+            self.index = max(self.index - 1, 0)
+
+    def apply(self, change: QueueChange) -> None:
+        offset = int(self.has_current)
+        match change.kind:
+            case "put" if change.track is not None:
+                self.queue.append(change.track)
+            case "get" | "finish":
+                if self.has_current:
+                    self.pop(0)
+                self.has_current = change.kind == "get"
+            case "current" if self.has_current and change.track is not None:
+                self.queue[0] = change.track
+            case "replace" if change.index is not None and change.track is not None:
+                self.queue[offset + change.index] = change.track
+            case "delete" if change.index is not None:
+                self.pop(offset + change.index)
+            case "move" if change.index is not None and change.target is not None:
+                source, destination = offset + change.index, offset + change.target
+                self.queue.insert(destination, self.queue.pop(source))
+                if source == self.index:
+                    self.index = destination
+                else:
+                    self.index -= source < self.index
+                    self.index += destination <= self.index
+            case "clear":
+                self.queue.clear()
+                self.has_current = False
+                self.index = 0
+                self.stale = True
+
+    def rebuild(self) -> None:
+        track = self.queue[self.index] if 0 <= self.index < len(self.queue) else None
+        self.queue = list(self.state.queue.all())
+        self.has_current = self.state.queue.current is not None
+        index = next((i for i, queued in enumerate(self.queue) if queued is track), None)
+        if index is None:
             self.index = 0
+            self.stale = True
+        else:
+            self.index = index  # 並び替え後も表示中の曲を追いかける
+
+    def sync(self) -> None:
+        # 前回の表示以降の変更のみを反映し、表示中の曲が無くなった場合はstaleにする
+        queue = self.state.queue
+        changes = queue.changes(self.version)
+        if changes is None or any(change.kind == "reset" for change in changes):
+            self.rebuild()  # 変更履歴から消えている場合やシャッフルなどの一括変更は作り直す
+        else:
+            for change in changes:
+                self.apply(change)
+        self.version = queue.version
+        self.length = len(self.queue)
 
-        if self.index <= 0:
+    def update_buttons(self) -> None:
+        if self.position < 0:
             self.button_remove.label = "Skip"
             self.button_remove.emoji = "❌"
-            self.button_remove.disabled = self.length == 0
-
-            self.button_first.disabled = True
-            self.button_back.disabled = True
+            self.button_remove.disabled = False
         else:
-            user = self.track.user
+            user = self.track.user if self.queue else None
             self.button_remove.label = "Remove"
             self.button_remove.emoji = "🗑️"
-            self.button_remove.disabled = not (user is None or user.bot or user == self.user)
+            self.button_remove.disabled = not self.queue or not (user is None or user.bot or user.id == self.user.id)
 
-            self.button_first.disabled = False
-            self.button_back.disabled = False
+        self.button_first.disabled = self.index <= 0
+        self.button_back.disabled = self.index <= 0
 
         if self.index >= self.length - 1:
             self.button_next.disabled = True
@@ -219,24 +276,37 @@ class QueueTracksView(utils.CustomView):
             self.button_next.disabled = False
             self.button_last.disabled = False
 
+    async def update(self, interaction: Interaction) -> None:
+        if not self.state.is_connected():
+            raise errors.NotConnectedError
+
+        if not interaction.response.is_done():
+            await interaction.response.defer()
+
+        self.sync()
+        self.stale = False
+        self.index = min(max(self.index, 0), max(self.length - 1, 0))
+        self.update_buttons()
+
         await self.interaction.edit_original_response(embed=self.embed, view=self)
 
     def check_validity(self, interaction: Interaction) -> None:
         if not self.state.is_connected():
             raise errors.NotConnectedError
-        if self.hash != hash(self.state.queue):
-            raise errors.QueueChangedError
         if interaction.user != self.user:
             raise utils.MissingPermissionsError
+        self.sync()
 
     async def remove(self, interaction: Interaction) -> None:
         self.check_validity(interaction)
+        if self.stale:  # 表示中の曲が既に無い場合は別の曲を削除しない
+            raise errors.QueueChangedError
 
-        if self.index == 0:
+        if self.position < 0:
             track = await self.state.skip()
             embed = TrackEmbed(track=track, title="Skipped Now Playing", color=Color.green())
         else:
-            track = await self.state.remove_track(self.index - 1)
+            track = await self.state.remove_track(self.position)
             embed = TrackEmbed(track=track, title="Removed from the Queue", color=Color.green())
         await interaction.response.send_message(embed=embed)
         await self.update(interaction)
@@ -0,0 +1,291 @@
+import os
+import queue
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+
+from discord import ClientException
+from discord.player import AudioSource
+
+import utils
+
+from . import encoder, errors
+from .encoder import MESSAGE_ENDED, MESSAGE_FAILED, MESSAGE_HEADER, MESSAGE_PACKET, MESSAGE_SPAWNED
+from .process import SUPERVISOR, ProcessOwner
+
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", "0"))  # 0の場合はBotのプロセス内でエンコードする
+AUDIO_WORKER_STREAMS = int(os.getenv("AUDIO_WORKER_STREAMS", "8"))
+WORKER_CREDIT_BATCH = 10
+WORKER_OPEN_TIMEOUT = 10
+WORKER_READ_TIMEOUT = 10
+
+
+def ffmpeg_args(source: str, *, before_options: str | None = None, options: str | None = None) -> list[str]:
+    # FFmpegPCMAudioと同じ引数でPCMを出力させる
+    args = ["ffmpeg"]
+    if before_options:
+        args.extend(shlex.split(before_options))
+    args.extend(("-i", source, "-f", "s16le", "-ar", "48000", "-ac", "2", "-loglevel", "warning"))
+    if options:
+        args.extend(shlex.split(options))
+    args.append("pipe:1")
+    return args
+
+
+class WorkerAudio(AudioSource):
+    def __init__(self, worker: "AudioWorker", stream_id: int) -> None:
+        self.worker = worker
+        self.stream_id = stream_id
+        self.pid = 0
+        self.returncode: int | None = None
+        self.error: str | None = None
+        self._packets: queue.SimpleQueue[bytes] = queue.SimpleQueue()
+        self._spawned = threading.Event()
+        self._consumed = 0
+        self._ended = False
+        self._finished = False
+        self._current_error: Exception | None = None
+
+    def spawned(self, pid: int) -> None:
+        self.pid = pid
+        self._spawned.set()
+
+    def push(self, packet: bytes) -> None:
+        self._packets.put(packet)
+
+    def end(self, returncode: int, error: str | None = None) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        self.returncode = returncode
+        self.error = error
+        self._packets.put(b"")
+        self._spawned.set()
+
+    def wait_spawned(self) -> None:
+        if not self._spawned.wait(WORKER_OPEN_TIMEOUT):
+            self.kill()
+            msg = f"Audio Worker did not respond (Worker: {self.worker.worker_id})"
+            raise ClientException(msg)
+        if self.error is not None:
+            raise ClientException(self.error)
+
+    def read(self) -> bytes:
+        if self._ended:
+            return b""
+        try:
+            packet = self._packets.get(timeout=WORKER_READ_TIMEOUT)
+        except queue.Empty:
+            self._current_error = TimeoutError(f"Audio Worker Stalled (Stream: {self.stream_id})")
+            packet = b""
+        if not packet:
+            self._ended = True
+            if self.error is not None and self._current_error is None:
+                self._current_error = ClientException(self.error)
+            return b""
+
+        self._consumed += 1
+        if self._consumed >= WORKER_CREDIT_BATCH:
+            self.worker.send(("credit", self.stream_id, self._consumed))
+            self._consumed = 0
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def kill(self) -> None:
+        if self.returncode is None:
+            self.worker.send(("close", self.stream_id))
+            self.returncode = -signal.SIGKILL
+
+    def cleanup(self) -> None:
+        self.kill()
+        self.worker.release(self)
+        SUPERVISOR.prune()
+
+
+class AudioWorker:
+    def __init__(self, worker_id: int) -> None:
+        self.worker_id = worker_id
+        parent, child = socket.socketpair()
+        # encoder.pyを直接実行し、Botの起動スクリプトやCogのパッケージを読み込まずにすぐ応答できるようにする
+        self.process = subprocess.Popen(  # noqa: S603
+            [sys.executable, "-P", encoder.__file__, str(child.fileno())],
+            stdin=subprocess.DEVNULL,
+            pass_fds=(child.fileno(),),
+        )
+        child.close()
+        self.connection = Connection(parent.detach())
+
+        self.streams: dict[int, WorkerAudio] = {}
+        self.exited = False  # 接続が切れた時点ではプロセスの終了を回収できていない場合がある
+        self.packets = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._receiver = threading.Thread(target=self.receive, name=f"AudioWorker-{worker_id}-Receiver", daemon=True)
+        self._receiver.start()
+
+    def is_alive(self) -> bool:
+        return not self.exited and self.process.poll() is None and not self.connection.closed
+
+    def send(self, message: tuple) -> None:
+        with self._lock:  # 複数の再生スレッドから送信される
+            try:
+                self.connection.send(message)
+            except (OSError, ValueError):
+                return
+
+    def reserve(self, stream_id: int) -> WorkerAudio:
+        stream = WorkerAudio(self, stream_id)
+        with self._lock:
+            self.streams[stream_id] = stream
+        return stream
+
+    def open(self, stream: WorkerAudio, args: list[str]) -> WorkerAudio:
+        self.send(("open", stream.stream_id, args))
+        try:
+            stream.wait_spawned()
+        except ClientException:
+            self.release(stream)
+            raise
+        return stream
+
+    def release(self, stream: WorkerAudio) -> None:
+        with self._lock:
+            self.streams.pop(stream.stream_id, None)
+
+    def receive(self) -> None:
+        try:
+            while True:
+                message = self.connection.recv_bytes()
+                stream_id, kind, value = MESSAGE_HEADER.unpack_from(message)
+                stream = self.streams.get(stream_id)
+                if stream is None:
+                    continue
+                payload = message[MESSAGE_HEADER.size :]
+                if kind == MESSAGE_PACKET:
+                    self.packets += 1
+                    self.bytes += len(payload)
+                    stream.push(payload)
+                elif kind == MESSAGE_SPAWNED:
+                    stream.spawned(value)
+                elif kind == MESSAGE_ENDED:
+                    stream.end(value)
+                elif kind == MESSAGE_FAILED:
+                    stream.end(-1, payload.decode(errors="replace"))
+        except (EOFError, OSError):
+            pass
+        self.exited = True
+        for stream in tuple(self.streams.values()):
+            stream.end(-1, f"Audio Worker Exited (Worker: {self.worker_id})")
+
+    def shutdown(self) -> None:
+        self.connection.close()  # ワーカーは接続が閉じられるとFFmpegを停止して終了する
+        try:
+            self.process.wait(encoder.WORKER_STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class AudioWorkerPool:
+    def __init__(self, workers: int = AUDIO_WORKERS, streams: int = AUDIO_WORKER_STREAMS) -> None:
+        self.max_workers = max(0, workers)
+        self.max_streams = max(1, streams)
+        self._workers: list[AudioWorker] = []
+        self._lock = threading.Lock()
+        self._worker_ids = 0
+        self._stream_ids = 0
+
+        self.restarts = 0
+        self.fallbacks = 0
+        self.open_latency = utils.LatencyRecorder()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_workers > 0
+
+    @property
+    def streams(self) -> int:
+        return sum(len(worker.streams) for worker in self._workers)
+
+    def _prune(self) -> None:
+        for worker in tuple(self._workers):
+            if not worker.is_alive():
+                self._workers.remove(worker)
+                worker.shutdown()  # 終了コードを回収する
+                utils.logger.error(
+                    f"Audio Worker Exited (Worker: {worker.worker_id}, Code: {worker.process.returncode})",
+                )
+                self.restarts += 1
+
+    def _reserve(self) -> WorkerAudio | None:
+        # 空きのあるワーカーのうち最もストリームの少ないものに割り当て、無ければワーカーを追加する
+        with self._lock:
+            self._prune()
+            available = [worker for worker in self._workers if len(worker.streams) < self.max_streams]
+            if available:
+                worker = min(available, key=lambda worker: len(worker.streams))
+            elif len(self._workers) < self.max_workers:
+                self._worker_ids += 1
+                worker = AudioWorker(self._worker_ids)
+                self._workers.append(worker)
+                utils.logger.debug(f"Spawned Audio Worker (Worker: {worker.worker_id}, PID: {worker.process.pid})")
+            else:
+                return None
+            self._stream_ids += 1
+            return worker.reserve(self._stream_ids)
+
+    def open(
+        self,
+        source: str,
+        *,
+        owner: ProcessOwner,
+        before_options: str | None = None,
+        options: str | None = None,
+    ) -> WorkerAudio | None:
+        # ワーカーの応答を待つため、イベントループからはスレッドで呼び出す
+        stream = self._reserve()
+        if stream is None:
+            self.fallbacks += 1  # 全ワーカーが上限に達した場合はBotのプロセス内で再生する
+            return None
+
+        args = ffmpeg_args(source, before_options=before_options, options=options)
+        start = time.perf_counter()
+        try:
+            SUPERVISOR.spawn(owner, lambda: stream.worker.open(stream, args))
+        except errors.TooManyProcessesError:
+            stream.worker.release(stream)
+            raise
+        self.open_latency.record(time.perf_counter() - start)
+        return stream
+
+    def shutdown(self) -> None:
+        with self._lock:
+            utils.logger.debug(f"Shutting down Audio Workers (Workers: {len(self._workers)})")
+            for worker in self._workers:
+                worker.shutdown()
+            self._workers.clear()
+
+    def stats(self) -> dict[str, str]:
+        if not self.enabled:
+            return {"Mode": "In-Process"}
+        workers = ", ".join(f"#{worker.worker_id} {len(worker.streams)}" for worker in self._workers)
+        latency = self.open_latency
+        packets = sum(worker.packets for worker in self._workers)
+        size = sum(worker.bytes for worker in self._workers)
+        return {
+            "Workers": f"{len(self._workers)} / {self.max_workers} (Restarts: {self.restarts})",
+            "Streams": f"{self.streams} / {self.max_workers * self.max_streams} (Fallbacks: {self.fallbacks})",
+            "Per Worker": workers or "No Worker",
+            "Packets": f"{packets} ({size / 1024 / 1024:.1f} MiB)",
+            "Open Latency": f"avg {utils.format_seconds(latency.mean)}, max {utils.format_seconds(latency.max)}",
+        }
+
+
+POOL = AudioWorkerPool()
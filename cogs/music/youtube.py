@@ -1,13 +1,29 @@
 import asyncio
+import collections
+import contextlib
+import functools
+import itertools
+import json
 import os
+import re
+import threading
+import time
+import unicodedata
 import urllib.parse
+from collections.abc import AsyncGenerator, Awaitable, Callable, Hashable
 from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple, Self
 
 import aiohttp
 import yt_dlp
 import yt_dlp.utils
+from discord.ext import tasks
 
-from . import errors
+import utils
+
+from . import errors, quota
+from .cache import LRUCache
 
 YTDLP_OPTIONS = {
     "format": "bestaudio/best",
@@ -19,30 +35,655 @@ YTDLP_OPTIONS = {
     "geo-country": "JP",
     "max_results": 1,
 }
+PLAYLIST_OPTIONS = YTDLP_OPTIONS | {
+    "noplaylist": False,
+    "extract_flat": "in_playlist",
+    "lazy_playlist": True,
+}
+PLAYLIST_MAX_ENTRIES = int(os.getenv("PLAYLIST_MAX_ENTRIES", "200"))
 
 YOUTUBE_API_KEY = os.getenv("GOOGLE_API_KEY")
 YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3/search"
+YOUTUBE_VIDEOS_API_URL = "https://www.googleapis.com/youtube/v3/videos"
+YOUTUBE_VIDEOS_BATCH = 50
+YOUTUBE_REGION = "JP"
+
+RESOLVER_MIN_WORKERS = int(os.getenv("RESOLVER_MIN_WORKERS", "1"))
+RESOLVER_MAX_WORKERS = int(os.getenv("RESOLVER_MAX_WORKERS", "4"))
+RESOLVER_IDLE_TIMEOUT = 300
+RESOLVER_RETRY = 1
+
+STREAM_CACHE_ENTRIES = int(os.getenv("STREAM_CACHE_ENTRIES", "1024"))
+STREAM_CACHE_BYTES = int(os.getenv("STREAM_CACHE_BYTES", str(16 * 1024 * 1024)))
+STREAM_CACHE_MARGIN = 300
+STREAM_CACHE_TTL = 1800
+
+SEARCH_CACHE_ENTRIES = int(os.getenv("SEARCH_CACHE_ENTRIES", "512"))
+SEARCH_CACHE_BYTES = int(os.getenv("SEARCH_CACHE_BYTES", str(8 * 1024 * 1024)))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(6 * 60 * 60)))
+SEARCH_CACHE_NEGATIVE_TTL = int(os.getenv("SEARCH_CACHE_NEGATIVE_TTL", str(10 * 60)))
+VIDEO_CACHE_ENTRIES = 4096
+VIDEO_CACHE_TTL = 24 * 60 * 60
+
+HTTP_LIMIT = 100
+HTTP_LIMIT_PER_HOST = 20
+HTTP_DNS_CACHE_TTL = 300
+HTTP_KEEPALIVE_TIMEOUT = 60
+HTTP_TIMEOUT = 10
+
+YOUTUBE_HOSTS = ("youtube.com", "m.youtube.com", "music.youtube.com")
+YOUTUBE_VIDEO_ID = re.compile(r"^[0-9A-Za-z_-]{11}$")
+ISO_DURATION = re.compile(r"^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+TIMESTAMP = re.compile(r"^(?:(\d+)h)?(?:(\d+)m)?(?:(\d+(?:\.\d+)?)s?)?$")
+CLOCK_TIMESTAMP = re.compile(r"^(?:(?:(\d+):)?(\d+):)?(\d+(?:\.\d+)?)$")
+
+
+def parse_video_id(url: str) -> str | None:
+    parse = urllib.parse.urlparse(url.strip())
+    host = parse.netloc.lower().removeprefix("www.")
+    segments = [segment for segment in parse.path.split("/") if segment]
+
+    video_id = None
+    if host == "youtu.be" and segments:
+        video_id = segments[0]
+    elif host in YOUTUBE_HOSTS:
+        if parse.path == "/watch":
+            video_id = urllib.parse.parse_qs(parse.query).get("v", [None])[0]
+        elif len(segments) >= 2 and segments[0] in ("shorts", "live", "embed"):  # noqa: PLR2004
+            video_id = segments[1]
+
+    if video_id is not None and YOUTUBE_VIDEO_ID.match(video_id):
+        return video_id
+    return None
+
+
+def is_playlist(url: str) -> bool:
+    parse = urllib.parse.urlparse(url.strip())
+    host = parse.netloc.lower().removeprefix("www.")
+    if host != "youtu.be" and host not in YOUTUBE_HOSTS:
+        return False
+
+    playlist_id = urllib.parse.parse_qs(parse.query).get("list", [""])[0]
+    if not playlist_id:
+        return False
+    # 動画付きのプレイリストURLは動画単体として扱い、ミックスリストのみ展開する
+    return parse.path == "/playlist" or parse_video_id(url) is None or playlist_id.startswith("RD")
+
 
+def canonical_key(url: str) -> str:
+    video_id = parse_video_id(url)
+    if video_id is not None:
+        return f"youtube:{video_id}"
+    return url.strip()
 
-def _download(url: str) -> dict:
+
+def parse_duration(duration: str | None) -> int | None:
+    if duration is None:
+        return None
+    match = ISO_DURATION.match(duration)
+    if match is None:
+        return None
+    days, hours, minutes, seconds = (int(value or 0) for value in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def parse_timestamp(value: str) -> float | None:
+    value = value.strip().lower()
+    match = CLOCK_TIMESTAMP.match(value) or TIMESTAMP.match(value)  # 1:23:45 と 1h23m45s の両方に対応
+    if not value or match is None:
+        return None
+    hours, minutes, seconds = match.groups()
+    return (int(hours or 0) * 60 + int(minutes or 0)) * 60 + float(seconds or 0)
+
+
+def parse_start(url: str) -> float | None:
+    parse = urllib.parse.urlparse(url.strip())
+    query = urllib.parse.parse_qs(parse.query) | urllib.parse.parse_qs(parse.fragment)
+    for key in ("t", "start"):
+        if key in query:
+            return parse_timestamp(query[key][0])
+    return None
+
+
+def normalize_query(word: str) -> str:
+    word = unicodedata.normalize("NFKC", word)  # 全角英数・半角カナ・全角スペースを統一
+    return " ".join(word.casefold().split())
+
+
+def parse_expire(url: str | None) -> int | None:
+    if url is None:
+        return None
+    parse = urllib.parse.urlparse(url)
+    expire = urllib.parse.parse_qs(parse.query).get("expire")
+    if expire is None:
+        segments = parse.path.split("/")  # マニフェストURLはパスに有効期限を含む
+        if "expire" in segments and segments.index("expire") + 1 < len(segments):
+            expire = [segments[segments.index("expire") + 1]]
     try:
-        with yt_dlp.YoutubeDL(YTDLP_OPTIONS) as ydl:  # pyright: ignore[reportArgumentType]
-            info = ydl.extract_info(url, download=False)
-            info = ydl.sanitize_info(info)
+        return int(expire[0]) if expire else None
+    except ValueError:
+        return None
+
+
+class ResolvedInfo(NamedTuple):
+    video_id: str | None
+    title: str | None
+    webpage_url: str | None
+    uploader: str | None
+    uploader_url: str | None
+    thumbnail: str | None
+    duration: float | None
+    url: str | None
+    http_headers: dict[str, str]
+    cookies: str | None
+    extractor: str | None
+    expire: int | None
+    acodec: str | None
+    abr: float | None
+    asr: int | None
+    ext: str | None
+    protocol: str | None
+
+    @classmethod
+    def from_info(cls, info: dict) -> Self:
+        extractor = info.get("extractor")
+        uploader_url = info.get("uploader_url")
+        if extractor == "niconico":
+            uploader_id = info.get("uploader_id")
+            if uploader_id is not None and uploader_url is None:
+                uploader_url = f"https://www.nicovideo.jp/user/{uploader_id}"
+
+        url = info.get("url")
+        return cls(
+            video_id=info.get("id"),
+            title=info.get("title"),
+            webpage_url=info.get("webpage_url"),
+            uploader=info.get("uploader"),
+            uploader_url=uploader_url,
+            thumbnail=info.get("thumbnail"),
+            duration=info.get("duration"),
+            url=url,
+            http_headers=dict(info.get("http_headers") or {}),
+            cookies=info.get("cookies"),
+            extractor=extractor,
+            expire=parse_expire(url),
+            acodec=info.get("acodec"),
+            abr=info.get("abr"),
+            asr=info.get("asr"),
+            ext=info.get("ext"),
+            protocol=info.get("protocol"),
+        )
+
+    @property
+    def size(self) -> int:
+        strings = [field for field in self if isinstance(field, str)]
+        strings.extend([f"{key}{value}" for key, value in self.http_headers.items()])
+        return sum(map(len, strings))
+
+    def ttl(self, margin: float = STREAM_CACHE_MARGIN) -> float:
+        if self.expire is None:
+            return STREAM_CACHE_TTL
+        return self.expire - time.time() - margin - (self.duration or 0)  # 再生し終えるまで有効なURLのみ使う
+
+
+class VideoDetails(NamedTuple):
+    video_id: str
+    duration: int | None
+    blocked: bool
+
+    @classmethod
+    def from_info(cls, info: dict) -> Self:
+        details: dict = info.get("contentDetails", {})
+        restriction: dict = details.get("regionRestriction", {})
+        blocked = YOUTUBE_REGION in restriction.get("blocked", [])
+        if "allowed" in restriction:
+            blocked = blocked or YOUTUBE_REGION not in restriction["allowed"]
+        duration = parse_duration(details.get("duration")) or None  # ライブ配信は P0D になる
+        return cls(video_id=info["id"], duration=duration, blocked=blocked)
+
+
+class PlaylistEntry(NamedTuple):
+    title: str | None
+    url: str
+    uploader: str | None
+    uploader_url: str | None
+    thumbnail: str | None
+    duration: float | None
+
+    @classmethod
+    def from_info(cls, info: dict) -> Self | None:
+        url = info.get("url") or info.get("webpage_url")
+        if info.get("ie_key") == "Youtube" and info.get("id") is not None:
+            url = f"https://www.youtube.com/watch?v={info['id']}"
+        if url is None:
+            return None
+
+        thumbnails: list[dict] = info.get("thumbnails") or []
+        thumbnail = info.get("thumbnail") or (thumbnails[-1].get("url") if thumbnails else None)
+        return cls(
+            title=info.get("title"),
+            url=url,
+            uploader=info.get("channel") or info.get("uploader"),
+            uploader_url=info.get("channel_url") or info.get("uploader_url"),
+            thumbnail=thumbnail,
+            duration=info.get("duration"),
+        )
+
+
+@functools.cache
+def _get_ydl() -> yt_dlp.YoutubeDL:
+    return yt_dlp.YoutubeDL(YTDLP_OPTIONS)  # pyright: ignore[reportArgumentType]
+
+
+def _initialize() -> None:
+    _get_ydl()  # ワーカー起動時にYoutubeDLを生成しておく
+
+
+def _download(url: str) -> ResolvedInfo:
+    ydl = _get_ydl()
+    try:
+        info = ydl.extract_info(url, download=False)
     except yt_dlp.utils.DownloadError as e:
         raise errors.DownloadError(str(e)) from e
     except yt_dlp.utils.YoutubeDLError as e:
         raise errors.YouTubeDLPError(str(e)) from e
-    return info  # pyright: ignore[reportReturnType]
+    if info is None:
+        raise errors.DownloadError(f"No Information Extracted: {url}")
+    return ResolvedInfo.from_info(info)  # 必要な情報だけをプロセス間で受け渡す
+
+
+def _extract_playlist(url: str, push: Callable[[PlaylistEntry | None], object], stop: threading.Event) -> None:
+    ydl = yt_dlp.YoutubeDL(PLAYLIST_OPTIONS)  # pyright: ignore[reportArgumentType]
+    try:
+        info = ydl.extract_info(url, download=False, process=False)
+        while info is not None and info.get("_type") in ("url", "url_transparent"):
+            info = ydl.extract_info(info["url"], download=False, process=False, ie_key=info.get("ie_key"))
+        if info is None:
+            raise errors.DownloadError(f"No Information Extracted: {url}")
+
+        # entriesはページ単位で遅延取得されるため、取得できた順に受け渡す
+        for item in itertools.islice(info.get("entries") or [], PLAYLIST_MAX_ENTRIES):
+            if stop.is_set():
+                break
+            entry = PlaylistEntry.from_info(item)
+            if entry is not None:
+                push(entry)
+    except yt_dlp.utils.DownloadError as e:
+        raise errors.DownloadError(str(e)) from e
+    except yt_dlp.utils.YoutubeDLError as e:
+        raise errors.YouTubeDLPError(str(e)) from e
+    finally:
+        push(None)
+
+
+class ResolverWorker:
+    def __init__(self) -> None:
+        self.executor = ProcessPoolExecutor(max_workers=1, initializer=_initialize)
+        self.last_used = time.monotonic()
+
+    def warmup(self) -> None:
+        self.executor.submit(_initialize)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ResolverPool:
+    def __init__(
+        self,
+        *,
+        min_workers: int = RESOLVER_MIN_WORKERS,
+        max_workers: int = RESOLVER_MAX_WORKERS,
+        idle_timeout: float = RESOLVER_IDLE_TIMEOUT,
+    ) -> None:
+        self.min_workers = max(0, min_workers)
+        self.max_workers = max(1, self.min_workers, max_workers)
+        self.idle_timeout = idle_timeout
+        self._workers: set[ResolverWorker] = set()
+        self._idle: collections.deque[ResolverWorker] = collections.deque()
+        self._waiters: collections.deque[asyncio.Future[None]] = collections.deque()
+
+        self.resolves = utils.RateCounter()
+        self.failures = utils.RateCounter()
+        self.restarts = 0
+        self.queue_wait = utils.LatencyRecorder()
 
+    @property
+    def size(self) -> int:
+        return len(self._workers)
 
-async def download(url: str) -> dict:
+    @property
+    def busy(self) -> int:
+        return len(self._workers) - len(self._idle)
+
+    @property
+    def pending(self) -> int:
+        return sum(not waiter.done() for waiter in self._waiters)
+
+    def start(self) -> None:
+        utils.logger.debug(f"Starting Resolver Pool (Min: {self.min_workers}, Max: {self.max_workers})")
+        while len(self._workers) < self.min_workers:
+            worker = self._spawn()
+            worker.warmup()
+            self._idle.append(worker)
+        if not self.scale_down.is_running():
+            self.scale_down.start()
+
+    def shutdown(self) -> None:
+        utils.logger.debug(f"Shutting down Resolver Pool (Workers: {len(self._workers)})")
+        self.scale_down.cancel()
+        for worker in self._workers:
+            worker.shutdown()
+        self._workers.clear()
+        self._idle.clear()
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.cancel()
+        self._waiters.clear()
+
+    def _spawn(self) -> ResolverWorker:
+        worker = ResolverWorker()
+        self._workers.add(worker)
+        utils.logger.debug(f"Spawned Resolver Worker (Workers: {len(self._workers)}, Pending: {self.pending})")
+        return worker
+
+    def _discard(self, worker: ResolverWorker) -> None:
+        self._workers.discard(worker)
+        if worker in self._idle:
+            self._idle.remove(worker)
+        worker.shutdown()
+
+    def _wakeup(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def _acquire(self) -> ResolverWorker:
+        loop = asyncio.get_running_loop()
+        while not self._idle:
+            if len(self._workers) < self.max_workers:
+                return self._spawn()
+
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wakeup()
+                raise
+        return self._idle.pop()
+
+    def _replace(self, worker: ResolverWorker) -> None:
+        utils.logger.warning("Resolver Worker Crashed, Replacing")
+        self.restarts += 1
+        self._discard(worker)
+        if len(self._workers) < self.min_workers:
+            worker = self._spawn()
+            worker.warmup()
+            self._idle.append(worker)
+        self._wakeup()
+
+    def _release(self, worker: ResolverWorker, future: asyncio.Future[ResolvedInfo]) -> None:
+        if worker not in self._workers:
+            return
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._replace(worker)
+            return
+        worker.last_used = time.monotonic()
+        self._idle.append(worker)
+        self._wakeup()
+
+    async def _resolve(self, url: str) -> ResolvedInfo:
+        start = time.monotonic()
+        worker = await self._acquire()
+        self.queue_wait.record(time.monotonic() - start)
+
+        try:
+            submitted = worker.executor.submit(_download, url)
+        except BrokenProcessPool:
+            self._replace(worker)  # 待機中に終了したワーカーは投入時点で失敗する
+            raise
+        future = asyncio.wrap_future(submitted)
+        future.add_done_callback(functools.partial(self._release, worker))
+        return await asyncio.shield(future)  # キャンセルされてもワーカーは処理完了後に返却する
+
+    async def resolve(self, url: str) -> ResolvedInfo:
+        for retry in range(RESOLVER_RETRY + 1):
+            try:
+                info = await self._resolve(url)
+            except BrokenProcessPool as e:
+                self.failures.add()
+                if retry >= RESOLVER_RETRY:
+                    raise errors.YouTubeDLPError("Resolver Worker Crashed.") from e
+                continue
+            except errors.YouTubeDLPError:
+                self.failures.add()
+                raise
+            self.resolves.add()
+            return info
+        raise errors.YouTubeDLPError("Resolver Worker Crashed.")
+
+    @tasks.loop(seconds=60)
+    async def scale_down(self) -> None:
+        now = time.monotonic()
+        for worker in tuple(self._idle):
+            if len(self._workers) <= self.min_workers:
+                break
+            if now - worker.last_used < self.idle_timeout:
+                continue
+            self._discard(worker)
+            utils.logger.debug(f"Removed Idle Resolver Worker (Workers: {len(self._workers)})")
+
+    def stats(self) -> dict[str, str]:
+        return {
+            "Workers": f"{self.size} ({self.busy} busy, {self.min_workers}-{self.max_workers})",
+            "Pending": str(self.pending),
+            "Resolves": f"{self.resolves.total} ({self.resolves.rate:.2f}/s)",
+            "Failures": str(self.failures.total),
+            "Restarts": str(self.restarts),
+            "Queue Wait": (
+                f"avg {utils.format_seconds(self.queue_wait.mean)}, max {utils.format_seconds(self.queue_wait.max)}"
+            ),
+        }
+
+
+class SingleFlight[K: Hashable, V]:
+    def __init__(self) -> None:
+        self._calls: dict[K, asyncio.Task[V]] = {}
+        self._waiters: dict[K, int] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def _done(self, key: K, task: asyncio.Task[V]) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            self._waiters.pop(key, None)
+
+    async def do(self, key: K, func: Callable[[], Awaitable[V]]) -> V:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            task.add_done_callback(functools.partial(self._done, key))
+            self._calls[key] = task
+            self._waiters[key] = 0
+            self.leaders += 1
+        else:
+            self.followers += 1
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)  # 1人のキャンセルで共有中の処理を止めない
+        finally:
+            if self._calls.get(key) is task:
+                self._waiters[key] -= 1
+                if self._waiters[key] <= 0 and not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict[str, str]:
+        return {
+            "In Flight": str(len(self._calls)),
+            "Shared": f"{self.followers} / {self.leaders + self.followers}",
+        }
+
+
+class APISession:
+    def __init__(self) -> None:
+        self._session: aiohttp.ClientSession | None = None
+        self.requests = utils.RateCounter()
+        self.connections = 0
+        self.reused = 0
+        self.latency = utils.LatencyRecorder()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        self.start()
+        return self._session  # pyright: ignore[reportReturnType]
+
+    async def _on_connection_create(self, *_: object) -> None:
+        self.connections += 1
+
+    async def _on_connection_reuse(self, *_: object) -> None:
+        self.reused += 1
+
+    def start(self) -> None:
+        if self._session is not None and not self._session.closed:
+            return
+        utils.logger.debug("Starting API Session")
+
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(self._on_connection_create)
+        trace.on_connection_reuseconn.append(self._on_connection_reuse)
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_LIMIT,
+            limit_per_host=HTTP_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+            trace_configs=[trace],
+        )
+
+    async def close(self) -> None:
+        if self._session is None or self._session.closed:
+            return
+        utils.logger.debug("Closing API Session")
+        await self._session.close()
+        self._session = None
+
+    async def get_json(self, url: str) -> dict:
+        start = time.monotonic()
+        async with self.session.get(url) as res:
+            info: dict = await res.json()
+        self.latency.record(time.monotonic() - start)
+        self.requests.add()
+        return info
+
+    def stats(self) -> dict[str, str]:
+        total = self.connections + self.reused
+        reuse_rate = self.reused / total if total else 0.0
+        return {
+            "Requests": f"{self.requests.total} ({self.requests.rate:.2f}/s)",
+            "Connections": f"{self.connections} new, {self.reused} reused ({reuse_rate:.1%})",
+            "Latency": (
+                f"p50 {utils.format_seconds(self.latency.percentile(50))}, "
+                f"p95 {utils.format_seconds(self.latency.percentile(95))}"
+            ),
+        }
+
+
+POOL = ResolverPool()
+API_SESSION = APISession()
+FLIGHT: SingleFlight[str, ResolvedInfo] = SingleFlight()
+STREAM_CACHE: LRUCache[str, ResolvedInfo] = LRUCache(
+    max_entries=STREAM_CACHE_ENTRIES,
+    max_bytes=STREAM_CACHE_BYTES,
+    sizeof=lambda info: info.size,
+)
+SEARCH_CACHE: LRUCache[tuple[str, int, str], dict] = LRUCache(
+    max_entries=SEARCH_CACHE_ENTRIES,
+    max_bytes=SEARCH_CACHE_BYTES,
+    sizeof=lambda info: len(json.dumps(info)),
+)
+NO_RESULTS: dict = {}
+VIDEO_CACHE: LRUCache[str, VideoDetails] = LRUCache(max_entries=VIDEO_CACHE_ENTRIES)
+
+
+async def download(url: str) -> ResolvedInfo:
+    key = canonical_key(url)
+    info = STREAM_CACHE.get(key)
+    if info is not None:
+        utils.logger.debug(f"Stream Cache Hit (Key: {key})")
+        return info
+
+    return await FLIGHT.do(key, functools.partial(_resolve, key, url))
+
+
+async def _resolve(key: str, url: str) -> ResolvedInfo:
+    info = await POOL.resolve(url)
+    STREAM_CACHE.put(key, info, ttl=info.ttl())
+    return info
+
+
+def invalidate(url: str) -> None:
+    STREAM_CACHE.pop(canonical_key(url))
+
+
+async def validate(url: str, headers: dict[str, str]) -> bool:
+    try:
+        async with API_SESSION.session.head(url, headers=headers, allow_redirects=True) as res:
+            return res.ok
+    except (aiohttp.ClientError, TimeoutError):
+        return False
+
+
+async def playlist(url: str) -> AsyncGenerator[PlaylistEntry]:
     loop = asyncio.get_running_loop()
-    with ProcessPoolExecutor() as executor:
-        return await loop.run_in_executor(executor, _download, url)
+    entries: asyncio.Queue[PlaylistEntry | None] = asyncio.Queue()
+    stop = threading.Event()
+
+    def push(entry: PlaylistEntry | None) -> None:
+        with contextlib.suppress(RuntimeError):  # 終了時にイベントループが閉じられている場合
+            loop.call_soon_threadsafe(entries.put_nowait, entry)
+
+    def discard(future: asyncio.Future[None]) -> None:
+        # 途中で打ち切った場合は取得スレッドの例外を取り出して破棄する
+        if not future.cancelled() and future.exception() is not None:
+            utils.logger.debug(f"Playlist Extraction Stopped with Error (URL: {url}, Error: {future.exception()})")
+
+    utils.logger.debug(f"Extracting Playlist (URL: {url})")
+    future = loop.run_in_executor(None, _extract_playlist, url, push, stop)
+    try:
+        while (entry := await entries.get()) is not None:
+            yield entry
+        await future
+    finally:
+        stop.set()
+        future.add_done_callback(discard)
+
 
+async def search(
+    word: str,
+    *,
+    results: int = 1,
+    token: str = "",
+    priority: quota.Priority = quota.Priority.interactive,
+) -> dict:
+    key = (normalize_query(word), results, token)
+    info = SEARCH_CACHE.get(key)
+    if info is NO_RESULTS:
+        raise errors.SearchError("No results found.")
+    if info is not None:
+        utils.logger.debug(f"Search Cache Hit (Query: {key[0]})")
+        return info
 
-async def search(word: str, *, results: int = 1, token: str = "") -> dict:
     query = {
         "part": "snippet",
         "type": "video",
@@ -55,11 +696,53 @@ async def search(word: str, *, results: int = 1, token: str = "") -> dict:
     parse = parse._replace(query=urllib.parse.urlencode(query))
     url = urllib.parse.urlunparse(parse)
 
-    async with aiohttp.ClientSession() as session, session.get(url) as res:
-        info: dict = await res.json()
+    quota.YOUTUBE.charge(quota.Cost.youtube_search, priority)
+    try:
+        info = await API_SESSION.get_json(url)
+    except (aiohttp.ClientError, TimeoutError) as e:
+        raise errors.SearchError(str(e)) from e
     if "error" in info:
         error_info: dict = info["error"]
         raise errors.SearchError(error_info.get("message"))
     if "items" not in info or not isinstance(info["items"], list) or len(info["items"]) <= 0:
+        SEARCH_CACHE.put(key, NO_RESULTS, ttl=SEARCH_CACHE_NEGATIVE_TTL)
         raise errors.SearchError("No results found.")
+    SEARCH_CACHE.put(key, info, ttl=SEARCH_CACHE_TTL)
     return info
+
+
+async def videos(
+    video_ids: list[str],
+    *,
+    priority: quota.Priority = quota.Priority.interactive,
+) -> dict[str, VideoDetails]:
+    details: dict[str, VideoDetails] = {}
+    missing: list[str] = []
+    for video_id in dict.fromkeys(video_ids):
+        cached = VIDEO_CACHE.get(video_id)
+        if cached is not None:
+            details[video_id] = cached
+        else:
+            missing.append(video_id)
+
+    for i in range(0, len(missing), YOUTUBE_VIDEOS_BATCH):
+        batch = missing[i : i + YOUTUBE_VIDEOS_BATCH]  # videos.listは1回で最大50件まで取得できる
+        query = {"part": "contentDetails", "id": ",".join(batch), "key": YOUTUBE_API_KEY}
+        parse = urllib.parse.urlparse(YOUTUBE_VIDEOS_API_URL)
+        parse = parse._replace(query=urllib.parse.urlencode(query))
+        url = urllib.parse.urlunparse(parse)
+
+        quota.YOUTUBE.charge(quota.Cost.youtube_videos, priority)
+        try:
+            info = await API_SESSION.get_json(url)
+        except (aiohttp.ClientError, TimeoutError) as e:
+            raise errors.SearchError(str(e)) from e
+        if "error" in info:
+            error_info: dict = info["error"]
+            raise errors.SearchError(error_info.get("message"))
+
+        for item in info.get("items", []):
+            video = VideoDetails.from_info(item)
+            VIDEO_CACHE.put(video.video_id, video, ttl=VIDEO_CACHE_TTL)
+            details[video.video_id] = video
+    return details
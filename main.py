@@ -6,6 +6,7 @@ import dotenv
 from discord import Intents
 
 from ciel import Ciel
+from cluster import Coordinator
 
 if __name__ == "__main__":
     os.chdir(Path(__file__).parent)
@@ -14,9 +15,15 @@ if __name__ == "__main__":
     parser = ArgumentParser(description="Generic Discord Bot built with discord.py.")
     parser.add_argument("--sync", action="store_true", help="Sync Commands on Start-up.")
     parser.add_argument("--develop", action="store_true", help="Enable develop mode.")
+    parser.add_argument("--clusters", type=int, default=0, help="Spread shards across worker processes.")
     args = parser.parse_args()
 
     intents = Intents.default()
     intents.message_content = True
-    bot = Ciel(intents=intents, sync=getattr(args, "sync", False), develop=getattr(args, "develop", False))
-    bot.run()
+    sync = getattr(args, "sync", False)
+    develop = getattr(args, "develop", False)
+    if args.clusters > 0:
+        Coordinator(args.clusters, intents, sync=sync, develop=develop).run()
+    else:
+        bot = Ciel(intents=intents, sync=sync, develop=develop)
+        bot.run()
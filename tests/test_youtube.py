@@ -0,0 +1,38 @@
+import asyncio
+import os
+import signal
+import unittest
+from unittest import mock
+
+from cogs.music import youtube
+
+
+def fake_download(url: str) -> str:
+    return url  # ワーカープロセスで実行されるため、ネットワークに接続せずに結果を返す
+
+
+class ResolverPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        patcher = mock.patch.object(youtube, "_download", fake_download)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = youtube.ResolverPool(min_workers=1, max_workers=1)
+        self.pool.start()
+        self.addCleanup(self.pool.shutdown)
+
+    async def test_resolve_after_idle_worker_killed(self) -> None:
+        self.assertEqual(await self.pool.resolve("first"), "first")
+
+        (worker,) = self.pool._workers  # noqa: SLF001
+        for pid in list(worker.executor._processes):  # noqa: SLF001
+            os.kill(pid, signal.SIGKILL)
+        await asyncio.sleep(0.5)  # 待機中のワーカーの終了をExecutorが検知するまで待つ
+
+        self.assertEqual(await asyncio.wait_for(self.pool.resolve("second"), 30), "second")
+        self.assertEqual(self.pool.restarts, 1)
+        self.assertEqual(self.pool.size, 1)
+        self.assertEqual(self.pool.busy, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,4 +4,5 @@ from .decorators import *
 from .embed import *
 from .errors import *
 from .logging import *
+from .metrics import *
 from .view import *
@@ -1,5 +1,7 @@
 import logging
+import logging.handlers
 import os
+from multiprocessing.queues import Queue
 from pathlib import Path
 
 from discord import utils
@@ -31,3 +33,33 @@ def setup_logging(develop: bool = False) -> None:
     handler = logging.StreamHandler()
     handler.addFilter(CustomFilter(level))
     utils.setup_logging(handler=handler, level=logging.DEBUG)
+
+
+class ClusterQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, queue: Queue, prefix: str) -> None:
+        super().__init__(queue)
+        self.prefix = prefix
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)  # 例外情報も含めて文字列化される
+        record.msg = f"[{self.prefix}] {record.msg}"
+        return record
+
+
+class ForwardHandler(logging.Handler):
+    def emit(self, record: logging.LogRecord) -> None:
+        logging.getLogger(record.name).handle(record)
+
+
+def setup_cluster_logging(queue: Queue, prefix: str, develop: bool = False) -> None:
+    handler = ClusterQueueHandler(queue, prefix)
+    handler.addFilter(CustomFilter(logging.DEBUG if develop else logging.INFO))
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    root.addHandler(handler)
+
+
+def listen_cluster_logging(queue: Queue) -> logging.handlers.QueueListener:
+    listener = logging.handlers.QueueListener(queue, ForwardHandler())
+    listener.start()
+    return listener
@@ -0,0 +1,101 @@
+import bisect
+import collections
+import time
+from collections.abc import Iterable
+
+RATE_WINDOW = 60
+LATENCY_SAMPLES = 1024
+HISTOGRAM_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5)
+
+
+class RateCounter:
+    def __init__(self, window: float = RATE_WINDOW) -> None:
+        self.window = window
+        self.total = 0
+        self._events: collections.deque[float] = collections.deque()
+
+    def _trim(self, now: float) -> None:
+        while self._events and self._events[0] < now - self.window:
+            self._events.popleft()
+
+    def add(self) -> None:
+        now = time.monotonic()
+        self.total += 1
+        self._events.append(now)
+        self._trim(now)
+
+    @property
+    def rate(self) -> float:
+        self._trim(time.monotonic())
+        return len(self._events) / self.window
+
+
+class LatencyRecorder:
+    def __init__(self, size: int = LATENCY_SAMPLES) -> None:
+        self.count = 0
+        self.max = 0.0
+        self._samples: collections.deque[float] = collections.deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.max = max(self.max, seconds)
+        self._samples.append(seconds)
+
+    @property
+    def mean(self) -> float:
+        if not self._samples:
+            return 0.0
+        return sum(self._samples) / len(self._samples)
+
+    def percentile(self, percent: float) -> float:
+        if not self._samples:
+            return 0.0
+        samples = sorted(self._samples)
+        index = min(len(samples) - 1, int(len(samples) * percent / 100))
+        return samples[index]
+
+
+class Histogram:
+    def __init__(self, bounds: Iterable[float] = HISTOGRAM_BOUNDS) -> None:
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)  # 最後の要素は上限を超えた値
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent: float) -> float:
+        # バケットの上限値で近似する
+        if not self.count:
+            return 0.0
+        target = self.count * percent / 100
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts, strict=False):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.max
+
+    def format(self) -> str:
+        if not self.count:
+            return "No Data"
+        labels = [f"≤{format_seconds(bound)}" for bound in self.bounds]
+        labels.append(f">{format_seconds(self.bounds[-1])}")
+        return ", ".join(
+            f"{label} {count / self.count:.1%}" for label, count in zip(labels, self.counts, strict=True) if count
+        )
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1000:.1f} ms"
+    return f"{seconds:.2f} s"